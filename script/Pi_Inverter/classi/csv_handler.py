@@ -7,9 +7,21 @@
 # Importazione delle librerie necessarie
 import csv          # Importa il modulo per gestire i file CSV (valori separati da virgola)
 import os           # Importa il modulo per interagire con il sistema operativo
+import sys          # Importa il modulo per modificare il percorso di ricerca dei moduli
 from datetime import datetime, timedelta     # Importa le classi per gestire date, orari e intervalli di tempo
 from sense_hat import SenseHat              # Importa la classe per interagire con il sensore SenseHat del Raspberry Pi
 
+# Rende importabili i moduli di Pi_Inverter_v2 (cartella sorella) usati qui: solo libreria standard
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from Pi_Inverter_v2.core.day_index import DayIndex   # Indice sidecar giorno -> intervallo di byte del CSV
+from Pi_Inverter_v2.core.csv_engine import CsvEngine, stream_cleanup   # Pulizia CSV in streaming e lettura in array
+from Pi_Inverter_v2.core.archive_segments import SegmentArchive, archive_dir   # Archivio compresso a segmenti mensili
+from Pi_Inverter_v2.core.series import Series   # Serie compatta su array (epoch, valori) con viste senza copie
+from Pi_Inverter_v2.core.tail_follower import TailFollower   # Lettura incrementale: solo le righe nuove a ogni ciclo
+
+# Codici di qualita delle letture fallite nella colonna finale (S=STALE, F=FAILED)
+BAD_FLAGS = ('S', 'F')
+
 class CSVHandler:
     """
     Classe per gestire le operazioni sui file CSV che contengono i dati dell'inverter.
@@ -26,6 +38,8 @@ class CSVHandler:
             csv_filepath (str): Il percorso completo del file CSV da gestire
         """
         self.csv_filepath = csv_filepath     # Memorizza il percorso del file CSV come attributo della classe
+        self.day_index = DayIndex(csv_filepath)  # Indice dei giorni per leggere un solo giorno con un seek
+        self.follower = TailFollower(CsvEngine(csv_filepath))  # Serie gia letta + offset e inode del file
         self.sense = SenseHat()              # Crea un oggetto SenseHat per mostrare messaggi sul display
         self.sense.set_rotation(180)         # Ruota il display di 180 gradi per visualizzare correttamente i messaggi
         self.RED = (255, 0, 0)               # Definisce il colore rosso in formato RGB (per messaggi di errore)
@@ -47,6 +61,9 @@ class CSVHandler:
                     reader = csv.reader(f)   # Crea un lettore CSV per processare il file
                     for row in reader:       # Itera su ogni riga del file CSV
                         if len(row) >= 2:    # Verifica che la riga abbia almeno 2 colonne (timestamp e power)
+                            # Salta le letture fallite (S=STALE, F=FAILED nella colonna finale)
+                            if len(row) > 2 and row[-1] in BAD_FLAGS:
+                                continue
                             try:
                                 # Converte la stringa del timestamp in un oggetto datetime
                                 ts = datetime.strptime(row[0], "%Y_%m_%d_%H:%M")
@@ -63,6 +80,25 @@ class CSVHandler:
                                      text_colour=self.RED, scroll_speed=0.03)
         return data  # Restituisce la lista di tuple (timestamp, power)
 
+    def read_series(self):
+        """
+        Legge il file CSV in una Series compatta (array di epoch e di potenze, 16 byte per lettura).
+        Solo la prima chiamata legge tutto il file: le successive leggono le righe
+        aggiunte dopo l'ultimo offset letto (da capo se il cleanup ha sostituito il file).
+
+        Returns:
+            Series: iterandola si ottengono le potenze (come [p for _, p in read_csv_data()]),
+                    items() restituisce le coppie (timestamp, power)
+        """
+        try:
+            # Legge solo le righe nuove e le accoda agli array gia in memoria
+            return self.follower.refresh()
+        except Exception as e:
+            # Se si verifica un errore durante la lettura del file, mostra un messaggio sul display
+            self.sense.show_message("Errore nella lettura del CSV", 
+                                 text_colour=self.RED, scroll_speed=0.03)
+        return Series()  # Serie vuota in caso di errore
+
     def append_to_csv(self, timestamp, power):
         """
         Aggiunge una nuova riga con timestamp e power al file CSV.
@@ -74,8 +110,12 @@ class CSVHandler:
         try:
             # Apre il file in modalità append (aggiunta) con codifica UTF-8
             with open(self.csv_filepath, "a", newline="", encoding="utf-8") as f:
+                start = f.tell()             # Posizione di inizio della nuova riga
                 writer = csv.writer(f)       # Crea uno scrittore CSV
                 writer.writerow([timestamp, power])  # Scrive una nuova riga con timestamp e power
+                end = f.tell()               # Posizione di fine della nuova riga
+            # Aggiorna l'indice dei giorni in modo incrementale
+            self.day_index.note_append(start, end, timestamp)
         except Exception as e:
             # Se si verifica un errore durante la scrittura, mostra un messaggio sul display
             self.sense.show_message("Errore nella scrittura sul CSV", 
@@ -85,48 +125,71 @@ class CSVHandler:
         """
         Rimuove dal file CSV tutti i dati più vecchi di un anno.
         
-        Questo metodo legge l'intero file, filtra i dati mantenendo solo quelli più recenti
-        di un anno, e poi riscrive il file con i dati filtrati.
+        Usa la pulizia in streaming di Pi_Inverter_v2: trova il punto di taglio per
+        bisezione, comprime i dati vecchi nei segmenti mensili dell'archivio
+        (logs/archive/<serie>/YYYY-MM.csv.gz) e copia i recenti a blocchi (byte per
+        byte, terminatori di riga inclusi) in un file temporaneo che sostituisce il
+        CSV con un rename atomico (memoria costante, il CSV non viene mai troncato).
+        L'indice dei giorni viene riallineato al file ruotato, senza ricostruirlo.
         """
         # Calcola la data limite (un anno fa rispetto ad oggi)
         threshold_date = datetime.now() - timedelta(days=365)
-        # Legge tutti i dati dal file CSV
-        data = self.read_csv_data()
-        # Filtra i dati, mantenendo solo quelli con timestamp successivo alla data limite
-        filtered_data = [(ts, power) for ts, power in data if ts >= threshold_date]
-        # Archivia i dati vecchi prima di cancellarli
-        old_data = [(ts, power) for ts, power in data if ts < threshold_date]
-        if old_data:
-            archive_path = self.csv_filepath.replace(".csv", "_archive.csv")
-            try:
-                with open(archive_path, "a", newline="", encoding="utf-8") as f:
-                    writer = csv.writer(f)
-                    for ts, power in old_data:
-                        writer.writerow([ts.strftime("%Y_%m_%d_%H:%M"), power])
-                print(f"Archiviati {len(old_data)} record in {archive_path}")
-            except Exception as e:
-                print(f"Errore nell'archiviazione: {e}")
+        # Archivio compresso in cui accodare i dati vecchi (un blocco gzip per giorno)
+        archive = SegmentArchive(archive_dir(self.csv_filepath))
         try:
-            # Apre il file in modalità scrittura (sovrascrive il contenuto esistente)
-            with open(self.csv_filepath, "w", newline="", encoding="utf-8") as f:
-                writer = csv.writer(f)  # Crea uno scrittore CSV
-                # Scrive ogni tupla filtrata nel file
-                for ts, power in filtered_data:
-                    writer.writerow([ts.strftime("%Y_%m_%d_%H:%M"), power])
+            # Pulizia in streaming con sostituzione atomica del file (stampa byte spostati e durata)
+            stream_cleanup(self.csv_filepath, threshold_date, archive=archive, day_index=self.day_index)
             # Mostra un messaggio di successo sul display
             self.sense.show_message("Cleanup CSV completato", 
                                  text_colour=self.GREEN, scroll_speed=0.03)
+        except FileNotFoundError:
+            pass                             # Nessun file: nulla da pulire
         except Exception as e:
             # Se si verifica un errore durante la pulizia, mostra un messaggio sul display
+            print(f"Errore durante il cleanup del CSV: {e}")
             self.sense.show_message("Errore durante il cleanup del CSV", 
                                  text_colour=self.RED, scroll_speed=0.03)
 
     def _percentile(self, values, pct):
         """Calcola il percentile di una lista di valori."""
+        if hasattr(values, 'percentile'):
+            return values.percentile(pct)   # Series: selezione parziale, senza ordinare una copia
         sorted_vals = sorted(values)
         idx = int(len(sorted_vals) * pct / 100)
         return sorted_vals[min(idx, len(sorted_vals) - 1)]
 
+    def read_day_data(self, target_date):
+        """
+        Legge solo le righe di un giorno usando l'indice dei giorni (un seek, nessuna scansione).
+        L'indice copre anche le righe fuori ordine (orologio spostato a mano).
+
+        Args:
+            target_date (date): Il giorno da leggere
+
+        Returns:
+            list: Lista di tuple (timestamp, power) del giorno richiesto
+        """
+        data = []                            # Inizializza la lista dei dati del giorno
+        try:
+            # Legge dal CSV solo l'intervallo di byte del giorno indicato dall'indice
+            for line in self.day_index.read_day_lines(target_date):
+                parts = line.split(",")      # Separa timestamp, potenza ed eventuale flag
+                # Salta le letture fallite (codice di qualita S/F nella colonna finale)
+                if len(parts) > 2 and parts[-1] in BAD_FLAGS:
+                    continue
+                try:
+                    # Converte timestamp e potenza come in read_csv_data
+                    data.append((datetime.strptime(parts[0], "%Y_%m_%d_%H:%M"), float(parts[1])))
+                except Exception:
+                    # Riga non valida: la salta
+                    continue
+        except FileNotFoundError:
+            pass                             # Nessun file: nessun dato del giorno
+        except Exception as e:
+            # Se l'indice o il file non sono leggibili, restituisce una lista vuota
+            print(f"Errore nella lettura del giorno {target_date} dal CSV: {e}")
+        return data  # Restituisce le tuple (timestamp, power) del giorno
+
     def get_day_power_chart(self, num_bars=8, day_start_hour=6, day_end_hour=20):
         """
         Calcola i valori per creare un grafico a barre che rappresenta la potenza durante il giorno.
@@ -142,20 +205,20 @@ class CSVHandler:
         Returns:
             list: Una lista di valori (da 0 a 8) che rappresentano l'altezza di ciascuna barra del grafico
         """
-        # Legge tutti i dati dal file CSV
-        all_data = self.read_csv_data()
+        # Legge tutti i dati dal file CSV in una Series compatta (solo le righe nuove dall'ultima lettura)
+        all_powers = self.read_series()
         # Ottiene la data e ora corrente
         now = datetime.now()
         # Determina la data target: se è prima dell'ora di inizio, usa il giorno precedente
         target_date = now.date() if now.hour >= day_start_hour else (now - timedelta(days=1)).date()
 
         # Calcola il 98° percentile dei valori positivi storici (ignora spike anomali)
-        positive_values = [power for _, power in all_data if power > 0]
+        positive_values = all_powers.positive()   # Vista dei soli valori positivi (nessuna copia)
         historical_max = self._percentile(positive_values, 98) if positive_values else 1
 
-        # Filtra i dati per ottenere solo quelli del giorno target e con potenza positiva
-        daylight_data = [(ts, power) for ts, power in all_data
-                        if ts.date() == target_date and power > 0]
+        # Legge solo il giorno target tramite l'indice e tiene le potenze positive
+        daylight_data = [(ts, power) for ts, power in self.read_day_data(target_date)
+                        if power > 0]
         
         # Se non ci sono dati per il giorno, restituisce un grafico vuoto (tutte barre a 0)
         if not daylight_data:
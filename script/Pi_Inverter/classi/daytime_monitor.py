@@ -52,8 +52,8 @@ class DaytimeMonitor:
         self.grid_csv_handler.append_to_csv(timestamp, grid_power)
 
         # Calcola i livelli per la visualizzazione
-        solar_historical = [p for _, p in self.csv_handler.read_csv_data()]
-        grid_historical = [p for _, p in self.grid_csv_handler.read_csv_data()]
+        solar_historical = self.csv_handler.read_series()
+        grid_historical = self.grid_csv_handler.read_series()
 
         solar_level = self.led_controller.calculate_level(solar_power, solar_historical)
         grid_level = self.led_controller.calculate_level(grid_power, grid_historical)
@@ -159,6 +159,8 @@ class LEDController:
 
     def _percentile(self, values, pct):
         """Calcola il percentile di una lista di valori."""
+        if hasattr(values, 'percentile'):
+            return values.percentile(pct)   # Series: selezione parziale, senza ordinare una copia
         sorted_vals = sorted(values)
         idx = int(len(sorted_vals) * pct / 100)
         return sorted_vals[min(idx, len(sorted_vals) - 1)]
@@ -169,8 +171,13 @@ class LEDController:
             return 8 if current_power > 0 else 0
 
         # Separa i valori positivi e negativi dalla storia
-        positive_values = [x for x in historical_values if x >= 0]
-        negative_values = [x for x in historical_values if x < 0]
+        if hasattr(historical_values, 'non_negative'):
+            # Series di Pi_Inverter_v2: viste filtrate per segno, nessuna copia dei dati
+            positive_values = historical_values.non_negative()
+            negative_values = historical_values.negative()
+        else:
+            positive_values = [x for x in historical_values if x >= 0]
+            negative_values = [x for x in historical_values if x < 0]
 
         if current_power >= 0:
             if not positive_values:
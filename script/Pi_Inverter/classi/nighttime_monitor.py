@@ -76,7 +76,7 @@ class NighttimeMonitor:
         self.led_controller.current_grid_power = grid_power
 
         # Ottieni i dati storici della rete
-        grid_historical = [p for _, p in self.grid_csv_handler.read_csv_data()]
+        grid_historical = self.grid_csv_handler.read_series()
 
         # Calcola il livello della barra (1-8) rispetto ai valori storici
         grid_level = self.led_controller.calculate_level(grid_power, grid_historical)
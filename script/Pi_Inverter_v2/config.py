@@ -29,6 +29,10 @@ DAY_START_HOUR = 6              # Inizio periodo diurno (06:00)
 DAY_END_HOUR = 20               # Fine periodo diurno (20:00)
 DAILY_YIELD_HOURS = [20, 21, 22]  # Ore di aggiornamento daily yield
 
+# -------------------- SCALA STORICA E INDICI --------------------
+SKETCH_K = 200                  # Precisione sketch KLL (errore di rango ~1%)
+SIDECAR_SAVE_INTERVAL = 600     # Secondi minimi tra due salvataggi di sketch/indici accanto ai CSV
+
 # -------------------- COLORI LED --------------------
 RED = (255, 0, 0)
 GREEN = (0, 255, 0)
@@ -44,8 +48,84 @@ _LOGS_DIR = os.path.join(_DATA_DIR, "logs")
 SOLAR_CSV = os.path.join(_LOGS_DIR, "power_log.csv")
 GRID_CSV = os.path.join(_LOGS_DIR, "power_cons_log.csv")
 DAILY_ENERGY_JSON = os.path.join(_DATA_DIR, "last_daily_energy.json")
+DAILY_YIELD_HISTORY_CSV = os.path.join(_DATA_DIR, "daily_yield_history.csv")
 NETWORK_WATCHDOG_LOG = os.path.join(_LOGS_DIR, "network_watchdog.log")
 
+# -------------------- STORAGE SERIE --------------------
+# 'csv': file testuali storici (default) | 'binary': record fissi <nome>.bin letti via mmap
+# 'partitioned': partizioni mensili logs/<nome>/YYYY-MM.csv, retention per mese intero
+# 'sqlite': database SQLite in WAL logs/series.db (tutte le serie, scritture a batch)
+# 'wide': un solo file logs/readings.csv, una riga per ciclo con tutti i canali (vedi WIDE_CHANNELS)
+# Migrazione: python3 Pi_Inverter_v2/storage_tools.py csv-to-bin|csv-to-partitions|csv-to-sqlite <file.csv>
+#             python3 Pi_Inverter_v2/storage_tools.py csv-to-wide (unisce le serie di WIDE_CHANNELS)
+# Confronto A/B: python3 Pi_Inverter_v2/storage_tools.py bench <file.csv>
+STORAGE_BACKEND = 'csv'
+BINARY_VALUE_FORMAT = 'd'       # 'd' = float64 (lossless), 'f' = float32 (solo interi fino a 2^24)
+SQLITE_DB = os.path.join(_LOGS_DIR, "series.db")
+SQLITE_BATCH_SIZE = 10          # Letture per serie raccolte in RAM prima di una transazione
+SQLITE_FLUSH_INTERVAL = 600     # Secondi massimi di attesa di un batch incompleto
+# Colonna opzionale con l'epoch UTC reale ('YYYY_MM_DD_HH:MM,value,epoch'): distingue
+# l'ora ripetuta al ritorno all'ora solare. CSV esistenti: storage_tools.py epoch-column <file.csv>
+CSV_EPOCH_COLUMN = False
+WIDE_CSV = os.path.join(_LOGS_DIR, "readings.csv")
+WIDE_CHANNELS = {               # Serie logica -> canale (colonna) del file wide
+    SOLAR_CSV: 'solar_w',
+    GRID_CSV: 'grid_kw',
+}
+
+# -------------------- RISOLUZIONI CONSOLIDATE --------------------
+# Stile RRD: letture al minuto per TIER_RAW_DAYS giorni (poi nell'archivio compresso),
+# consolidati min/max/mean/last aggiornati a ogni lettura in logs/tiers/<serie>/<livello>.csv
+# Attivazione su uno storico esistente: python3 Pi_Inverter_v2/storage_tools.py tiers <file.csv>
+TIERS_ENABLED = False
+TIER_RAW_DAYS = 90              # Retention delle letture al minuto con i livelli attivi
+TIERS = (                       # (livello, secondi per intervallo, giorni di retention o None = sempre)
+    ('15m', 900, 365),
+    ('1h', 3600, None),
+)
+TIER_MAX_POINTS = 5000          # Punti massimi di read_consolidated con livello automatico
+
+# -------------------- WRITE-BEHIND --------------------
+# Letture tenute in RAM (+ journal su tmpfs per il replay dopo un crash) e scritte
+# sulla SD a blocchi ogni WRITE_BEHIND_FLUSH_MINUTES minuti e all'arresto
+WRITE_BEHIND_ENABLED = False
+WRITE_BEHIND_FLUSH_MINUTES = 15
+WRITE_BEHIND_JOURNAL_DIR = "/dev/shm/pi_inverter_journal"   # None = solo RAM (nessun replay)
+
+# -------------------- LETTURE DUPLICATE --------------------
+# Scrittura idempotente per (serie, minuto): un riavvio nello stesso minuto non duplica la
+# riga. Indice in RAM degli ultimi DEDUP_RECENT_KEYS minuti, inizializzato dalla coda del file.
+# Storici esistenti: python3 Pi_Inverter_v2/storage_tools.py dedup <file.csv|file.bin|partizioni>
+DEDUP_ENABLED = True
+DEDUP_RECENT_KEYS = 1440        # Letture ricordate per serie (un giorno a POLL_INTERVAL di 60 s)
+
+# -------------------- QUALITA LETTURE --------------------
+# Letture Modbus fallite salvate con un codice di qualita (CSV: colonna finale ',F') ed
+# escluse da medie, percentili, sketch e grafici. Con QUALITY_HOLD_SECONDS > 0 una lettura
+# fallita entro quel tempo dall'ultima buona ripete quel valore (',S' = STALE) invece di 0.
+# Finestre di disservizio: python3 Pi_Inverter_v2/storage_tools.py quality <file.csv>
+QUALITY_HOLD_SECONDS = 0
+
+# -------------------- INTEGRITA FILE --------------------
+# All'avvio si controlla solo la coda dei file delle serie dopo l'ultimo offset
+# buono registrato (arresto pulito o mezzanotte): righe troncate/NUL rimosse
+INTEGRITY_STATE_JSON = os.path.join(_LOGS_DIR, "integrity_state.json")
+RECOVERY_REPORT_LOG = os.path.join(_LOGS_DIR, "recovery_report.jsonl")
+RECOVERY_TAIL_BYTES = 65536     # Byte massimi controllati per file (~3000 righe)
+
+# -------------------- CACHE SERIE IN MEMORIA --------------------
+SERIES_CACHE_ENABLED = True     # Letture servite da buffer in RAM invece che dal disco
+SERIES_CACHE_DAYS = 400         # Capacita del buffer per serie (giorni a risoluzione POLL_INTERVAL)
+TAIL_FOLLOW_ENABLED = True      # Serie intera fuori cache: lette solo le righe nuove dall'ultima lettura
+
+# -------------------- CALCOLO VETTORIALE --------------------
+NUMPY_ENABLED = True            # Grafico giornaliero con NumPy se installato (fallback Python puro)
+
+# -------------------- LAVORI BULK --------------------
+# Ricostruzioni e report su piu anni (storage_tools.py rebuild|report) divisi tra processi
+PARALLEL_WORKERS = None         # Processi della scansione parallela (None = tutti i core)
+PARALLEL_MIN_BYTES = 8 * 1024 * 1024  # Sotto questa dimensione lo sketch si ricostruisce in seriale
+
 # -------------------- SERVICE SYSTEMD --------------------
 SERVICE_FILE_PATH = "/etc/systemd/system/rbp4_8gb_inverter.service"
 SERVICE_NAME = "rbp4_8gb_inverter.service"
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Archivio compresso delle serie: un segmento per mese (YYYY-MM.csv.gz) fatto
+di blocchi gzip indipendenti concatenati (uno per giorno, il file resta
+leggibile con zcat) e un indice YYYY-MM.idx.json con, per ogni blocco,
+[primo ts, ultimo ts, offset, lunghezza compressa, righe, byte originali].
+Una lettura per intervallo decomprime solo i blocchi che lo intersecano.
+
+File: logs/archive/<serie>/YYYY-MM.csv.gz (+ .idx.json)
+"""
+
+import gzip
+import json
+import os
+import re
+
+from .file_utils import fsync_dir
+from .quality import row_value
+from .timestamps import line_epoch, epoch_to_datetime
+
+_SEGMENT_RE = re.compile(r'^(\d{4})-(\d{2})\.csv\.gz$')
+
+# Campi di una voce dell'indice blocchi
+FIRST_TS, LAST_TS, OFFSET, LENGTH, ROWS, RAW_BYTES = range(6)
+
+
+def archive_dir(filepath):
+    """Directory dell'archivio della serie (logs/power_log.csv -> logs/archive/power_log/)."""
+    series = os.path.splitext(os.path.basename(filepath))[0]
+    return os.path.join(os.path.dirname(filepath), 'archive', series)
+
+
+class SegmentArchive:
+    """Segmenti mensili compressi di una serie, con indice blocchi per segmento."""
+
+    def __init__(self, directory, compresslevel=9):
+        self.directory = directory
+        self.compresslevel = compresslevel
+
+    def _paths(self, month):
+        return (os.path.join(self.directory, f'{month}.csv.gz'),
+                os.path.join(self.directory, f'{month}.idx.json'))
+
+    def segment_path(self, month):
+        """Path del segmento compresso del mese 'YYYY-MM'."""
+        return self._paths(month)[0]
+
+    def segment_months(self):
+        """Mesi 'YYYY-MM' archiviati, in ordine cronologico."""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(name[:7] for name in names if _SEGMENT_RE.match(name))
+
+    def load_index(self, month):
+        """Voci dell'indice blocchi del segmento (lista vuota se assente)."""
+        try:
+            with open(self._paths(month)[1], 'r') as f:
+                return json.load(f)['blocks']
+        except FileNotFoundError:
+            return []
+
+    def _save_index(self, month, blocks):
+        index_path = self._paths(month)[1]
+        tmp_path = index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'blocks': blocks}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, index_path)
+
+    def append_lines(self, lines):
+        """
+        Archivia righe CSV (bytes, ordinate per tempo) raggruppandole in un blocco
+        per giorno nel segmento del loro mese. Righe senza timestamp valido scartate.
+        Ritorna (righe archiviate, righe scartate).
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        writer = _SegmentWriter(self)
+        day_epochs = {}
+        block = []
+        block_day = None
+        first = last = None
+        archived = skipped = 0
+        try:
+            for line in lines:
+                if not line.endswith(b'\n'):
+                    line += b'\n'
+                epoch = line_epoch(line, day_epochs)
+                if epoch is None:
+                    skipped += 1
+                    continue
+                day = line[:10]
+                if day != block_day and block:
+                    writer.write_block(block_day, block, first, last)
+                    block = []
+                if not block:
+                    block_day = day
+                    first = epoch
+                block.append(line)
+                last = epoch
+                archived += 1
+            if block:
+                writer.write_block(block_day, block, first, last)
+        finally:
+            writer.close()
+        fsync_dir(self.directory)
+        return archived, skipped
+
+    def iter_rows(self, start=None, end=None, column=0, reverse=False):
+        """
+        Iteratore in streaming sulle coppie (epoch, value) archiviate con
+        start <= epoch < end: legge e decomprime solo i blocchi che intersecano.
+        column e l'indice del valore dopo il timestamp (righe wide multi-canale);
+        le righe con il campo vuoto o mancante e le letture STALE/FAILED vengono saltate.
+        Con reverse=True mesi, blocchi e righe sono percorsi dal piu recente.
+        """
+        day_epochs = {}
+        months = self.segment_months()
+        if start is not None:
+            months = [m for m in months if m >= epoch_to_datetime(start).strftime('%Y-%m')]
+        if end is not None:
+            months = [m for m in months if m <= epoch_to_datetime(end - 1).strftime('%Y-%m')]
+        if reverse:
+            months.reverse()
+        for month in months:
+            blocks = [b for b in self.load_index(month)
+                      if (start is None or b[LAST_TS] >= start) and (end is None or b[FIRST_TS] < end)]
+            if not blocks:
+                continue
+            if reverse:
+                blocks.reverse()
+            with open(self._paths(month)[0], 'rb') as f:
+                for block in blocks:
+                    f.seek(block[OFFSET])
+                    lines = gzip.decompress(f.read(block[LENGTH])).split(b'\n')
+                    for line in (reversed(lines) if reverse else lines):
+                        epoch = line_epoch(line, day_epochs)
+                        if epoch is None or (start is not None and epoch < start) \
+                                or (end is not None and epoch >= end):
+                            continue
+                        value = row_value(line, column)
+                        if value is not None:
+                            yield epoch, value
+
+    def drop_from(self, epoch):
+        """
+        Toglie dall'archivio i blocchi con prima lettura >= epoch, cioe gli
+        ultimi accodati (l'archivio e in ordine di tempo): annulla il cleanup
+        di una rotazione scartata. Ritorna le righe tolte.
+        """
+        first_month = epoch_to_datetime(epoch).strftime('%Y-%m')
+        dropped = 0
+        for month in reversed(self.segment_months()):
+            if month < first_month:
+                break
+            blocks = self.load_index(month)
+            keep = 0
+            while keep < len(blocks) and blocks[keep][FIRST_TS] < epoch:
+                keep += 1
+            if keep == len(blocks):
+                continue
+            dropped += sum(block[ROWS] for block in blocks[keep:])
+            data_path, index_path = self._paths(month)
+            if keep:
+                # Prima l'indice: i byte oltre l'ultimo blocco indicizzato non sono mai letti
+                self._save_index(month, blocks[:keep])
+                with open(data_path, 'r+b') as f:
+                    f.truncate(blocks[keep - 1][OFFSET] + blocks[keep - 1][LENGTH])
+            else:
+                os.remove(index_path)
+                os.remove(data_path)
+        if dropped:
+            fsync_dir(self.directory)
+        return dropped
+
+    def stats(self):
+        """Segmenti, righe e byte originali/compressi dell'archivio."""
+        stats = {'segments': 0, 'rows': 0, 'raw_bytes': 0, 'compressed_bytes': 0}
+        for month in self.segment_months():
+            stats['segments'] += 1
+            for block in self.load_index(month):
+                stats['rows'] += block[ROWS]
+                stats['raw_bytes'] += block[RAW_BYTES]
+                stats['compressed_bytes'] += block[LENGTH]
+        return stats
+
+
+class _SegmentWriter:
+    """Scrittura in append dei blocchi: il segmento resta aperto finche non cambia mese."""
+
+    def __init__(self, archive):
+        self.archive = archive
+        self.month = None
+        self.file = None
+        self.blocks = None
+
+    def write_block(self, day, lines, first, last):
+        month = day[:7].decode('ascii').replace('_', '-')
+        if month != self.month:
+            self.close()
+            self._open(month)
+        raw = b''.join(lines)
+        data = gzip.compress(raw, self.archive.compresslevel)
+        offset = self.file.tell()
+        self.file.write(data)
+        self.blocks.append([first, last, offset, len(data), len(lines), len(raw)])
+
+    def _open(self, month):
+        data_path = self.archive._paths(month)[0]
+        self.blocks = self.archive.load_index(month)
+        end = self.blocks[-1][OFFSET] + self.blocks[-1][LENGTH] if self.blocks else 0
+        self.file = open(data_path, 'ab')
+        # Byte oltre l'ultimo blocco indicizzato: scrittura interrotta, si scartano
+        if self.file.tell() != end:
+            self.file.truncate(end)
+            self.file.seek(end)
+        self.month = month
+
+    def close(self):
+        """Rende durevoli i dati del segmento corrente, poi il suo indice."""
+        if self.file is None:
+            return
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        self.archive._save_index(self.month, self.blocks)
+        self.file = None
+        self.month = None
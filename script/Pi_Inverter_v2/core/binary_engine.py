@@ -0,0 +1,513 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Motore di storage binario a record fissi, letto via mmap.
+Header di 16 byte (magic, versione, formato valore) seguito da record
+'<q?B': secondi epoch wall clock, valore float64 ('d') o float32 ('f'),
+byte di flag (bit 0: valore intero, bit 1-2: qualita della lettura). Accesso O(1) al record i-esimo e ricerca binaria per data.
+Include l'import/export lossless da/verso il formato CSV storico.
+"""
+
+import csv
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from datetime import datetime, timedelta
+from itertools import islice
+
+from . import rotation
+from .file_utils import copy_range, fsync_dir
+from .quality import OK, CODES, USABLE, binary_bits, binary_flag, text_flag
+from .recent_keys import RecentKeys
+from .recovery import repair_record_tail
+from .timestamps import parse_ts, format_ts, epoch_to_datetime, datetime_to_epoch
+
+MAGIC = b'PIBS'
+VERSION = 1
+HEADER = struct.Struct('<4sBc10x')
+
+# Flag del record: il valore originale era un intero (es. watt del solare)
+FLAG_INT = 0x01
+
+
+def _usable(flags):
+    """True se il record non e una lettura STALE/FAILED."""
+    return binary_flag(flags) in USABLE
+
+
+def _record_flags(value, flag):
+    return (FLAG_INT if isinstance(value, int) else 0) | binary_bits(flag)
+
+
+def record_struct(value_format):
+    """Struct del record per il formato valore 'd' (float64) o 'f' (float32)."""
+    if value_format not in ('d', 'f'):
+        raise ValueError(f'Formato valore non supportato: {value_format}')
+    return struct.Struct('<q' + value_format + 'B')
+
+
+def binary_path(filepath):
+    """Path del file binario corrispondente al CSV logico (power_log.csv -> power_log.bin)."""
+    return os.path.splitext(filepath)[0] + '.bin'
+
+
+def format_value(value, flags):
+    """Testo CSV del valore, identico a quello scritto da csv.writer in origine."""
+    return str(int(value)) if flags & FLAG_INT else repr(value)
+
+
+class BinaryEngine:
+    """Serie memorizzata in un file di record binari a larghezza fissa."""
+
+    name = 'binary'
+
+    def __init__(self, filepath, value_format='d'):
+        self.path = binary_path(filepath)
+        self.value_format = value_format
+        # Struct del record per inode e mappatura per (inode, dimensione): riusati
+        # finche il file non cresce o viene sostituito
+        self._header = None
+        self._mapping = None
+        self._map_lock = threading.Lock()
+        # Rotazione preparata dal cleanup, completata da chi scrive (vedi rotation)
+        self._rotation = rotation.load(self.path, self._rollback_archive)
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def identity(self):
+        try:
+            return os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return None
+
+    def size(self):
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+
+    def version(self):
+        """(inode, dimensione, mtime_ns) del file: cambia a ogni modifica, None se assente."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def _value_format(self):
+        """Formato valore letto dall'header (o quello configurato se il file e nuovo)."""
+        try:
+            with open(self.path, 'rb') as f:
+                magic, version, value_format = HEADER.unpack(f.read(HEADER.size))
+        except (FileNotFoundError, struct.error):
+            return self.value_format
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'File binario non valido: {self.path}')
+        return value_format.decode('ascii')
+
+    def _record(self):
+        """Struct del record del file, letto dall'header una volta per inode."""
+        try:
+            inode = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return record_struct(self.value_format)
+        header = self._header
+        if header is None or header[0] != inode:
+            header = self._header = (inode, record_struct(self._value_format()))
+        return header[1]
+
+    def append(self, timestamp, value, flag=OK):
+        """Aggiunge un record e ritorna la nuova posizione di fine file."""
+        flags = _record_flags(value, flag)
+        new_file = self.size() == 0
+        with open(self.path, 'ab') as f:
+            if new_file:
+                f.write(HEADER.pack(MAGIC, VERSION, self.value_format.encode('ascii')))
+                record = record_struct(self.value_format)
+            else:
+                record = self._record()
+            f.write(record.pack(parse_ts(timestamp), float(value), flags))
+            return f.tell()
+
+    def append_many(self, rows):
+        """Aggiunge un blocco di record (timestamp, value[, flag]) con una sola scrittura."""
+        new_file = self.size() == 0
+        record = record_struct(self.value_format) if new_file else self._record()
+        data = b''.join(record.pack(parse_ts(row[0]), float(row[1]),
+                                    _record_flags(row[1], row[2] if len(row) > 2 else OK))
+                        for row in rows)
+        with open(self.path, 'ab') as f:
+            if new_file:
+                f.write(HEADER.pack(MAGIC, VERSION, self.value_format.encode('ascii')))
+            f.write(data)
+            return f.tell()
+
+    def last_epoch(self):
+        """Epoch dell'ultimo record (None se la serie e vuota)."""
+        try:
+            return self.read_record(-1)[0]
+        except IndexError:
+            return None
+
+    def _map(self):
+        """
+        (mmap, struct record, numero record) oppure None se il file e vuoto.
+        La mappatura resta aperta per (inode, dimensione): si rimappa solo se il
+        file e cresciuto o e stato sostituito. Una mappatura superata si chiude
+        quando l'ultimo lettore che la usa la rilascia.
+        """
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            self._mapping = None
+            return None
+        if st.st_size <= HEADER.size:
+            self._mapping = None
+            return None
+        key = (st.st_ino, st.st_size)
+        mapping = self._mapping
+        if mapping is None or mapping[0] != key:
+            with self._map_lock:
+                mapping = self._mapping
+                if mapping is None or mapping[0] != key:
+                    record = self._record()
+                    with open(self.path, 'rb') as f:
+                        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    mapping = self._mapping = (key, mm, record, (len(mm) - HEADER.size) // record.size)
+        return mapping[1:]
+
+    def count(self):
+        """Numero di record completi nel file."""
+        mapped = self._map()
+        if mapped is None:
+            return 0
+        return mapped[2]
+
+    def read_record(self, index):
+        """Record i-esimo (epoch, value, flags) in O(1)."""
+        mapped = self._map()
+        if mapped is None:
+            raise IndexError(index)
+        mm, record, count = mapped
+        if index < 0:
+            index += count
+        if not 0 <= index < count:
+            raise IndexError(index)
+        return record.unpack_from(mm, HEADER.size + index * record.size)
+
+    def iter_records(self, start=0, stop=None):
+        """Record (epoch, value, flags) con indice in [start, stop)."""
+        mapped = self._map()
+        if mapped is None:
+            return
+        mm, record, count = mapped
+        stop = count if stop is None else min(stop, count)
+        if start >= stop:
+            return
+        view = memoryview(mm)[HEADER.size + start * record.size:
+                              HEADER.size + stop * record.size]
+        try:
+            yield from record.iter_unpack(view)
+        finally:
+            view.release()
+
+    def load_arrays(self):
+        """Caricamento bulk di tutta la serie in array compatti (epoch wall clock, valori)."""
+        return self.arrays_since(0)[:2]
+
+    def arrays_since(self, offset):
+        """
+        Record completi dal byte offset in poi come array (epoch wall clock, valori)
+        e posizione dopo l'ultimo record, per la lettura incrementale (vedi tail_follower).
+        """
+        times = array('q')
+        values = array('d')
+        record = self._record()
+        count = max(0, offset - HEADER.size) // record.size
+        first = count
+        for epoch, value, flags in self.iter_records(first):
+            count += 1
+            if not _usable(flags):
+                continue
+            times.append(epoch)
+            values.append(value)
+        return times, values, (HEADER.size + count * record.size if count > first else offset)
+
+    def values(self):
+        return [value for _, value, flags in self.iter_records() if _usable(flags)]
+
+    def scan_values(self, start=0, stop=None):
+        """Valori dei record compresi tra i byte start e stop."""
+        record = self._record()
+        first = max(0, start - HEADER.size) // record.size
+        last = None if stop is None else max(0, stop - HEADER.size) // record.size
+        for _, value, flags in self.iter_records(first, last):
+            if _usable(flags):
+                yield value
+
+    def tail_values(self, n):
+        values = [value for _, value in islice(self._iter_range_reverse(None, None), n)]
+        values.reverse()
+        return values
+
+    def _bisect(self, epoch):
+        """Indice del primo record con timestamp >= epoch."""
+        mapped = self._map()
+        if mapped is None:
+            return 0
+        mm, record, count = mapped
+        return _bisect_mapped(mm, record, count, epoch)
+
+    def iter_range(self, start=None, end=None, reverse=False):
+        """
+        Coppie (epoch, value) con start <= epoch < end (ricerca binaria dell'inizio).
+        Con reverse=True dalla piu recente: ricerca binaria della fine e lettura
+        dei record all'indietro.
+        """
+        if reverse:
+            yield from self._iter_range_reverse(start, end)
+            return
+        first = self._bisect(start) if start is not None else 0
+        for epoch, value, flags in self.iter_records(first):
+            if end is not None and epoch >= end:
+                break
+            if _usable(flags):
+                yield epoch, value
+
+    def _iter_range_reverse(self, start, end):
+        mapped = self._map()
+        if mapped is None:
+            return
+        mm, record, count = mapped
+        last = _bisect_mapped(mm, record, count, end) if end is not None else count
+        for index in range(last - 1, -1, -1):
+            epoch, value, flags = record.unpack_from(mm, HEADER.size + index * record.size)
+            if start is not None and epoch < start:
+                break
+            if _usable(flags):
+                yield epoch, value
+
+    def day_rows(self, target_date):
+        """Coppie (datetime, value) del giorno target_date (ricerca binaria)."""
+        day_start = datetime_to_epoch(datetime.combine(target_date, datetime.min.time()))
+        mapped = self._map()
+        if mapped is None:
+            return []
+        mm, record, count = mapped
+        first = _bisect_mapped(mm, record, count, day_start)
+        last = _bisect_mapped(mm, record, count, day_start + 86400)
+        return [(epoch_to_datetime(epoch), value)
+                for epoch, value, flags in (record.unpack_from(mm, HEADER.size + i * record.size)
+                                            for i in range(first, last))
+                if _usable(flags)]
+
+    def iter_flags(self, start=None, end=None):
+        """
+        Coppie (epoch, flag) dei record non OK con start <= epoch < end: si
+        leggono i soli byte di flag (slice a passo record dal mmap), il
+        timestamp solo dei record segnati.
+        """
+        mapped = self._map()
+        if mapped is None:
+            return
+        mm, record, count = mapped
+        first = _bisect_mapped(mm, record, count, start) if start is not None else 0
+        last = _bisect_mapped(mm, record, count, end) if end is not None else count
+        flag_offset = HEADER.size + record.size - 1
+        flag_bytes = mm[flag_offset + first * record.size:flag_offset + last * record.size:record.size]
+        for index, flags in enumerate(flag_bytes, first):
+            if flags > FLAG_INT:
+                epoch = record.unpack_from(mm, HEADER.size + index * record.size)[0]
+                yield epoch, binary_flag(flags)
+
+    def iter_archive(self, start=None, end=None, reverse=False):
+        """Coppie (epoch, value) di <nome>_archive.bin con start <= epoch < end, in streaming."""
+        end = rotation.archive_end(self._rotation, end)
+        return BinaryEngine(self.path.replace('.bin', '_archive.bin')).iter_range(start, end, reverse)
+
+    def repair_tail(self, last_good=None, max_tail=65536):
+        """Controllo di integrita della coda: record parziale finale e record a zero (vedi recovery)."""
+        return repair_record_tail(self.path, HEADER.size, self._record().size, last_good, max_tail)
+
+    def cleanup(self, max_age_days):
+        """
+        Sposta i record piu vecchi di max_age_days in <nome>_archive.bin con una
+        copia a blocchi e prepara in <nome>.bin.next i record recenti presenti
+        all'avvio (segmento sigillato, vedi rotation): il file vivo e sostituito
+        da complete_rotation alla scrittura successiva. None se la serie non
+        esiste o una rotazione e ancora in sospeso.
+        """
+        if not self.exists() or self._rotation is not None:
+            return None
+        started = time.monotonic()
+        threshold = datetime_to_epoch(datetime.now() - timedelta(days=max_age_days))
+        cut = self._bisect(threshold)
+        stats = {'archived_bytes': 0, 'kept_bytes': 0, 'elapsed': 0.0}
+        if cut == 0:
+            stats['kept_bytes'] = self.size() - HEADER.size
+            return stats
+        value_format = self._value_format()
+        header = HEADER.pack(MAGIC, VERSION, value_format.encode('ascii'))
+        record = record_struct(value_format)
+
+        archive_path = self.path.replace('.bin', '_archive.bin')
+        with open(self.path, 'rb') as src:
+            kept = os.fstat(src.fileno()).st_size - HEADER.size - cut * record.size
+            src.seek(HEADER.size)
+            first_epoch = record.unpack(src.read(record.size))[0]
+            src.seek(HEADER.size)
+            with open(archive_path, 'ab') as dst:
+                if dst.tell() == 0:
+                    dst.write(header)
+                stats['archived_bytes'] = copy_range(src, dst, cut * record.size)
+                dst.flush()
+                os.fsync(dst.fileno())
+            with open(rotation.next_path(self.path), 'wb') as dst:
+                dst.write(header)
+                stats['kept_bytes'] = copy_range(src, dst, kept - kept % record.size)
+                dst.flush()
+                os.fsync(dst.fileno())
+        sealed = HEADER.size + cut * record.size + stats['kept_bytes']
+        self._rotation = rotation.seal(self.path, sealed, first_epoch, HEADER.size + cut * record.size)
+
+        stats['elapsed'] = time.monotonic() - started
+        print(f"Cleanup {self.path}: archiviati {cut} record ({stats['archived_bytes']} byte) "
+              f"in {archive_path}, mantenuti {stats['kept_bytes']} byte ({stats['elapsed']:.2f}s)")
+        return stats
+
+    def rotation_pending(self):
+        return self._rotation is not None
+
+    def rotation_manifest(self):
+        """Manifest della rotazione in sospeso (vedi rotation), None se assente."""
+        return self._rotation
+
+    def complete_rotation(self):
+        """Sostituisce il file vivo con il segmento preparato dal cleanup. Ritorna i byte ricopiati."""
+        manifest, self._rotation = self._rotation, None
+        return rotation.complete(self.path, manifest, self._rollback_archive)
+
+    def _rollback_archive(self, manifest):
+        """
+        on_discard della rotazione (vedi rotation.discard): se i record archiviati
+        dal cleanup sono ancora nel file vivo, tronca <nome>_archive.bin al primo
+        record >= la loro prima lettura.
+        """
+        try:
+            live_first = self.read_record(0)[0]
+        except IndexError:
+            live_first = None
+        if not rotation.archived_rows_live(manifest, live_first):
+            return
+        archive = BinaryEngine(self.path.replace('.bin', '_archive.bin'))
+        count = archive.count()
+        cut = archive._bisect(manifest['first_epoch'])
+        if cut == count:
+            return
+        with open(archive.path, 'r+b') as f:
+            f.truncate(HEADER.size + cut * archive._record().size)
+        print(f'Rotazione {self.path} scartata: {count - cut} record ancora nel file vivo '
+              f'tolti da {archive.path}')
+
+
+def _bisect_mapped(mm, record, count, epoch):
+    lo, hi = 0, count
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if record.unpack_from(mm, HEADER.size + mid * record.size)[0] < epoch:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def dedup_records(bin_path, window=10080, chunk_records=4096):
+    """
+    Elimina i record con epoch gia presente tra gli ultimi `window` (tiene il
+    primo) in una sola passata a blocchi, scrivendo un file temporaneo
+    sostituito con os.replace. Ritorna (record tenuti, duplicati rimossi).
+    """
+    seen = RecentKeys(window)
+    kept = removed = 0
+    tmp_path = bin_path + '.tmp'
+    with open(bin_path, 'rb') as src:
+        header = src.read(HEADER.size)
+        magic, version, value_format = HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'File binario non valido: {bin_path}')
+        size = record_struct(value_format.decode('ascii')).size
+        with open(tmp_path, 'wb') as dst:
+            dst.write(header)
+            while True:
+                chunk = src.read(size * chunk_records)
+                if len(chunk) < size:
+                    break   # fine file; un record parziale finale (scrittura interrotta) non e copiato
+                out = []
+                for offset in range(0, len(chunk) - len(chunk) % size, size):
+                    if seen.add(chunk[offset:offset + 8]):
+                        out.append(chunk[offset:offset + size])
+                    else:
+                        removed += 1
+                kept += len(out)
+                dst.write(b''.join(out))
+            dst.flush()
+            os.fsync(dst.fileno())
+    if not removed:
+        os.remove(tmp_path)
+        return kept, 0
+    os.replace(tmp_path, bin_path)
+    fsync_dir(os.path.dirname(os.path.abspath(bin_path)))
+    return kept, removed
+
+
+def import_csv(csv_path, bin_path, value_format='d'):
+    """
+    Converte un CSV storico in file binario (sovrascrive bin_path).
+    Ritorna (record importati, righe scartate). ValueError se un valore non
+    e rappresentabile senza perdite nel formato scelto.
+    """
+    record = record_struct(value_format)
+    imported = skipped = 0
+    tmp_path = bin_path + '.tmp'
+    with open(csv_path, 'r', encoding='utf-8') as src, open(tmp_path, 'wb') as dst:
+        dst.write(HEADER.pack(MAGIC, VERSION, value_format.encode('ascii')))
+        for row in csv.reader(src):
+            try:
+                epoch = parse_ts(row[0])
+                value = float(row[1])
+            except (ValueError, IndexError):
+                skipped += 1
+                continue
+            flags = (FLAG_INT if row[1].lstrip('-').isdigit() else 0) | binary_bits(text_flag(row))
+            packed = record.pack(epoch, value, flags)
+            stored = record.unpack(packed)[1]
+            if format_ts(epoch) != row[0] or format_value(stored, flags) != row[1]:
+                dst.close()
+                os.remove(tmp_path)
+                raise ValueError(f'Riga non convertibile senza perdite: {row}')
+            dst.write(packed)
+            imported += 1
+        dst.flush()
+        os.fsync(dst.fileno())
+    os.replace(tmp_path, bin_path)
+    return imported, skipped
+
+
+def export_csv(bin_path, csv_path):
+    """Esporta un file binario nel formato CSV storico. Ritorna i record scritti."""
+    engine = BinaryEngine(bin_path)
+    written = 0
+    with open(csv_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        for epoch, value, flags in engine.iter_records():
+            row = [format_ts(epoch), format_value(value, flags)]
+            flag = binary_flag(flags)
+            if flag != OK:
+                row.append(CODES[flag])
+            writer.writerow(row)
+            written += 1
+    return written
@@ -0,0 +1,653 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Motore di storage CSV testuale (default): una riga 'YYYY_MM_DD_HH:MM,value'
+per lettura, con la colonna opzionale dell'epoch UTC reale
+('YYYY_MM_DD_HH:MM,value,epoch', vedi config.CSV_EPOCH_COLUMN) e il codice
+di qualita finale delle sole letture non OK (',S' / ',F' / ',I', vedi quality).
+ZERO dipendenze da SenseHat — errori gestiti via print.
+"""
+
+import calendar
+import csv
+import os
+import time
+from array import array
+from datetime import datetime, timedelta
+
+from . import rotation
+from .archive_segments import SegmentArchive, archive_dir
+from .day_index import DayIndex
+from .file_utils import copy_range, fsync_dir
+from .quality import OK, CODES, USABLE, bad_line, line_flag, text_flag
+from .recent_keys import RecentKeys
+from .recovery import repair_text_tail
+from .timestamps import TS_FORMAT, HEADER_PREFIX, format_ts, parse_ts, line_epoch, epoch_to_datetime, utc_after
+
+
+class CsvEngine:
+    """Serie memorizzata in un singolo file CSV append-only, con indice per giorno."""
+
+    name = 'csv'
+
+    def __init__(self, filepath, index_save_interval=600, epoch_column=False):
+        self.path = filepath
+        self.day_index = DayIndex(filepath, index_save_interval)
+        self.epoch_column = epoch_column
+        self._last_utc = None
+        # Rotazione preparata dal cleanup, completata da chi scrive (vedi rotation)
+        self._rotation = rotation.load(filepath, self._rollback_archive)
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def identity(self):
+        """Inode del file (None se non esiste): cambia se il file viene sostituito."""
+        try:
+            return os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return None
+
+    def size(self):
+        """Posizione di fine serie (byte), usata per gli aggiornamenti incrementali."""
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+
+    def version(self):
+        """(inode, dimensione, mtime_ns) del file: cambia a ogni modifica, None se assente."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def _row(self, timestamp, value, flag=OK):
+        """
+        Campi della riga: con epoch_column anche l'epoch UTC (seconda occorrenza
+        nell'ora ripetuta), per le letture non OK il codice di qualita in coda.
+        """
+        row = [timestamp, value]
+        if self.epoch_column:
+            if self._last_utc is None:
+                self._last_utc = self._tail_utc()
+            self._last_utc = utc_after(parse_ts(timestamp), self._last_utc)
+            row.append(self._last_utc)
+        if flag != OK:
+            row.append(CODES[flag])
+        return row
+
+    def _tail_utc(self):
+        """Epoch UTC dell'ultima riga che lo riporta (None se assente)."""
+        if not self.exists():
+            return None
+        for line in reversed(_tail_lines(self.path, 5)):
+            parts = line.strip().split(',')
+            if len(parts) >= 3:
+                try:
+                    return int(parts[2])
+                except ValueError:
+                    continue
+        return None
+
+    def append(self, timestamp, value, flag=OK):
+        """Aggiunge una riga e ritorna la nuova posizione di fine file."""
+        with open(self.path, 'a', newline='', encoding='utf-8') as f:
+            start = f.tell()
+            writer = csv.writer(f)
+            writer.writerow(self._row(timestamp, value, flag))
+            end = f.tell()
+        self.day_index.note_append(start, end, timestamp)
+        return end
+
+    def append_many(self, rows):
+        """Aggiunge un blocco di righe (timestamp, value[, flag]) con una sola apertura del file."""
+        with open(self.path, 'a', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            start = f.tell()
+            for row in rows:
+                writer.writerow(self._row(row[0], row[1], row[2] if len(row) > 2 else OK))
+                end = f.tell()
+                self.day_index.note_append(start, end, row[0])
+                start = end
+            return f.tell()
+
+    def last_epoch(self):
+        """Epoch wall clock dell'ultima riga valida (None se la serie e vuota)."""
+        if not self.exists():
+            return None
+        for line in reversed(_tail_lines(self.path, 5)):
+            try:
+                return parse_ts(line.split(',')[0])
+            except ValueError:
+                continue
+        return None
+
+    def values(self):
+        """Tutti i valori (colonna 1) del CSV, senza le letture STALE/FAILED."""
+        values = []
+        if not self.exists():
+            return values
+        with open(self.path, 'r', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            for row in reader:
+                if len(row) >= 2 and text_flag(row) in USABLE:
+                    try:
+                        values.append(float(row[1]))
+                    except ValueError:
+                        continue
+        return values
+
+    def load_arrays(self):
+        """
+        Caricamento bulk di tutta la serie in array compatti (epoch wall clock, valori):
+        lettura in streaming del file (memoria = i soli array) e timestamp ricavati
+        per slicing, con la parte data calcolata una volta per giorno.
+        """
+        return self.arrays_since(0)[:2]
+
+    def arrays_since(self, offset):
+        """
+        Righe complete dal byte offset in poi come array (epoch wall clock, valori)
+        e posizione dopo l'ultima riga completa, per la lettura incrementale (vedi tail_follower).
+        """
+        times = array('q')
+        values = array('d')
+        if not self.exists():
+            return times, values, offset
+        day_epochs = {}
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                offset += len(line)
+                if line[16:17] != b',' or bad_line(line):
+                    continue
+                day = line[:10]
+                base = day_epochs.get(day)
+                comma = line.find(b',', 17)
+                try:
+                    if base is None:
+                        base = day_epochs[day] = calendar.timegm(
+                            (int(day[0:4]), int(day[5:7]), int(day[8:10]), 0, 0, 0))
+                    value = float(line[17:comma] if comma > 0 else line[17:])
+                    epoch = base + int(line[11:13]) * 3600 + int(line[14:16]) * 60
+                except ValueError:
+                    continue
+                times.append(epoch)
+                values.append(value)
+        return times, values, offset
+
+    def scan_values(self, start=0, stop=None):
+        """Valori delle righe complete comprese tra i byte start e stop."""
+        if not self.exists():
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(start)
+            position = start
+            for line in f:
+                position += len(line)
+                if not line.endswith(b'\n') or (stop is not None and position > stop):
+                    break
+                parts = line.split(b',')
+                if len(parts) >= 2 and not bad_line(line):
+                    try:
+                        yield float(parts[1])
+                    except ValueError:
+                        continue
+
+    def tail_values(self, n):
+        """Gli ultimi N valori (lettura a blocchi dalla fine del file)."""
+        if not self.exists():
+            return []
+        values = []
+        for line in _tail_lines(self.path, n):
+            parts = line.strip().split(',')
+            if len(parts) >= 2 and text_flag(parts) in USABLE:
+                try:
+                    values.append(float(parts[1]))
+                except ValueError:
+                    continue
+        return values
+
+    def iter_range(self, start=None, end=None, reverse=False):
+        """
+        Coppie (epoch, value) con start <= epoch < end in streaming: l'indice
+        giorni fornisce l'offset di partenza, la lettura si ferma al primo
+        timestamp >= end. Con reverse=True dalla piu recente, leggendo a blocchi
+        all'indietro dalla fine del file (o dalla fine del giorno di end) fino
+        al primo timestamp < start.
+        """
+        if not self.exists():
+            return
+        if reverse:
+            yield from self._iter_range_reverse(start, end)
+            return
+        offset = 0
+        if start is not None:
+            offset = self.day_index.offset_from(epoch_to_datetime(start).date())
+            if offset is None:
+                return
+        day_epochs = {}
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                epoch = line_epoch(line, day_epochs)
+                if epoch is None or (start is not None and epoch < start):
+                    continue
+                if end is not None and epoch >= end:
+                    break
+                if bad_line(line):
+                    continue
+                try:
+                    yield epoch, float(line[17:].split(b',')[0])
+                except ValueError:
+                    continue
+
+    def _iter_range_reverse(self, start, end):
+        limit = self.size()
+        if end is not None:
+            # Righe dei giorni successivi a end: si parte dall'inizio del primo di essi
+            next_day = self.day_index.offset_from(epoch_to_datetime(end - 1).date() + timedelta(days=1))
+            if next_day is not None:
+                limit = next_day
+        day_epochs = {}
+        with open(self.path, 'rb') as f:
+            for line in reverse_lines(f, limit):
+                epoch = line_epoch(line, day_epochs)
+                if epoch is None or (end is not None and epoch >= end):
+                    continue
+                if start is not None and epoch < start:
+                    break
+                if bad_line(line):
+                    continue
+                try:
+                    yield epoch, float(line[17:].split(b',')[0])
+                except ValueError:
+                    continue
+
+    def day_rows(self, target_date):
+        """Coppie (datetime, value) del giorno target_date, lette via indice giorni."""
+        if not self.exists():
+            return []
+        data = []
+        for line in self.day_index.read_day_lines(target_date):
+            parts = line.strip().split(',')
+            if len(parts) < 2 or text_flag(parts) not in USABLE:
+                continue
+            try:
+                data.append((epoch_to_datetime(parse_ts(parts[0])), float(parts[1])))
+            except ValueError:
+                continue
+        return data
+
+    def iter_flags(self, start=None, end=None):
+        """
+        Coppie (epoch, flag) delle letture non OK con start <= epoch < end: il codice
+        e in coda alla riga, quindi si controlla la fine della riga e si converte
+        il timestamp solo delle righe segnate.
+        """
+        if not self.exists():
+            return
+        offset = 0
+        if start is not None:
+            offset = self.day_index.offset_from(epoch_to_datetime(start).date())
+            if offset is None:
+                return
+        end_key = None if end is None else format_ts(end).encode('ascii')
+        day_epochs = {}
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                if end_key is not None and line[:16] >= end_key and line[16:17] == b',':
+                    break
+                flag = line_flag(line)
+                if flag == OK:
+                    continue
+                epoch = line_epoch(line, day_epochs)
+                if epoch is not None and (start is None or epoch >= start):
+                    yield epoch, flag
+
+    def iter_archive(self, start=None, end=None, reverse=False):
+        """Coppie (epoch, value) archiviate con start <= epoch < end, in streaming."""
+        end = rotation.archive_end(self._rotation, end)
+        return SegmentArchive(archive_dir(self.path)).iter_rows(start, end, reverse=reverse)
+
+    def repair_tail(self, last_good=None, max_tail=65536):
+        """Controllo di integrita della coda dopo un arresto non pulito (vedi recovery)."""
+        result = repair_text_tail(self.path, last_good, max_tail)
+        if result is not None and result['repaired_from'] is not None:
+            self.day_index.truncate(result['repaired_from'])
+        return result
+
+    def cleanup(self, max_age_days):
+        """
+        Archivia i record piu vecchi di max_age_days nei segmenti compressi e
+        prepara la rotazione (vedi prepare_cleanup): il file vivo non viene
+        toccato, lo sostituisce complete_rotation alla scrittura successiva.
+        None se la serie non esiste o una rotazione e ancora in sospeso.
+        """
+        if not self.exists() or self._rotation is not None:
+            return None
+        stats, self._rotation = prepare_cleanup(self.path, datetime.now() - timedelta(days=max_age_days),
+                                                archive=SegmentArchive(archive_dir(self.path)))
+        return stats
+
+    def rotation_pending(self):
+        return self._rotation is not None
+
+    def rotation_manifest(self):
+        """Manifest della rotazione in sospeso (vedi rotation), None se assente."""
+        return self._rotation
+
+    def complete_rotation(self):
+        """Sostituisce il file vivo con il segmento preparato dal cleanup. Ritorna i byte ricopiati."""
+        manifest, self._rotation = self._rotation, None
+        size = self.size()
+        copied = rotation.complete(self.path, manifest, self._rollback_archive)
+        self.day_index.rotate(manifest, size - self.size())
+        return copied
+
+    def _rollback_archive(self, manifest):
+        rollback_archive(self.path, manifest)
+
+
+def first_epoch(filepath):
+    """Epoch della prima riga del CSV (saltando l'header wide), None se vuoto o illeggibile."""
+    try:
+        with open(filepath, 'rb') as f:
+            line = f.readline()
+            if line.startswith(HEADER_PREFIX):
+                line = f.readline()
+    except FileNotFoundError:
+        return None
+    return line_epoch(line, {})
+
+
+def rollback_archive(filepath, manifest):
+    """
+    on_discard delle rotazioni CSV e wide (vedi rotation.discard): se le righe
+    archiviate dal cleanup sono ancora nel file vivo le toglie dai segmenti,
+    cosi non vengono lette due volte ne archiviate di nuovo.
+    """
+    if not rotation.archived_rows_live(manifest, first_epoch(filepath)):
+        return
+    dropped = SegmentArchive(archive_dir(filepath)).drop_from(manifest['first_epoch'])
+    if dropped:
+        print(f'Rotazione {filepath} scartata: {dropped} righe ancora nel file vivo tolte dall\'archivio')
+
+
+def stream_cleanup(filepath, threshold, archive_path=None, archive=None, day_index=None):
+    """
+    Cleanup a memoria costante di un CSV ordinato per tempo: prepare_cleanup
+    seguito subito dalla sostituzione del file con os.replace (il CSV non e
+    mai troncato). Usata dal cleanup del CSVHandler legacy; il servizio v2
+    completa invece la rotazione da chi scrive (vedi CsvEngine.cleanup). Le
+    righe accodate dopo il sigillo vengono ricopiate, ma una scrittura durante
+    la copia finale andrebbe persa: nessuno deve scrivere in quell'istante.
+    day_index (DayIndex del file) viene riallineato senza riscansionare il CSV.
+
+    Returns:
+        dict con 'archived_bytes', 'kept_bytes' e 'elapsed' (secondi).
+    """
+    stats, manifest = prepare_cleanup(filepath, threshold, archive_path, archive)
+    if manifest is not None:
+        rotation.complete(filepath, manifest, lambda discarded: rollback_archive(filepath, discarded))
+        if day_index is not None:
+            day_index.rotate(manifest, manifest['sealed'] - os.path.getsize(filepath))
+    return stats
+
+
+def prepare_cleanup(filepath, threshold, archive_path=None, archive=None):
+    """
+    Cleanup a memoria costante di un CSV ordinato per tempo, sui soli byte
+    presenti all'avvio (segmento sigillato, vedi rotation): trova per
+    bisezione il primo record con timestamp >= threshold, accoda a blocchi la
+    parte precedente in archive_path (o nei segmenti compressi di archive, un
+    SegmentArchive), copia la coda in <file>.next e registra il manifest.
+    Una prima riga senza timestamp (header del formato wide) resta in testa al file.
+
+    Returns:
+        (stats, manifest): stats con 'archived_bytes', 'kept_bytes' e 'elapsed'
+        (secondi), manifest None se non c'e nulla da archiviare.
+    """
+    started = time.monotonic()
+    # ts < threshold  <=>  testo del minuto < threshold arrotondato al minuto successivo
+    cutoff = threshold.replace(second=0, microsecond=0)
+    if cutoff != threshold:
+        cutoff += timedelta(minutes=1)
+    cutoff_key = cutoff.strftime(TS_FORMAT).encode('ascii')
+
+    with open(filepath, 'rb') as src:
+        size = os.fstat(src.fileno()).st_size
+        header = first = src.readline()
+        if not header.startswith(HEADER_PREFIX) or not header.endswith(b'\n'):
+            header = b''
+        else:
+            first = src.readline()
+        first_epoch = line_epoch(first, {})
+        cut = _find_cut(src, size, cutoff_key)
+        stats = {'archived_bytes': max(0, cut - len(header)), 'kept_bytes': 0, 'elapsed': 0.0}
+        if cut <= len(header):
+            stats['kept_bytes'] = size
+            stats['elapsed'] = time.monotonic() - started
+            return stats, None
+
+        src.seek(len(header))
+        if archive is not None:
+            archive.append_lines(_iter_lines(src, cut - len(header)))
+            archive_path = archive.directory
+        else:
+            with open(archive_path, 'ab') as dst:
+                copy_range(src, dst, cut - len(header))
+                dst.flush()
+                os.fsync(dst.fileno())
+
+        with open(rotation.next_path(filepath), 'wb') as dst:
+            dst.write(header)
+            src.seek(cut)
+            stats['kept_bytes'] = len(header) + copy_range(src, dst, size - cut)
+            dst.flush()
+            os.fsync(dst.fileno())
+    manifest = rotation.seal(filepath, size, first_epoch, cut)
+
+    stats['elapsed'] = time.monotonic() - started
+    print(f"Cleanup {filepath}: archiviati {stats['archived_bytes']} byte in {archive_path}, "
+          f"mantenuti {stats['kept_bytes']} byte ({stats['elapsed']:.2f}s)")
+    return stats, manifest
+
+
+def convert_epoch_column(filepath, add=True):
+    """
+    Aggiunge (o rimuove con add=False) la colonna dell'epoch UTC a tutte le righe
+    del CSV, riscrivendolo in un file temporaneo sostituito con os.replace.
+    L'epoch e ricavato dall'ora locale nel fuso del sistema: nell'ora ripetuta
+    al ritorno all'ora solare le righe che tornano indietro sono la seconda
+    occorrenza. Righe non valide copiate invariate. Ritorna le righe convertite.
+    """
+    converted = 0
+    previous_utc = None
+    tmp_path = filepath + '.tmp'
+    with open(filepath, 'rb') as src, open(tmp_path, 'wb') as dst:
+        for line in src:
+            if line.startswith(HEADER_PREFIX):
+                raise ValueError(f'{filepath} e un file wide multi-canale: colonna epoch non supportata')
+            parts = line.rstrip(b'\r\n').split(b',')
+            # Codice di qualita in coda: resta l'ultima colonna dopo la conversione
+            code = [parts.pop()] if len(parts) > 2 and line_flag(line) != OK else []
+            try:
+                wall = parse_ts(parts[0].decode('ascii'))
+                if len(parts) < 2 or not line.endswith(b'\n'):
+                    raise ValueError(line)
+                utc = int(parts[2]) if len(parts) >= 3 else None
+            except (ValueError, UnicodeDecodeError):
+                dst.write(line)
+                continue
+            if add:
+                if utc is not None:
+                    previous_utc = utc
+                else:
+                    previous_utc = utc_after(wall, previous_utc)
+                    parts.append(str(previous_utc).encode('ascii'))
+            else:
+                parts = parts[:2]
+            dst.write(b','.join(parts + code) + b'\r\n')
+            converted += 1
+        dst.flush()
+        os.fsync(dst.fileno())
+    os.replace(tmp_path, filepath)
+    fsync_dir(os.path.dirname(os.path.abspath(filepath)))
+    return converted
+
+
+def dedup_csv(filepath, window=10080):
+    """
+    Elimina le righe duplicate per minuto (stesso timestamp, e stesso epoch UTC
+    se presente la colonna) in una sola passata in streaming, tenendo la prima:
+    un duplicato e cercato tra le ultime `window` righe, quindi la memoria resta
+    limitata anche su file di anni. Vale anche per il file wide (header copiato),
+    dove sono duplicate solo le righe dello stesso minuto con gli stessi canali
+    compilati: una riga con canali diversi da quella tenuta non e mai rimossa.
+    Righe non valide copiate invariate; file temporaneo sostituito con os.replace.
+    Ritorna (righe tenute, duplicati rimossi).
+    """
+    seen = RecentKeys(window)
+    kept = removed = 0
+    tmp_path = filepath + '.tmp'
+    with open(filepath, 'rb') as src, open(tmp_path, 'wb') as dst:
+        wide = src.read(len(HEADER_PREFIX)) == HEADER_PREFIX
+        src.seek(0)
+        for line in src:
+            if not _has_timestamp(line) or not line.endswith(b'\n'):
+                dst.write(line)
+                continue
+            key = line[:16]
+            parts = line.rstrip(b'\r\n').split(b',')
+            if wide:
+                # Canali compilati: righe parziali dello stesso minuto con canali diversi non sono duplicati
+                key += b'|' + bytes(48 + bool(cell) for cell in parts[1:])
+            elif len(parts) >= 3 and parts[2].isdigit():
+                key += parts[2]   # colonna epoch UTC
+            if not seen.add(key):
+                removed += 1
+                continue
+            dst.write(line)
+            kept += 1
+        dst.flush()
+        os.fsync(dst.fileno())
+    if not removed:
+        os.remove(tmp_path)
+        return kept, 0
+    os.replace(tmp_path, filepath)
+    fsync_dir(os.path.dirname(os.path.abspath(filepath)))
+    return kept, removed
+
+
+def _iter_lines(f, length):
+    """Righe dalla posizione corrente di f fino a length byte letti."""
+    remaining = length
+    while remaining > 0:
+        line = f.readline(remaining)
+        if not line:
+            break
+        remaining -= len(line)
+        yield line
+
+
+def _find_cut(f, size, cutoff_key):
+    """
+    Offset della prima riga con timestamp >= cutoff_key (size se nessuna),
+    per bisezione sugli offset in byte. Le righe non valide vengono saltate.
+    """
+    lo, hi = 0, size     # righe che iniziano prima di lo: vecchie; riga a hi: recente (o EOF)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        start, line = _valid_line_at(f, mid, hi)
+        if start is None:
+            break
+        if line[:16] < cutoff_key:
+            lo = start + len(line)
+        else:
+            hi = start
+    # Scansione lineare del tratto residuo [lo, hi)
+    f.seek(lo)
+    position = lo
+    while position < hi:
+        line = f.readline()
+        if not line:
+            break
+        if _has_timestamp(line) and line[:16] >= cutoff_key:
+            return position
+        position += len(line)
+    return hi
+
+
+def _valid_line_at(f, offset, limit):
+    """Prima riga valida che inizia in [offset, limit): (start, riga) o (None, None)."""
+    if offset > 0:
+        f.seek(offset - 1)
+        f.readline()
+    else:
+        f.seek(0)
+    start = f.tell()
+    while start < limit:
+        line = f.readline()
+        if not line:
+            break
+        if _has_timestamp(line) and line.endswith(b'\n'):
+            return start, line
+        start += len(line)
+    return None, None
+
+
+def _has_timestamp(line):
+    return len(line) > 16 and line[16:17] == b',' and line[4:5] == b'_' and line[10:11] == b'_'
+
+
+def reverse_lines(f, end_offset, block_size=8192):
+    """
+    Righe complete (bytes, con terminatore) del file binario f che terminano
+    entro end_offset, dall'ultima alla prima, leggendo a blocchi all'indietro.
+    Una riga finale senza newline (scrittura in corso o troncata) viene saltata.
+    """
+    position = end_offset
+    buffer = b''
+    trailing = True
+    while position > 0:
+        read_size = min(block_size, position)
+        position -= read_size
+        f.seek(position)
+        buffer = f.read(read_size) + buffer
+        if trailing:
+            cut = buffer.rfind(b'\n')
+            if cut < 0:
+                continue
+            buffer = buffer[:cut + 1]
+            trailing = False
+        lines = buffer.split(b'\n')
+        # lines[0] puo iniziare nel blocco precedente; l'ultimo elemento e vuoto
+        for line in reversed(lines[1:-1]):
+            yield line + b'\n'
+        buffer = lines[0] + b'\n'
+    if not trailing and len(buffer) > 1:
+        yield buffer
+
+
+def _tail_lines(filepath, n):
+    """Legge le ultime N righe complete di un file senza caricarlo tutto in memoria."""
+    lines = []
+    if n <= 0:
+        return lines
+    with open(filepath, 'rb') as f:
+        for line in reverse_lines(f, f.seek(0, 2)):
+            lines.append(line.decode('utf-8', errors='replace').rstrip('\r\n'))
+            if len(lines) >= n:
+                break
+    lines.reverse()
+    return lines
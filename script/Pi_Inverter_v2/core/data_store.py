@@ -1,142 +1,1014 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
-Persistenza dati: CSV e JSON.
+Persistenza dati: serie storiche (motore CSV, binario, a partizioni mensili,
+SQLite o wide multi-canale, vedi config.STORAGE_BACKEND) e JSON.
 ZERO dipendenze da SenseHat — errori gestiti via eccezioni o print.
 """
 
-import csv
+import math
 import os
 import json
-from datetime import datetime, timedelta
+import threading
+import time
+from array import array
+from datetime import date, datetime, timedelta
+from itertools import islice
 
+from .csv_engine import CsvEngine
+from .binary_engine import BinaryEngine
+from .partitioned_engine import PartitionedEngine
+from .sqlite_engine import SqliteEngine
+from .wide_engine import WideChannelEngine, wide_file
+from .archive_segments import archive_dir
+from .quality import OK, USABLE, NAMES as QUALITY_NAMES, format_cell
+from .quantile_sketch import SeriesSketch
+from .recent_keys import RecentKeys
+from .series import Series
+from .series_cache import SeriesCache
+from .tail_follower import TailFollower
+from .write_behind import WriteBehindBuffer
+from .tiers import TierSeries, tier_dir
+from .yield_history import YieldHistory
+from .timestamps import parse_ts, epoch_to_datetime, datetime_to_epoch
+from . import query as series_query
+from . import parallel_load, rollups, vectorized
+from .. import config
+
+
+# Motore di storage per serie: filepath logico -> istanza del motore
+_engines = {}
+
+# Cache residente delle serie (None se disabilitata in config)
+_cache = (SeriesCache(config.SERIES_CACHE_DAYS * 86400 // config.POLL_INTERVAL)
+          if config.SERIES_CACHE_ENABLED else None)
+
+# Letture in attesa di scrittura su disco (None se il write-behind e disabilitato)
+_write_behind = (WriteBehindBuffer(config.WRITE_BEHIND_FLUSH_MINUTES * 60,
+                                   config.WRITE_BEHIND_JOURNAL_DIR)
+                 if config.WRITE_BEHIND_ENABLED else None)
+
+# Storico daily yield (una riga per giorno), con copia in memoria
+_yield_history = YieldHistory(config.DAILY_YIELD_HISTORY_CSV, seed_json=config.DAILY_ENERGY_JSON)
+
+# Sketch dei quantili per serie: filepath -> stato in memoria
+_sketches = {}
+_sketch_lock = threading.Lock()
+# Sketch preparati dal cleanup per il file ruotato: filepath -> (manifest della rotazione, sketch)
+_rotation_sketches = {}
+
+# Livelli consolidati (15m, 1h, ...) per serie: filepath -> TierSeries (solo con TIERS_ENABLED)
+_tiers = {}
+_tiers_lock = threading.Lock()
+
+# Lettori incrementali della serie intera: filepath -> TailFollower (solo con TAIL_FOLLOW_ENABLED)
+_followers = {}
+_followers_lock = threading.Lock()
+
+# Minuti scritti di recente per serie: filepath -> RecentKeys (scritture idempotenti)
+_recent_keys = {}
+_recent_keys_lock = threading.Lock()
+_dedup_counters = {'duplicates': 0}
+
+# Generazione per serie: incrementata a ogni scrittura o cleanup fatti dal processo
+_generations = {}
+
+# Risultati di get_day_power_chart: (filepath, giorno, barre, ore) -> (versione serie, livelli)
+_chart_memo = {}
+_chart_memo_counters = {'hits': 0, 'misses': 0}
+
+# Serie intere come array NumPy: filepath -> (versione serie, (datetime64[s], float64))
+_ndarrays = {}
+
+
+def get_engine(filepath):
+    """
+    Restituisce il motore di storage della serie identificata dal path CSV
+    logico (config.SOLAR_CSV, config.GRID_CSV, ...), secondo config.STORAGE_BACKEND.
+    """
+    engine = _engines.get(filepath)
+    if engine is None:
+        if config.STORAGE_BACKEND == 'binary':
+            engine = BinaryEngine(filepath, config.BINARY_VALUE_FORMAT)
+        elif config.STORAGE_BACKEND == 'partitioned':
+            engine = PartitionedEngine(filepath, config.SIDECAR_SAVE_INTERVAL, config.CSV_EPOCH_COLUMN)
+        elif config.STORAGE_BACKEND == 'sqlite':
+            engine = SqliteEngine(filepath, config.SQLITE_DB, config.SQLITE_BATCH_SIZE,
+                                  config.SQLITE_FLUSH_INTERVAL)
+        elif config.STORAGE_BACKEND == 'wide':
+            wide = wide_file(config.WIDE_CSV, list(config.WIDE_CHANNELS.values()),
+                             config.SIDECAR_SAVE_INTERVAL)
+            engine = WideChannelEngine(wide, config.WIDE_CHANNELS[filepath])
+        elif config.STORAGE_BACKEND == 'csv':
+            engine = CsvEngine(filepath, config.SIDECAR_SAVE_INTERVAL, config.CSV_EPOCH_COLUMN)
+        else:
+            raise ValueError(f'STORAGE_BACKEND non supportato: {config.STORAGE_BACKEND}')
+        _engines[filepath] = engine
+    return engine
+
+
+def append_reading(filepath, timestamp, value, flag=OK):
+    """
+    Aggiunge una lettura (timestamp, value) alla serie, alla cache e allo sketch.
+    Con il write-behind la lettura resta in RAM/journal fino al prossimo flush.
+    Idempotente per minuto: una lettura di un minuto gia scritto viene scartata.
+    Le letture con flag STALE/FAILED (vedi quality) sono scritte con il loro
+    codice ma non entrano in cache, sketch e livelli consolidati.
+    """
+    if not _accept_reading(filepath, timestamp):
+        return
+    _bump_generation(filepath)
+    if _write_behind is not None:
+        try:
+            _write_behind.add(filepath, timestamp, value, flag)
+            if _cache is not None and flag in USABLE:
+                _cache.note_append(filepath, get_engine(filepath), parse_ts(timestamp), float(value))
+        except Exception as e:
+            print(f'Errore accodamento lettura {filepath}: {e}')
+        if flag in USABLE:
+            _consolidate(filepath, timestamp, value)
+        if _write_behind.due():
+            flush_series()
+        return
 
-def append_reading(filepath, timestamp, value):
-    """Aggiunge una riga (timestamp, value) al file CSV."""
     try:
-        with open(filepath, 'a', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow([timestamp, value])
+        engine = get_engine(filepath)
+        _complete_rotation(filepath, engine)
+        # Riga scartata dai lettori: la cache resta valida se lo era prima della scrittura
+        cache_current = flag not in USABLE and _cache is not None and _cache.is_current(filepath, engine)
+        end_offset = engine.append(timestamp, value, flag)
     except Exception as e:
-        print(f'Errore scrittura CSV {filepath}: {e}')
+        print(f'Errore scrittura serie {filepath}: {e}')
+        return
 
+    if flag not in USABLE:
+        if cache_current:
+            _cache.refresh_version(filepath, engine)
+        return
+    if _cache is not None:
+        _cache.note_append(filepath, engine, parse_ts(timestamp), float(value))
+    _update_sketch(filepath, [float(value)], end_offset)
+    _consolidate(filepath, timestamp, value)
 
-def read_all_values(filepath):
-    """Restituisce la lista di tutti i valori (colonna 1) del CSV."""
-    if not os.path.exists(filepath):
-        return []
 
-    values = []
+def append_cycle(timestamp, readings, flags=None):
+    """
+    Aggiunge le letture di un ciclo di polling, {filepath: value} nell'ordine
+    di scrittura, con i flag di qualita {filepath: flag} (assente = OK).
+    Con il backend wide (senza write-behind) e una sola riga e una sola
+    scrittura per tutti i canali; altrimenti una append_reading per serie
+    (col write-behind le righe del ciclo sono riunite al flush).
+    """
+    flags = flags or {}
+    if config.STORAGE_BACKEND != 'wide' or _write_behind is not None:
+        for filepath, value in readings.items():
+            append_reading(filepath, timestamp, value, flags.get(filepath, OK))
+        return
+
+    readings = {filepath: value for filepath, value in readings.items()
+                if _accept_reading(filepath, timestamp)}
+    if not readings:
+        return
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            for row in reader:
-                if len(row) >= 2:
-                    try:
-                        values.append(float(row[1]))
-                    except ValueError:
-                        continue
+        engines = {filepath: get_engine(filepath) for filepath in readings}
+        first = next(iter(engines))
+        _complete_rotation(first, engines[first])
+        wide = engines[first].wide
+        # Canali senza lettura nel ciclo (es. solare di notte) o con lettura STALE/FAILED:
+        # la riga non li tocca, la loro cache resta valida anche se il file condiviso cambia
+        untouched = [filepath for filepath in config.WIDE_CHANNELS
+                     if (filepath not in readings or flags.get(filepath, OK) not in USABLE)
+                     and _cache is not None and _cache.is_current(filepath, get_engine(filepath))]
+        end_offset = wide.append_rows([(timestamp, {
+            engines[filepath].channel: format_cell(value, flags.get(filepath, OK))
+            for filepath, value in readings.items()})])
     except Exception as e:
-        print(f'Errore lettura CSV {filepath}: {e}')
-    return values
+        print(f'Errore scrittura ciclo {timestamp}: {e}')
+        return
 
+    epoch = parse_ts(timestamp)
+    for filepath, value in readings.items():
+        _bump_generation(filepath)
+        if flags.get(filepath, OK) not in USABLE:
+            continue
+        if _cache is not None:
+            _cache.note_append(filepath, engines[filepath], epoch, float(value))
+        _update_sketch(filepath, [float(value)], end_offset)
+        _consolidate(filepath, timestamp, value)
+    for filepath in untouched:
+        _cache.refresh_version(filepath, get_engine(filepath))
 
-def read_recent_values(filepath, max_lines=500):
-    """Restituisce gli ultimi N valori dal CSV (lettura efficiente tail)."""
-    if not os.path.exists(filepath):
-        return []
 
+def _accept_reading(filepath, timestamp):
+    """
+    False se la serie ha gia la lettura del minuto (servizio riavviato nello
+    stesso minuto): va scartata. Altrimenti registra il minuto e ritorna True.
+    Con CSV_EPOCH_COLUMN un minuto gia visto ma precedente alla coda e l'ora
+    ripetuta del ritorno all'ora solare, quindi e scartato solo il minuto in coda.
+    """
+    if not config.DEDUP_ENABLED:
+        return True
     try:
-        lines = _tail_lines(filepath, max_lines)
-        values = []
-        for line in lines:
-            parts = line.strip().split(',')
-            if len(parts) >= 2:
-                try:
-                    values.append(float(parts[1]))
-                except ValueError:
-                    continue
-        return values
+        epoch = parse_ts(timestamp)
+    except ValueError:
+        return True     # Timestamp non valido: l'errore lo segnala la scrittura
+    with _recent_keys_lock:
+        keys = _recent_keys.get(filepath)
+        if keys is None:
+            keys = _recent_keys[filepath] = _seed_recent_keys(filepath)
+        if epoch == keys.last or (epoch in keys and not config.CSV_EPOCH_COLUMN):
+            _dedup_counters['duplicates'] += 1
+            print(f'Lettura duplicata scartata: {filepath} {timestamp}')
+            return False
+        keys.add(epoch)
+        return True
+
+
+def _seed_recent_keys(filepath):
+    """
+    Indice dei minuti recenti alla prima scrittura del processo: ultime
+    DEDUP_RECENT_KEYS letture lette all'indietro dalla coda dello storage,
+    dopo aver scritto le letture ripristinate dal journal del write-behind.
+    """
+    keys = RecentKeys(config.DEDUP_RECENT_KEYS)
+    try:
+        _flush_pending(filepath)
+        rows = list(islice(get_engine(filepath).iter_range(reverse=True), config.DEDUP_RECENT_KEYS))
     except Exception as e:
-        print(f'Errore lettura CSV {filepath}: {e}')
-        return []
+        print(f'Errore lettura coda della serie {filepath}: {e}')
+        return keys
+    for epoch, _ in reversed(rows):
+        keys.add(epoch)
+    return keys
 
 
-def _tail_lines(filepath, n):
-    """Legge le ultime N righe di un file senza caricarlo tutto in memoria."""
-    with open(filepath, 'rb') as f:
-        f.seek(0, 2)
-        file_size = f.tell()
-        if file_size == 0:
-            return []
+def dedup_stats():
+    """Letture duplicate scartate dal processo e serie con l'indice dei minuti recenti."""
+    return {'duplicates': _dedup_counters['duplicates'], 'series': len(_recent_keys)}
 
-        block_size = 8192
-        blocks = []
-        remaining = file_size
-        lines_found = 0
 
-        while remaining > 0 and lines_found <= n:
-            read_size = min(block_size, remaining)
-            remaining -= read_size
-            f.seek(remaining)
-            block = f.read(read_size)
-            blocks.append(block)
-            lines_found += block.count(b'\n')
+def _consolidate(filepath, timestamp, value):
+    """Aggiorna i livelli consolidati della serie con una lettura appena scritta."""
+    if not config.TIERS_ENABLED:
+        return
+    try:
+        epoch = parse_ts(timestamp)
+        _tier_series(filepath, epoch).add(epoch, float(value))
+    except Exception as e:
+        print(f'Errore consolidamento {filepath}: {e}')
+
+
+def _tier_series(filepath, epoch=None):
+    """
+    Livelli della serie. Alla prima lettura del processo gli intervalli non
+    ancora consolidati (servizio fermo, crash) sono ripresi dalla serie al minuto.
+    """
+    with _tiers_lock:
+        tier_series = _tiers.get(filepath)
+        if tier_series is None:
+            tier_series = _tiers[filepath] = TierSeries(tier_dir(filepath), config.TIERS)
+        if epoch is not None and not tier_series.resumed:
+            tier_series.consolidate(_range_rows(filepath, tier_series.resume_from(epoch), epoch))
+            tier_series.resumed = True
+        return tier_series
 
-        content = b''.join(reversed(blocks)).decode('utf-8', errors='replace')
-        all_lines = content.splitlines()
-        return all_lines[-n:] if len(all_lines) > n else all_lines
+
+def _bump_generation(filepath):
+    _generations[filepath] = _generations.get(filepath, 0) + 1
+
+
+def series_version(filepath):
+    """
+    Token di versione della serie: generazione delle scritture del processo e
+    identita del file (cambia se il file viene sostituito, es. cleanup o conversioni).
+    """
+    try:
+        identity = get_engine(filepath).identity()
+    except Exception:
+        identity = None
+    return (_generations.get(filepath, 0), identity)
+
+
+def _flush_pending(filepath):
+    """Scrive nello storage le letture in write-behind della serie (prima di leggerla da disco)."""
+    if _write_behind is None or not _write_behind.has_pending(filepath):
+        return
+    if config.STORAGE_BACKEND == 'wide':
+        _flush_wide_pending()
+        return
+    engine = get_engine(filepath)
+
+    def write(rows, recovered):
+        _complete_rotation(filepath, engine)
+        if recovered:
+            # Replay dopo un crash: scarta le righe gia arrivate allo storage
+            last = engine.last_epoch()
+            if last is not None:
+                rows = [row for row in rows[:recovered] if parse_ts(row[0]) > last] + rows[recovered:]
+            if _cache is not None:
+                _cache.invalidate(filepath)
+        if not rows:
+            return
+        # La cache contiene gia le righe: resta valida se lo era prima del flush
+        cache_current = _cache is not None and _cache.is_current(filepath, engine)
+        end_offset = engine.append_many(rows)
+        if cache_current:
+            _cache.refresh_version(filepath, engine)
+        _update_sketch(filepath, [float(row[1]) for row in rows if row[2] in USABLE], end_offset)
+
+    try:
+        _write_behind.flush(filepath, write)
+    except Exception as e:
+        print(f'Errore flush write-behind {filepath}: {e}')
+
+
+def _flush_wide_pending():
+    """
+    Write-behind col backend wide: le letture in attesa di tutti i canali sono
+    unite per timestamp e scritte come righe complete in ordine di tempo, come
+    fa append_cycle senza write-behind. Un blocco per canale lascerebbe nel file
+    righe parziali dello stesso minuto fuori ordine (letture e bisezione rotte).
+    """
+    filepaths = list(config.WIDE_CHANNELS)
+    engines = {filepath: get_engine(filepath) for filepath in filepaths}
+    wide = engines[filepaths[0]].wide
+
+    def write(pending):
+        _complete_rotation(filepaths[0], engines[filepaths[0]])
+        cells = {}           # timestamp -> {canale: campo}
+        usable = {}          # filepath -> valori per lo sketch
+        for filepath, (rows, recovered) in pending.items():
+            engine = engines[filepath]
+            if recovered:
+                # Replay dopo un crash: scarta le righe gia arrivate allo storage
+                last = engine.last_epoch()
+                if last is not None:
+                    rows = [row for row in rows[:recovered] if parse_ts(row[0]) > last] + rows[recovered:]
+                if _cache is not None:
+                    _cache.invalidate(filepath)
+            for timestamp, value, flag in rows:
+                cells.setdefault(timestamp, {})[engine.channel] = format_cell(value, flag)
+            usable[filepath] = [float(row[1]) for row in rows if row[2] in USABLE]
+        if not cells:
+            return
+        # La cache contiene gia le righe: resta valida se lo era prima del flush
+        current = [filepath for filepath in filepaths
+                   if _cache is not None and _cache.is_current(filepath, engines[filepath])]
+        end_offset = wide.append_rows(sorted(cells.items()))
+        for filepath in current:
+            _cache.refresh_version(filepath, engines[filepath])
+        for filepath, values in usable.items():
+            _update_sketch(filepath, values, end_offset)
+
+    try:
+        _write_behind.flush_group(filepaths, write)
+    except Exception as e:
+        print(f'Errore flush write-behind {wide.path}: {e}')
+
+
+def _complete_rotation(filepath, engine):
+    """
+    Completa, nel thread che scrive la serie, la rotazione preparata dal cleanup
+    (vedi rotation): ricopia le righe accodate durante il cleanup e sostituisce
+    il file vivo, poi riallinea cache, follower e sketch dei canali del file
+    senza rileggere la serie (vedi _rotate_views).
+    """
+    pending = getattr(engine, 'rotation_pending', None)
+    if pending is None or not pending():
+        return
+    manifest = engine.rotation_manifest()
+    series = list(config.WIDE_CHANNELS) if engine.name == 'wide' else [filepath]
+    current = [name for name in series
+               if _cache is not None and _cache.is_current(name, get_engine(name))]
+    size = engine.size()
+    try:
+        copied = engine.complete_rotation()
+    except Exception as e:
+        print(f'Errore rotazione serie {filepath}: {e}')
+        return
+    removed = size - engine.size()
+    for name in series:
+        _bump_generation(name)
+        _rotate_views(name, get_engine(name), manifest, removed, name in current)
+    print(f'Rotazione serie {filepath} completata ({copied} byte scritti durante il cleanup)')
+
+
+def _rotate_views(filepath, engine, manifest, removed, cache_current):
+    """
+    Dopo la rotazione le righe mantenute sono le stesse, nello stesso ordine,
+    spostate indietro dei byte archiviati: la cache scarta le letture
+    archiviate, il follower sposta la sua posizione e lo sketch preparato dal
+    cleanup riceve le sole righe accodate dopo il sigillo. Dove non e possibile
+    (manifest di una versione precedente, processo riavviato, serie non
+    allineata) si torna all'invalidazione.
+    """
+    try:
+        first = next(iter(engine.iter_range()), (None,))[0]
+    except Exception as e:
+        print(f'Errore lettura serie ruotata {filepath}: {e}')
+        first = None
+    rotated = first is not None and manifest.get('cut') is not None
+    if _cache is not None:
+        if rotated and cache_current:
+            _cache.drop_before(filepath, engine, first)
+        else:
+            _cache.invalidate(filepath)
+    with _followers_lock:
+        follower = _followers.get(filepath)
+        if follower is not None and not (rotated and follower.rotate(manifest, removed, first)):
+            del _followers[filepath]
+    with _sketch_lock:
+        prepared = _rotation_sketches.pop(filepath, None)
+    if not rotated or prepared is None or prepared[0] is not manifest:
+        invalidate_sketch(filepath)
+        return
+    sketch = prepared[1]
+    end_offset = engine.size()
+    try:
+        for value in engine.scan_values(manifest['sealed'] - removed, end_offset):
+            sketch.update(value)
+    except Exception as e:
+        print(f'Errore lettura serie {filepath} per lo sketch: {e}')
+        invalidate_sketch(filepath)
+        return
+    state = {'sketch': sketch, 'offset': end_offset, 'inode': engine.identity(), 'saved_at': 0}
+    with _sketch_lock:
+        _sketches[filepath] = state
+        _save_sketch(filepath, state)
+
+
+def _prepare_rotation_sketches(filepath, engine):
+    """
+    Nel thread del cleanup, dopo il sigillo: sketch delle righe mantenute del
+    segmento sigillato, per le serie con uno sketch in uso. Alla rotazione
+    _rotate_views lo completa con le righe accodate nel frattempo, senza
+    ricostruirlo dall'intera serie. Uno sketch finito dopo che chi scrive ha
+    gia completato la rotazione viene scartato.
+    """
+    manifest = engine.rotation_manifest()
+    if manifest is None or manifest.get('cut') is None:
+        return
+    series = list(config.WIDE_CHANNELS) if engine.name == 'wide' else [filepath]
+    for name in series:
+        with _sketch_lock:
+            in_use = name in _sketches
+        if not in_use and not os.path.exists(_sketch_path(name)):
+            continue
+        sketch = SeriesSketch(config.SKETCH_K)
+        try:
+            for value in get_engine(name).scan_values(manifest['cut'], manifest['sealed']):
+                sketch.update(value)
+        except Exception as e:
+            print(f'Errore preparazione sketch {name}: {e}')
+            continue
+        with _sketch_lock:
+            if engine.rotation_manifest() is manifest:
+                _rotation_sketches[name] = (manifest, sketch)
+
+
+def write_behind_stats():
+    """Contatori del write-behind (letture, blocchi, syscall/byte risparmiati), None se disabilitato."""
+    return _write_behind.stats() if _write_behind is not None else None
+
+
+def flush_series():
+    """
+    Scrive su disco le letture in attesa (write-behind e batch dei motori):
+    chiamata periodicamente e all'arresto.
+    """
+    if _write_behind is not None:
+        for filepath in _write_behind.series():
+            _flush_pending(filepath)
+        _write_behind.mark_flushed()
+    for filepath, engine in list(_engines.items()):
+        flush = getattr(engine, 'flush', None)
+        if flush is None:
+            continue
+        try:
+            flush()
+        except Exception as e:
+            print(f'Errore flush serie {filepath}: {e}')
+
+
+def shutdown_series():
+    """Arresto pulito: scrive le letture in attesa e registra gli offset buoni dei file."""
+    flush_series()
+    record_good_offsets(clean=True)
+
+
+def check_integrity(filepaths):
+    """
+    Controllo di integrita all'avvio: per ogni serie verifica solo la coda del
+    file dopo l'ultimo offset buono registrato (al massimo
+    config.RECOVERY_TAIL_BYTES), ripara righe/record troncati e accoda il
+    report a config.RECOVERY_REPORT_LOG. Ritorna il report.
+    """
+    started = time.monotonic()
+    state = _load_integrity_state()
+    report = {'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+              'clean_shutdown': state.get('clean_shutdown'), 'series': {}}
+    for filepath in filepaths:
+        try:
+            engine = get_engine(filepath)
+            repair = getattr(engine, 'repair_tail', None)
+            if repair is None:
+                # SQLite: consistenza garantita dal journal WAL
+                continue
+            result = repair(state['series'].get(filepath), config.RECOVERY_TAIL_BYTES)
+        except Exception as e:
+            print(f'Errore controllo integrita {filepath}: {e}')
+            continue
+        if result is None:
+            continue
+        report['series'][filepath] = result
+        state['series'][filepath] = {key: result[key] for key in ('path', 'inode', 'offset')}
+        if result['dropped_bytes']:
+            print(f"Integrita {result['path']}: scartate {result['dropped_lines']} righe/record "
+                  f"({result['dropped_bytes']} byte) dalla coda")
+    report['elapsed'] = time.monotonic() - started
+
+    state['clean_shutdown'] = False
+    try:
+        _atomic_write_json(config.INTEGRITY_STATE_JSON, state)
+        with open(config.RECOVERY_REPORT_LOG, 'a') as f:
+            f.write(json.dumps(report) + '\n')
+    except Exception as e:
+        print(f'Errore salvataggio report di integrita: {e}')
+    if report['clean_shutdown'] is False:
+        print(f"Arresto non pulito rilevato: controllate le code di {len(report['series'])} serie "
+              f"in {report['elapsed'] * 1000:.1f} ms")
+    return report
+
+
+def record_good_offsets(clean=False):
+    """
+    Registra come buoni (dopo fsync) gli offset di fine dei file controllati
+    da check_integrity: al prossimo avvio si verifichera solo cio che segue.
+    clean=True all'arresto pulito.
+    """
+    state = _load_integrity_state()
+    for filepath, entry in state['series'].items():
+        try:
+            with open(entry['path'], 'rb') as f:
+                os.fsync(f.fileno())
+                st = os.fstat(f.fileno())
+        except FileNotFoundError:
+            continue
+        except Exception as e:
+            print(f'Errore registrazione offset buono di {filepath}: {e}')
+            continue
+        entry['inode'] = st.st_ino
+        entry['offset'] = st.st_size
+    state['clean_shutdown'] = clean
+    try:
+        _atomic_write_json(config.INTEGRITY_STATE_JSON, state)
+    except Exception as e:
+        print(f'Errore salvataggio stato di integrita: {e}')
+
+
+def _load_integrity_state():
+    try:
+        with open(config.INTEGRITY_STATE_JSON, 'r') as f:
+            state = json.load(f)
+        state.setdefault('series', {})
+        return state
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f'Stato di integrita illeggibile, controllo delle sole code: {e}')
+    return {'clean_shutdown': None, 'series': {}}
+
+
+def read_all_values(filepath):
+    """
+    Restituisce l'intera serie come Series (iterandola si ottengono i valori).
+    Fuori dalla cache la serie e seguita in coda: ogni chiamata legge solo le righe nuove.
+    """
+    buffer = _cached_buffer(filepath)
+    if _cache_served(buffer is not None and buffer.complete):
+        return _buffer_series(buffer, len(buffer))
+    _flush_pending(filepath)
+    try:
+        if config.TAIL_FOLLOW_ENABLED:
+            return _follow(filepath)
+        return Series(*get_engine(filepath).load_arrays())
+    except Exception as e:
+        print(f'Errore lettura serie {filepath}: {e}')
+        return Series()
+
+
+def _follow(filepath):
+    """Serie intera aggiornata per differenza dal follower della serie (vedi tail_follower)."""
+    with _followers_lock:
+        follower = _followers.get(filepath)
+        if follower is None:
+            follower = _followers[filepath] = TailFollower(get_engine(filepath))
+        return follower.refresh()
+
+
+def _forget_follower(filepath):
+    """Il prossimo read_all_values rilegge la serie da capo (file riscritto dal processo)."""
+    with _followers_lock:
+        _followers.pop(filepath, None)
+
+
+def tail_follower_stats():
+    """Per serie: letture in memoria, righe lette in totale e reset dei follower."""
+    with _followers_lock:
+        return {filepath: follower.stats() for filepath, follower in _followers.items()}
+
+
+def read_recent_values(filepath, max_lines=500):
+    """Restituisce gli ultimi N valori della serie come Series (lettura all'indietro dalla fine)."""
+    if max_lines <= 0:
+        return Series()
+    buffer = _cached_buffer(filepath)
+    if _cache_served(buffer is not None and (buffer.complete or len(buffer) >= max_lines)):
+        return _buffer_series(buffer, max_lines)
+    _flush_pending(filepath)
+    try:
+        rows = list(islice(get_engine(filepath).iter_range(reverse=True), max_lines))
+        rows.reverse()
+        return Series.from_pairs(rows)
+    except Exception as e:
+        print(f'Errore lettura serie {filepath}: {e}')
+        return Series()
+
+
+def _buffer_series(buffer, n):
+    """Copia compatta delle ultime n letture del buffer (che continua a crescere)."""
+    count = len(buffer)
+    first = max(0, count - n)
+    return Series(buffer.times[first:count], buffer.values[first:count])
 
 
 def read_day_values(filepath, target_date, start_hour, end_hour):
     """
-    Restituisce la lista di coppie (timestamp, power) per il giorno target_date,
-    filtrando solo i record tra start_hour e end_hour.
+    Restituisce le letture del giorno target_date tra start_hour e end_hour
+    come Series (items() per le coppie (timestamp, power)).
     """
-    if not os.path.exists(filepath):
-        return []
+    return Series(*_day_arrays(filepath, target_date, start_hour, end_hour))
+
 
-    date_prefix = target_date.strftime('%Y_%m_%d_')
-    data = []
+def _day_arrays(filepath, target_date, start_hour, end_hour):
+    """Letture del giorno tra start_hour ed end_hour come array (epoch wall clock, valori)."""
+    day_epoch = datetime_to_epoch(datetime.combine(target_date, datetime.min.time()))
+    times = array('q')
+    values = array('d')
+    for epoch, value in _range_rows(filepath, day_epoch + start_hour * 3600,
+                                    day_epoch + end_hour * 3600):
+        times.append(epoch)
+        values.append(value)
+    return times, values
 
+
+def read_series_ndarrays(filepath):
+    """
+    Intera serie come array NumPy (datetime64[s], float64), dalla cache residente
+    o con un unico caricamento bulk del motore. Gli array restano in memoria
+    finche il token di versione della serie non cambia (di notte: una sola
+    lettura). None se NumPy non e installato o la lettura fallisce.
+    """
+    if not vectorized.available():
+        return None
+    version = series_version(filepath)
+    cached = _ndarrays.get(filepath)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    buffer = _cached_buffer(filepath)
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            for row in reader:
-                if len(row) < 2:
-                    continue
-                if not row[0].startswith(date_prefix):
-                    continue
-                try:
-                    ts = datetime.strptime(row[0], '%Y_%m_%d_%H:%M')
-                    if start_hour <= ts.hour < end_hour:
-                        power = float(row[1])
-                        data.append((ts, power))
-                except (ValueError, IndexError):
-                    continue
+        if _cache_served(buffer is not None and buffer.complete):
+            arrays = vectorized.to_ndarrays(buffer.times, buffer.values)
+        else:
+            _flush_pending(filepath)
+            if config.TAIL_FOLLOW_ENABLED:
+                arrays = vectorized.to_ndarrays(*_follow(filepath).to_arrays())
+            else:
+                arrays = vectorized.to_ndarrays(*get_engine(filepath).load_arrays())
     except Exception as e:
-        print(f'Errore lettura dati giornalieri da {filepath}: {e}')
+        print(f'Errore lettura serie {filepath}: {e}')
+        return None
+    _ndarrays[filepath] = (version, arrays)
+    return arrays
+
+
+def query(filepath, start=None, end=None, bucket=None, agg=None):
+    """
+    Interrogazione generale di una serie tra start incluso ed end escluso
+    (datetime, date o None = senza limite), su archivio e serie viva insieme.
 
-    return data
+    Senza agg: generatore di coppie (timestamp, value).
+    Con agg (es. ['mean', 'max', 'p98']): generatore di (inizio bucket, {agg: valore})
+    con bucket = secondi, timedelta o '15m'/'1h'/'1d' (None = un unico bucket).
+
+    I limiti di tempo arrivano al motore (indice giorni, partizioni, ricerca
+    binaria, chiave SQL, blocchi d'archivio) e le righe sono lette in streaming;
+    le letture recenti gia in cache non toccano il disco.
+    """
+    start_epoch = _to_epoch(start)
+    end_epoch = _to_epoch(end)
+    rows = _range_rows(filepath, start_epoch, end_epoch)
+    if agg is None:
+        return ((epoch_to_datetime(epoch), value) for epoch, value in rows)
+    buckets = series_query.aggregate(rows, series_query.parse_bucket(bucket), agg, start_epoch,
+                                     config.SKETCH_K)
+    return ((epoch_to_datetime(bucket_start), stats) for bucket_start, stats in buckets)
+
+
+def iter_range(filepath, start=None, end=None, reverse=False):
+    """
+    Generatore pigro di coppie (timestamp, value) tra start incluso ed end
+    escluso (datetime, date o None = senza limite), su archivio e serie viva.
+    Con reverse=True le righe arrivano dalla piu recente: i file sono letti a
+    blocchi all'indietro dalla fine e la lettura si ferma appena si supera
+    start, quindi una finestra recente costa quanto la finestra, non il file.
+    """
+    for epoch, value in _range_rows(filepath, _to_epoch(start), _to_epoch(end), reverse):
+        yield epoch_to_datetime(epoch), value
+
+
+def iter_quality_flags(filepath, start=None, end=None):
+    """
+    Letture non OK della serie tra start incluso ed end escluso (datetime, date
+    o None), come coppie (timestamp, 'stale' | 'failed' | 'interpolated').
+    Le altre letture non vengono convertite: si legge solo il codice di qualita.
+    """
+    _flush_pending(filepath)
+    try:
+        for epoch, flag in get_engine(filepath).iter_flags(_to_epoch(start), _to_epoch(end)):
+            yield epoch_to_datetime(epoch), QUALITY_NAMES[flag]
+    except Exception as e:
+        print(f'Errore lettura flag di qualita {filepath}: {e}')
+
+
+def outage_windows(filepath, start=None, end=None):
+    """
+    Finestre di disservizio della serie: letture STALE/FAILED consecutive (a
+    distanza <= POLL_INTERVAL) unite in {'start', 'end', 'readings', 'failed',
+    'stale'}, con end = timestamp dell'ultima lettura della finestra.
+    """
+    windows = []
+    current = None
+    for ts, name in iter_quality_flags(filepath, start, end):
+        if name == 'interpolated':
+            continue
+        if current is None or (ts - current['end']).total_seconds() > config.POLL_INTERVAL:
+            current = {'start': ts, 'end': ts, 'readings': 0, 'failed': 0, 'stale': 0}
+            windows.append(current)
+        current['end'] = ts
+        current['readings'] += 1
+        current[name] += 1
+    return windows
+
+
+def _to_epoch(value):
+    if value is None:
+        return None
+    if not isinstance(value, datetime):
+        value = datetime.combine(value, datetime.min.time())
+    return datetime_to_epoch(value)
+
+
+def _range_rows(filepath, start, end, reverse=False):
+    """
+    Righe (epoch, value) con start <= epoch < end: prima l'archivio, poi la
+    serie viva (con reverse=True l'ordine e invertito, dalla lettura piu recente).
+    """
+    try:
+        engine = get_engine(filepath)
+        buffer = _cached_buffer(filepath)
+        cached = _cache_served(buffer is not None and len(buffer) > 0 and (
+            buffer.complete or (start is not None and buffer.first_time() <= start)))
+        # L'archivio contiene solo letture precedenti alla serie viva
+        archived = not cached or start is None or start < buffer.first_time()
+        if archived and not reverse:
+            yield from engine.iter_archive(start, end)
+        if cached:
+            first, last = buffer.range_indexes(start if start is not None else buffer.first_time(),
+                                               end if end is not None else buffer.times[-1] + 1)
+            if reverse:
+                for index in range(last - 1, first - 1, -1):
+                    yield buffer.times[index], buffer.values[index]
+            else:
+                yield from zip(buffer.times[first:last], buffer.values[first:last])
+        else:
+            _flush_pending(filepath)
+            yield from engine.iter_range(start, end, reverse)
+        if archived and reverse:
+            yield from engine.iter_archive(start, end, reverse)
+    except Exception as e:
+        print(f'Errore interrogazione serie {filepath}: {e}')
+
+
+def read_consolidated(filepath, start=None, end=None, tier=None):
+    """
+    Letture consolidate (timestamp di inizio intervallo, {min, max, mean, last, count})
+    tra start incluso ed end escluso (datetime, date o None), dal livello tier
+    ('15m', '1h', ...) o, con tier=None, dal livello piu fine che copre start
+    con al piu TIER_MAX_POINTS punti: un intervallo di anni legge poche migliaia di righe.
+    """
+    start_epoch = _to_epoch(start)
+    end_epoch = _to_epoch(end)
+    try:
+        tier_series = _tier_series(filepath)
+        level = tier_series.tier(tier) if tier is not None else \
+            tier_series.choose(start_epoch, end_epoch, config.TIER_MAX_POINTS)
+        for epoch, stats in level.iter_rows(start_epoch, end_epoch):
+            yield epoch_to_datetime(epoch), stats
+    except Exception as e:
+        print(f'Errore lettura consolidati {filepath}: {e}')
+
+
+def rebuild_tiers(filepath):
+    """
+    Ricostruisce i livelli consolidati dall'intera serie (archivio incluso),
+    per l'attivazione su uno storico esistente (storage_tools.py tiers).
+    Ritorna {livello: righe scritte}.
+    """
+    _flush_pending(filepath)
+    directory = tier_dir(filepath)
+    for name, _, _ in config.TIERS:
+        try:
+            os.remove(os.path.join(directory, f'{name}.csv'))
+        except FileNotFoundError:
+            pass
+    with _tiers_lock:
+        tier_series = _tiers[filepath] = TierSeries(directory, config.TIERS)
+        tier_series.resumed = True
+    return tier_series.consolidate(_range_rows(filepath, None, None))
+
+
+def iter_archive(filepath, start_date=None, end_date=None):
+    """
+    Iteratore in streaming sulle letture archiviate dal cleanup, come coppie
+    (timestamp, power) tra start_date incluso ed end_date escluso (None = senza limite).
+    Legge solo i blocchi d'archivio che intersecano l'intervallo.
+    """
+    start = datetime_to_epoch(datetime.combine(start_date, datetime.min.time())) \
+        if start_date is not None else None
+    end = datetime_to_epoch(datetime.combine(end_date, datetime.min.time())) \
+        if end_date is not None else None
+    try:
+        for epoch, value in get_engine(filepath).iter_archive(start, end):
+            yield epoch_to_datetime(epoch), value
+    except Exception as e:
+        print(f'Errore lettura archivio {filepath}: {e}')
+
+
+def cache_stats():
+    """Statistiche della cache residente (hit/miss, caricamenti, byte), None se disabilitata."""
+    return _cache.stats() if _cache is not None else None
+
+
+def _cached_buffer(filepath):
+    """Buffer in memoria della serie, None se la cache e disabilitata o non caricabile."""
+    if _cache is None:
+        return None
+    try:
+        engine = get_engine(filepath)
+        if not _cache.is_current(filepath, engine):
+            # Il (ri)caricamento legge dal disco: prima vi scrive le letture in attesa
+            _flush_pending(filepath)
+        return _cache.get(filepath, engine)
+    except Exception as e:
+        print(f'Errore caricamento cache della serie {filepath}: {e}')
+        return None
+
+
+def _cache_served(served):
+    """Registra hit/miss della cache e restituisce served."""
+    if _cache is not None:
+        if served:
+            _cache.record_hit()
+        else:
+            _cache.record_miss()
+    return served
 
 
 def get_day_power_chart(filepath, num_bars=8, day_start_hour=6, day_end_hour=20):
     """
     Calcola i valori per il grafico a barre giornaliero (0-8 per ogni barra),
     normalizzando rispetto al 98esimo percentile storico.
+    Per un giorno gia concluso usa il rollup materializzato (slot da 15 minuti)
+    quando le barre sono allineate agli slot; altrimenti le letture grezze.
+    Medie e livelli sono calcolati con NumPy se disponibile (config.NUMPY_ENABLED).
+    Il risultato e memorizzato per giorno, barre e ore con il token di versione
+    della serie: di notte (nessuna nuova lettura solare) viene calcolato una volta.
     """
     now = datetime.now()
     target_date = now.date() if now.hour >= day_start_hour else (now - timedelta(days=1)).date()
 
-    day_data = read_day_values(filepath, target_date, day_start_hour, day_end_hour)
-    daylight_data = [(ts, power) for ts, power in day_data if power > 0]
+    key = (filepath, target_date, num_bars, day_start_hour, day_end_hour)
+    version = series_version(filepath)
+    memo = _chart_memo.get(key)
+    if memo is not None and memo[0] == version:
+        _chart_memo_counters['hits'] += 1
+        return list(memo[1])
+    _chart_memo_counters['misses'] += 1
+    levels = _compute_day_power_chart(filepath, target_date, num_bars, day_start_hour, day_end_hour)
+    # Le voci dei giorni precedenti non servono piu
+    for old_key in [k for k in _chart_memo if k[0] == filepath and k[1] != target_date]:
+        del _chart_memo[old_key]
+    _chart_memo[key] = (version, levels)
+    return list(levels)
+
+
+def chart_memo_stats():
+    """Hit/miss della memoizzazione di get_day_power_chart."""
+    return dict(_chart_memo_counters, entries=len(_chart_memo))
+
+
+def _compute_day_power_chart(filepath, target_date, num_bars, day_start_hour, day_end_hour):
+    """Livelli 0-8 delle barre del giorno target_date (vedi get_day_power_chart)."""
+    arrays = read_series_ndarrays(filepath) if config.NUMPY_ENABLED else None
+    now = datetime.now()
 
-    if not daylight_data:
+    averages = None
+    if target_date < now.date():
+        averages = _bar_averages_from_rollup(filepath, target_date, num_bars,
+                                             day_start_hour, day_end_hour)
+    if averages is None:
+        averages = _bar_averages(filepath, arrays, target_date, num_bars,
+                                 day_start_hour, day_end_hour)
+
+    if not any(avg is not None for avg in averages):
         return [0] * num_bars
+    return _bar_levels(filepath, arrays, averages)
+
+
+def _bar_averages(filepath, arrays, target_date, num_bars, day_start_hour, day_end_hour):
+    """Medie per barra dalle letture grezze: sugli array NumPy se presenti, altrimenti riga per riga."""
+    if arrays is None:
+        return _bar_averages_from_rows(filepath, target_date, num_bars,
+                                       day_start_hour, day_end_hour)
+    day_epoch = datetime_to_epoch(datetime.combine(target_date, datetime.min.time()))
+    return vectorized.to_list(vectorized.bar_averages(
+        arrays[0], arrays[1], day_epoch + day_start_hour * 3600,
+        day_epoch + day_end_hour * 3600, num_bars))
+
+
+def _bar_levels(filepath, arrays, averages):
+    """
+    Livelli 0-8 normalizzati sul 98esimo percentile storico dei valori positivi,
+    calcolato sulla serie intera (array NumPy o serie in memoria, stessa semantica).
+    """
+    if arrays is not None:
+        historical_max = vectorized.percentile_positive(arrays[1], 98)
+    else:
+        historical_max = read_all_values(filepath).positive().percentile(98)
+    if historical_max is None:
+        historical_max = 1
 
-    all_values = read_all_values(filepath)
-    positive_values = [v for v in all_values if v > 0]
-    historical_max = _percentile(positive_values, 98) if positive_values else 1
+    if historical_max == 0:
+        return [0] * len(averages)
+    if arrays is not None:
+        return vectorized.bar_levels(averages, historical_max)
+
+    levels = []
+    for avg in averages:
+        if avg is not None:
+            ratio = avg / historical_max
+            level = 8 if ratio >= 0.9 else min(8, max(0, round(ratio * 8)))
+        else:
+            level = 0
+        levels.append(level)
+
+    return levels
+
+
+def chart_parity(filepath, target_dates, num_bars=8, day_start_hour=6, day_end_hour=20):
+    """
+    Confronta giorno per giorno il percorso NumPy con quello Python puro sulle
+    letture grezze: medie per barra con tolleranza relativa 1e-9 (l'ordine
+    delle somme differisce), livelli esatti. Ritorna [(data, livelli NumPy,
+    livelli Python, medie NumPy, medie Python)] dei giorni diversi.
+    ValueError se NumPy non e installato.
+    """
+    arrays = read_series_ndarrays(filepath)
+    if arrays is None:
+        raise ValueError('NumPy non installato: nessun percorso vettoriale da confrontare')
+    differences = []
+    for target_date in target_dates:
+        numpy_averages = _bar_averages(filepath, arrays, target_date, num_bars,
+                                       day_start_hour, day_end_hour)
+        python_averages = _bar_averages(filepath, None, target_date, num_bars,
+                                        day_start_hour, day_end_hour)
+        numpy_levels = _bar_levels(filepath, arrays, numpy_averages)
+        python_levels = _bar_levels(filepath, None, python_averages)
+        same_averages = all(
+            (a is None and b is None) or
+            (a is not None and b is not None and math.isclose(a, b, rel_tol=1e-9))
+            for a, b in zip(numpy_averages, python_averages))
+        if not same_averages or numpy_levels != python_levels:
+            differences.append((target_date, numpy_levels, python_levels,
+                                numpy_averages, python_averages))
+    return differences
+
+
+def _bar_averages_from_rows(filepath, target_date, num_bars, day_start_hour, day_end_hour):
+    """Media dei valori positivi per barra dalle letture grezze (None = barra vuota)."""
+    day_data = read_day_values(filepath, target_date, day_start_hour, day_end_hour)
+    daylight_data = day_data.positive().items()
 
     start_time = datetime.combine(target_date, datetime.min.time().replace(hour=day_start_hour))
     end_time = datetime.combine(target_date, datetime.min.time().replace(hour=day_end_hour))
@@ -150,61 +1022,422 @@ def get_day_power_chart(filepath, num_bars=8, day_start_hour=6, day_end_hour=20)
         index = min(int((elapsed / total_seconds) * num_bars), num_bars - 1)
         buckets[index].append(power)
 
-    if historical_max == 0:
-        return [0] * num_bars
+    return [sum(bucket) / len(bucket) if bucket else None for bucket in buckets]
 
-    levels = []
-    for bucket in buckets:
-        if bucket:
-            avg = sum(bucket) / len(bucket)
-            ratio = avg / historical_max
-            level = 8 if ratio >= 0.9 else min(8, max(0, round(ratio * 8)))
+
+def _bar_averages_from_rollup(filepath, target_date, num_bars, day_start_hour, day_end_hour):
+    """Media per barra dagli slot del rollup; None se le barre non sono allineate agli slot."""
+    window_minutes = (day_end_hour - day_start_hour) * 60
+    if window_minutes <= 0 or window_minutes % (num_bars * rollups.SLOT_MINUTES):
+        return None
+    rollup_data = _day_rollup(filepath, target_date)
+    if rollup_data is None:
+        return None
+
+    slots_per_bar = window_minutes // (num_bars * rollups.SLOT_MINUTES)
+    first_slot = day_start_hour * 60 // rollups.SLOT_MINUTES
+    averages = []
+    for bar in range(num_bars):
+        start = first_slot + bar * slots_per_bar
+        pos_count, pos_sum = rollups.slot_range_stats(rollup_data, start, start + slots_per_bar)
+        averages.append(pos_sum / pos_count if pos_count else None)
+    return averages
+
+
+def build_day_rollup(filepath, target_date):
+    """
+    Materializza il rollup (slot da 15 minuti + giornata) di un giorno concluso.
+    Chiamata dal thread di mezzanotte per il giorno appena finito.
+    """
+    sample_hours = config.POLL_INTERVAL / 3600
+    _flush_pending(filepath)
+    try:
+        engine = get_engine(filepath)
+        if hasattr(engine, 'bucket_stats'):
+            # Aggregati per slot calcolati dal motore (SQL) senza leggere le righe
+            start = datetime_to_epoch(datetime.combine(target_date, datetime.min.time()))
+            slot_stats = engine.bucket_stats(start, start + 86400, rollups.SLOT_MINUTES * 60)
+            rollup_data = rollups.rollup_from_slot_stats(slot_stats, target_date, sample_hours)
         else:
-            level = 0
-        levels.append(level)
+            rollup_data = rollups.compute_day_rollup(engine.day_rows(target_date), target_date,
+                                                     sample_hours)
+        rollups.save_day_rollup(filepath, rollup_data)
+        return rollup_data
+    except Exception as e:
+        print(f'Errore creazione rollup {target_date} di {filepath}: {e}')
+        return None
 
-    return levels
 
+def read_daily_rollups(filepath, start_date, end_date):
+    """
+    Statistiche giornaliere (min/max/mean/count/energy) tra start_date ed
+    end_date inclusi, solo per giorni conclusi. Ritorna [(date, stats)].
+    """
+    result = []
+    day = start_date
+    last = min(end_date, datetime.now().date() - timedelta(days=1))
+    while day <= last:
+        rollup_data = _day_rollup(filepath, day)
+        if rollup_data is not None and rollup_data['day']['count']:
+            result.append((day, rollup_data['day']))
+        day += timedelta(days=1)
+    return result
 
-def cleanup_csv(filepath, max_age_days=365):
-    """Archivia i record piu vecchi di max_age_days e riscrive il CSV con i soli recenti."""
-    if not os.path.exists(filepath):
-        return
 
-    threshold_date = datetime.now() - timedelta(days=max_age_days)
+def _day_rollup(filepath, target_date):
+    """Rollup di un giorno passato: da disco, o materializzato al volo se manca."""
+    if target_date >= datetime.now().date():
+        return None
+    rollup_data = rollups.load_day_rollup(filepath, target_date)
+    if rollup_data is None:
+        rollup_data = build_day_rollup(filepath, target_date)
+    return rollup_data
+
+
+def cleanup_csv(filepath, max_age_days=None):
+    """
+    Archivia i record piu vecchi di max_age_days e sostituisce la serie con i soli recenti.
+    Default: 365 giorni, o TIER_RAW_DAYS con i livelli consolidati attivi (la cui
+    retention viene applicata qui). Ritorna le statistiche del motore (byte spostati, tempo) o None.
+    Con i motori a file singolo (csv, binary, wide) il cleanup lavora solo sui byte
+    gia scritti e il file vivo e sostituito da chi scrive alla scrittura successiva
+    (vedi rotation): il polling non aspetta il cleanup e non perde righe.
+    I canali del backend wide condividono il file: vanno puliti insieme con cleanup_wide.
+    """
+    if config.STORAGE_BACKEND == 'wide' and filepath in config.WIDE_CHANNELS:
+        print(f'Cleanup {filepath} non eseguito: canale del file wide {config.WIDE_CSV}, usare cleanup_wide')
+        return None
+    return _cleanup(filepath, [filepath], max_age_days)
+
+
+def cleanup_wide(max_age_days=None):
+    """
+    Cleanup del file wide (STORAGE_BACKEND = 'wide'): un solo passaggio che
+    archivia e ruota le righe di tutti i canali di config.WIDE_CHANNELS, con la
+    retention dei livelli consolidati di ogni canale. Come cleanup_csv.
+    """
+    return _cleanup(next(iter(config.WIDE_CHANNELS)), list(config.WIDE_CHANNELS), max_age_days)
+
+
+def _cleanup(filepath, series, max_age_days):
+    """Cleanup del motore di filepath, condiviso dalle serie in series."""
+    if max_age_days is None:
+        max_age_days = config.TIER_RAW_DAYS if config.TIERS_ENABLED else 365
+    for name in series:
+        if not config.TIERS_ENABLED:
+            break
+        try:
+            removed = _tier_series(name).cleanup()
+            print(f'Retention livelli consolidati {name}: '
+                  + ', '.join(f'{tier} -{size} byte' for tier, size in removed.items()))
+        except Exception as e:
+            print(f'Errore retention livelli consolidati {name}: {e}')
+    stats = None
+    _flush_pending(filepath)
+    for name in series:
+        _bump_generation(name)
+    try:
+        engine = get_engine(filepath)
+        stats = engine.cleanup(max_age_days)
+        if getattr(engine, 'rotation_pending', lambda: False)():
+            # File vivo ancora intatto: cache e sketch riallineati da _complete_rotation
+            if stats is not None:
+                _prepare_rotation_sketches(filepath, engine)
+            print(f'Cleanup serie preparato: {", ".join(series)} (rotazione alla prossima scrittura)')
+            return stats
+        for name in series:
+            if _cache is not None:
+                _cache.invalidate(name)
+            invalidate_sketch(name)
+            _forget_follower(name)
+        print(f'Cleanup serie completato: {", ".join(series)}')
+    except Exception as e:
+        print(f'Errore durante cleanup serie {", ".join(series)}: {e}')
+    return stats
+
+
+def get_series_sketch(filepath):
+    """
+    Restituisce lo SeriesSketch della serie (percentili, min/max) per la scala
+    dei LED. Lo sketch e salvato accanto al CSV (<nome>_sketch.json): al primo
+    accesso viene caricato e allineato leggendo solo le righe aggiunte dopo
+    l'ultimo salvataggio; viene ricostruito dalla serie solo se manca o e stale.
+    """
+    with _sketch_lock:
+        state = _sketches.get(filepath)
+        if state is None:
+            state = _load_sketch(filepath)
+            _sketches[filepath] = state
+        return state['sketch']
+
+
+def invalidate_sketch(filepath):
+    """Scarta lo sketch (memoria e disco): verra ricostruito al prossimo accesso."""
+    with _sketch_lock:
+        _sketches.pop(filepath, None)
+        try:
+            os.remove(_sketch_path(filepath))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f'Errore rimozione sketch di {filepath}: {e}')
+
+
+def _sketch_path(filepath):
+    return os.path.splitext(filepath)[0] + '_sketch.json'
+
+
+def _update_sketch(filepath, values, end_offset):
+    """Aggiornamento O(1) per valore dello sketch gia in memoria dopo un append."""
+    with _sketch_lock:
+        state = _sketches.get(filepath)
+        if state is None:
+            return
+        for value in values:
+            state['sketch'].update(value)
+        state['offset'] = end_offset
+        if state['inode'] is None:
+            state['inode'] = get_engine(filepath).identity()
+        if time.time() - state['saved_at'] >= config.SIDECAR_SAVE_INTERVAL:
+            _save_sketch(filepath, state)
+
+
+def _load_sketch(filepath):
+    """Carica lo sketch da disco e lo allinea alla serie, ricostruendolo se stale."""
+    engine = get_engine(filepath)
+    inode = engine.identity()
+    state = None
+    try:
+        with open(_sketch_path(filepath), 'r') as f:
+            data = json.load(f)
+        if data.get('engine') == engine.name:
+            state = {
+                'sketch': SeriesSketch.from_dict(data['sketch']),
+                'offset': data['offset'],
+                'inode': data['inode'],
+                'saved_at': 0,
+            }
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f'Sketch di {filepath} illeggibile, ricostruzione: {e}')
+
+    end_offset = engine.size()
+    rebuilt = state is None or inode is None or state['inode'] != inode \
+        or end_offset < state['offset']
+    if rebuilt:
+        state = {'sketch': SeriesSketch(config.SKETCH_K), 'offset': 0,
+                 'inode': inode, 'saved_at': 0}
+
+    if inode is not None and (rebuilt or end_offset != state['offset']):
+        try:
+            source = _parallel_source(engine) if rebuilt and end_offset >= config.PARALLEL_MIN_BYTES else None
+            if source is not None:
+                # Ricostruzione completa di una serie grande: sketch parziali in parallelo, poi fusi
+                state['sketch'] = parallel_load.scan_file(source[0], source[1], sketch_k=config.SKETCH_K,
+                                                          stop=end_offset,
+                                                          workers=config.PARALLEL_WORKERS).sketch
+            else:
+                for value in engine.scan_values(state['offset'], end_offset):
+                    state['sketch'].update(value)
+        except Exception as e:
+            print(f'Errore lettura serie {filepath} per lo sketch: {e}')
+        state['offset'] = end_offset
+        _save_sketch(filepath, state)
+    return state
 
+
+def _save_sketch(filepath, state):
+    data = {'engine': get_engine(filepath).name, 'sketch': state['sketch'].to_dict(),
+            'offset': state['offset'], 'inode': state['inode']}
     try:
-        all_data = []
-        with open(filepath, 'r', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            for row in reader:
-                if len(row) >= 2:
-                    try:
-                        ts = datetime.strptime(row[0], '%Y_%m_%d_%H:%M')
-                        power = float(row[1])
-                        all_data.append((ts, power))
-                    except (ValueError, IndexError):
-                        continue
+        _atomic_write_json(_sketch_path(filepath), data)
+        state['saved_at'] = time.time()
+    except Exception as e:
+        print(f'Errore salvataggio sketch di {filepath}: {e}')
+
 
-        old_data = [(ts, p) for ts, p in all_data if ts < threshold_date]
-        recent_data = [(ts, p) for ts, p in all_data if ts >= threshold_date]
+def _parallel_source(engine):
+    """
+    (file di testo, colonna del valore, directory d'archivio) della serie per
+    la scansione parallela, None se il motore non la supporta.
+    """
+    if engine.name == 'csv':
+        return engine.path, 0, archive_dir(engine.path)
+    if engine.name == 'wide':
+        column = engine.wide.column(engine.channel)
+        if column is not None:
+            return engine.path, column, archive_dir(engine.path)
+    return None
+
+
+def _timed_scan(job, workers, compare):
+    """Esegue job(workers); con compare anche in seriale per misurare lo speedup."""
+    workers = workers or config.PARALLEL_WORKERS or parallel_load.default_workers()
+    if compare:
+        return parallel_load.measure_speedup(job, workers)
+    started = time.perf_counter()
+    result = job(workers)
+    return result, {'parallel': time.perf_counter() - started, 'workers': workers}
+
+
+def rebuild_indexes(filepath, workers=None, compare=False):
+    """
+    Ricostruisce con un'unica scansione parallela (serie viva + archivio)
+    indice giorni, sketch dei quantili e rollup di tutti i giorni conclusi.
+    Lavoro bulk offline (storage_tools.py rebuild), solo motori CSV e wide.
+    Ritorna {'rows', 'days', 'rollups', 'timing'}.
+    """
+    _flush_pending(filepath)
+    engine = get_engine(filepath)
+    source = _parallel_source(engine)
+    if source is None:
+        raise ValueError(f'Scansione parallela non supportata dal motore {engine.name}')
+    path, column, archive_directory = source
+    inode = engine.identity()
+    size = engine.size()
+    slot_seconds = rollups.SLOT_MINUTES * 60
+
+    def job(job_workers):
+        archived = parallel_load.scan_archive(archive_directory, column, bucket_seconds=slot_seconds,
+                                              workers=job_workers)
+        live = parallel_load.scan_file(path, column, sketch_k=config.SKETCH_K, bucket_seconds=slot_seconds,
+                                       spans=True, stop=size, workers=job_workers)
+        return archived, live
+
+    (archived, live), timing = _timed_scan(job, workers, compare)
+    engine.day_index.replace(live.days, live.end, inode)
+    with _sketch_lock:
+        state = {'sketch': live.sketch, 'offset': live.end, 'inode': inode, 'saved_at': 0}
+        _sketches[filepath] = state
+        _save_sketch(filepath, state)
+    total = archived.merge(live)
+    saved = _save_slot_rollups(filepath, total.bucket_stats())
+    return {'rows': total.count, 'days': len(live.days), 'rollups': saved, 'timing': timing}
+
+
+def _save_slot_rollups(filepath, bucket_stats):
+    """Salva i rollup dei giorni conclusi dalle statistiche per slot {inizio slot: stats}."""
+    slot_seconds = rollups.SLOT_MINUTES * 60
+    days = {}
+    for start, stats in bucket_stats.items():
+        day_start = start - start % 86400
+        days.setdefault(day_start, {})[(start - day_start) // slot_seconds] = stats
+    today = datetime.now().date()
+    sample_hours = config.POLL_INTERVAL / 3600
+    saved = 0
+    for day_start, slot_stats in days.items():
+        target_date = epoch_to_datetime(day_start).date()
+        if target_date >= today:
+            continue
+        rollups.save_day_rollup(filepath, rollups.rollup_from_slot_stats(slot_stats, target_date, sample_hours))
+        saved += 1
+    return saved
+
+
+def yearly_report(filepath, year, workers=None, compare=False):
+    """
+    Report annuale della serie (archivio incluso) con una scansione parallela:
+    statistiche per mese e per l'anno, percentili dei valori positivi dallo
+    sketch fuso, daily yield misurato per mese (yield_kwh, None senza storico).
+    Ritorna {'months': [...], 'year': {...}, 'percentiles', 'timing'}.
+    """
+    _flush_pending(filepath)
+    engine = get_engine(filepath)
+    source = _parallel_source(engine)
+    if source is None:
+        raise ValueError(f'Scansione parallela non supportata dal motore {engine.name}')
+    path, column, archive_directory = source
+    start = datetime_to_epoch(datetime(year, 1, 1))
+    end = datetime_to_epoch(datetime(year + 1, 1, 1))
+    first_byte = engine.day_index.offset_from(date(year, 1, 1))
+    last_byte = engine.day_index.offset_from(date(year + 1, 1, 1))
 
-        if old_data:
-            archive_path = filepath.replace('.csv', '_archive.csv')
-            with open(archive_path, 'a', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f)
-                for ts, power in old_data:
-                    writer.writerow([ts.strftime('%Y_%m_%d_%H:%M'), power])
-            print(f'Archiviati {len(old_data)} record in {archive_path}')
+    def job(job_workers):
+        result = parallel_load.scan_archive(archive_directory, column, sketch_k=config.SKETCH_K,
+                                            bucket_seconds=86400, epoch_start=start, epoch_end=end,
+                                            workers=job_workers)
+        if first_byte is not None:
+            result.merge(parallel_load.scan_file(path, column, sketch_k=config.SKETCH_K, bucket_seconds=86400,
+                                                 start=first_byte, stop=last_byte, epoch_start=start,
+                                                 epoch_end=end, workers=job_workers))
+        return result
 
-        with open(filepath, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            for ts, power in recent_data:
-                writer.writerow([ts.strftime('%Y_%m_%d_%H:%M'), power])
+    result, timing = _timed_scan(job, workers, compare)
+    sample_hours = config.POLL_INTERVAL / 3600
+    months = {}
+    for day_start, stats in result.bucket_stats().items():
+        month = months.setdefault(epoch_to_datetime(day_start).strftime('%Y-%m'),
+                                  {'days': 0, 'count': 0, 'sum': 0.0, 'min': None, 'max': None})
+        month['days'] += 1
+        month['count'] += stats['count']
+        month['sum'] += stats['sum']
+        month['min'] = stats['min'] if month['min'] is None else min(month['min'], stats['min'])
+        month['max'] = stats['max'] if month['max'] is None else max(month['max'], stats['max'])
+    for month in months.values():
+        month['mean'] = month['sum'] / month['count']
+        month['energy'] = month['sum'] * sample_hours
+    # Produzione misurata dall'inverter (storico daily yield) per il confronto
+    yields = {}
+    for record in read_daily_yields(date(year, 1, 1), date(year, 12, 31)):
+        key = record.date.strftime('%Y-%m')
+        yields[key] = yields.get(key, 0.0) + record.energy_kwh
+    for key, month in months.items():
+        month['yield_kwh'] = yields.get(key)
+    year_stats = {'days': len(result.buckets), 'count': result.count, 'sum': result.sum, 'min': result.min,
+                  'max': result.max, 'mean': result.mean(), 'energy': result.sum * sample_hours,
+                  'yield_kwh': sum(yields.values()) if yields else None}
+    percentiles = {f'p{pct}': result.sketch.percentile_positive(pct) for pct in (50, 90, 98)}
+    return {'months': sorted(months.items()), 'year': year_stats, 'percentiles': percentiles,
+            'timing': timing}
 
-        print(f'Cleanup CSV completato: {filepath}')
+
+def _atomic_write_json(path, data):
+    """Scrive un JSON su file temporaneo e lo sostituisce atomicamente."""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def record_daily_yield(energy_kwh, target_date=None, source='modbus'):
+    """Registra nello storico il daily yield del giorno (default oggi). Ritorna True/False."""
+    try:
+        _yield_history.record(target_date or datetime.now().date(), energy_kwh, source)
+        return True
+    except Exception as e:
+        print(f'Errore salvataggio storico daily yield: {e}')
+        return False
+
+
+def get_daily_yield(target_date):
+    """Daily yield (kWh) registrato per target_date, None se assente."""
+    try:
+        record = _yield_history.get(target_date)
     except Exception as e:
-        print(f'Errore durante cleanup CSV {filepath}: {e}')
+        print(f'Errore lettura storico daily yield: {e}')
+        return None
+    return record.energy_kwh if record is not None else None
+
+
+def read_daily_yields(start_date, end_date):
+    """Lista di YieldRecord (date, energy_kwh, read_at, source) tra le due date incluse."""
+    try:
+        return _yield_history.between(start_date, end_date)
+    except Exception as e:
+        print(f'Errore lettura storico daily yield: {e}')
+        return []
+
+
+def last_daily_yield():
+    """Ultimo YieldRecord registrato, None se lo storico e vuoto."""
+    try:
+        return _yield_history.last()
+    except Exception as e:
+        print(f'Errore lettura storico daily yield: {e}')
+        return None
 
 
 def read_daily_energy(filepath):
@@ -235,11 +1468,3 @@ def save_daily_energy(filepath, energy_kwh):
         print(f'Errore salvataggio daily energy in {filepath}: {e}')
         return False
 
-
-def _percentile(values, pct):
-    """Restituisce il percentile pct (0-100) di una lista di valori."""
-    if not values:
-        return 0
-    sorted_vals = sorted(values)
-    idx = int(len(sorted_vals) * pct / 100)
-    return sorted_vals[min(idx, len(sorted_vals) - 1)]
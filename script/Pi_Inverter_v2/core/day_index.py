@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Indice sidecar giorno -> intervallo di byte per i CSV delle serie.
+Salvato come <nome>_dayidx.json accanto al CSV, aggiornato in modo
+incrementale agli append e ricostruito se inode o dimensione del CSV non
+corrispondono piu. Solo libreria standard: usato anche dal codice legacy
+(Pi_Inverter/classi) e dagli script stand_alone_.
+"""
+
+import json
+import os
+import threading
+import time
+
+
+def index_path(csv_path):
+    """Path del sidecar dell'indice (power_log.csv -> power_log_dayidx.json)."""
+    return os.path.splitext(csv_path)[0] + '_dayidx.json'
+
+
+def day_key(target_date):
+    """Chiave dell'indice per una data: 'YYYY_MM_DD' come nel timestamp CSV."""
+    return target_date.strftime('%Y_%m_%d')
+
+
+class DayIndex:
+    """
+    Mappa 'YYYY_MM_DD' -> [start, end) in byte del CSV.
+    Se le righe di un giorno non sono contigue (orologio spostato a mano),
+    l'intervallo le copre tutte: chi legge filtra comunque per prefisso.
+    """
+
+    def __init__(self, csv_path, save_interval=600):
+        self.csv_path = csv_path
+        self.path = index_path(csv_path)
+        self.save_interval = save_interval
+        self.days = {}
+        self.size = 0
+        self.inode = None
+        self._loaded = False
+        self._saved_at = 0
+        self._lock = threading.Lock()
+
+    def lookup(self, target_date):
+        """Intervallo (start, end) in byte del giorno, None se assente."""
+        with self._lock:
+            self._sync()
+            span = self.days.get(day_key(target_date))
+            return tuple(span) if span else None
+
+    def offset_from(self, target_date):
+        """Offset in byte del primo giorno >= target_date, None se non ce ne sono."""
+        key = day_key(target_date)
+        with self._lock:
+            self._sync()
+            starts = [span[0] for day, span in self.days.items() if day >= key]
+        return min(starts) if starts else None
+
+    def read_day_lines(self, target_date):
+        """Righe (str, senza terminatore) del giorno, lette con un solo seek."""
+        span = self.lookup(target_date)
+        if span is None:
+            return []
+        start, end = span
+        with open(self.csv_path, 'rb') as f:
+            f.seek(start)
+            chunk = f.read(end - start)
+        prefix = day_key(target_date) + '_'
+        return [line for line in chunk.decode('utf-8', errors='replace').splitlines()
+                if line.startswith(prefix)]
+
+    def note_append(self, start, end, timestamp):
+        """Registra una riga appena scritta in [start, end) dal processo corrente."""
+        with self._lock:
+            if not self._loaded or start != self.size:
+                # Indice non caricato o file cambiato da altri: si riallinea alla prossima lettura
+                return
+            self._add(timestamp[:10], start, end)
+            self.size = end
+            if self.inode is None:
+                self.inode = _inode(self.csv_path)
+            if time.time() - self._saved_at >= self.save_interval:
+                self._save()
+
+    def invalidate(self):
+        """Scarta l'indice (memoria e disco): verra ricostruito al prossimo accesso."""
+        with self._lock:
+            self.days = {}
+            self.size = 0
+            self.inode = None
+            self._loaded = False
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    def replace(self, days, size, inode):
+        """Sostituisce l'indice con intervalli calcolati altrove (scansione parallela) e lo salva."""
+        with self._lock:
+            self.days, self.size, self.inode = days, size, inode
+            self._loaded = True
+            self._save()
+
+    def truncate(self, offset):
+        """
+        Riallinea l'indice a un CSV riscritto da offset (inizio riga) in poi,
+        es. dopo la riparazione della coda: gli intervalli vengono tagliati a
+        offset e solo la coda viene riscansionata al prossimo accesso.
+        """
+        with self._lock:
+            if not self._loaded:
+                self._load()
+                self._loaded = True
+            if self.inode != _inode(self.csv_path) or self.size <= offset:
+                return
+            self.days = {key: [span[0], min(span[1], offset)]
+                         for key, span in self.days.items() if span[0] < offset}
+            self.size = offset
+            self._save()
+
+    def rotate(self, manifest, removed):
+        """
+        Riallinea l'indice al CSV ruotato dal cleanup (manifest della rotazione,
+        vedi rotation): i giorni dalla prima riga mantenuta in poi restano,
+        spostati indietro dei byte archiviati. Un indice non allineato al file
+        sigillato, o un manifest senza 'cut', viene scartato.
+        """
+        cut = manifest.get('cut')
+        if cut is None:
+            self.invalidate()
+            return
+        with self._lock:
+            if not self._loaded:
+                self._load()
+                self._loaded = True
+            if self.inode != manifest.get('inode') or self.size < cut:
+                self.days, self.size, self.inode = {}, 0, None
+            else:
+                self.days = {key: [max(span[0], cut) - removed, span[1] - removed]
+                             for key, span in self.days.items() if span[1] > cut}
+                self.size -= removed
+                self.inode = _inode(self.csv_path)
+            self._save()
+
+    def _add(self, key, start, end):
+        span = self.days.get(key)
+        if span is None:
+            self.days[key] = [start, end]
+        else:
+            span[0] = min(span[0], start)
+            span[1] = max(span[1], end)
+
+    def _sync(self):
+        """Allinea l'indice al CSV: estensione incrementale o ricostruzione."""
+        if not self._loaded:
+            self._load()
+            self._loaded = True
+        try:
+            st = os.stat(self.csv_path)
+        except FileNotFoundError:
+            self.days, self.size, self.inode = {}, 0, None
+            return
+        if st.st_ino == self.inode and st.st_size == self.size:
+            return
+        if st.st_ino != self.inode:
+            # File sostituito: il sidecar puo essere gia stato riallineato da chi l'ha ruotato
+            self._load()
+        if st.st_ino != self.inode or st.st_size < self.size:
+            self.days, self.size = {}, 0
+        self.inode = st.st_ino
+        self._scan_from(self.size)
+        self._save()
+
+    def _scan_from(self, offset):
+        with open(self.csv_path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                end = offset + len(line)
+                key = line[:10].decode('ascii', errors='replace')
+                if len(line) > 10 and line[10:11] == b'_':
+                    self._add(key, offset, end)
+                offset = end
+        self.size = offset
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            self.days = data['days']
+            self.size = data['size']
+            self.inode = data['inode']
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f'Indice giorni {self.path} illeggibile, ricostruzione: {e}')
+            self.days, self.size, self.inode = {}, 0, None
+
+    def _save(self):
+        data = {'inode': self.inode, 'size': self.size, 'days': self.days}
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+            self._saved_at = time.time()
+        except Exception as e:
+            print(f'Errore salvataggio indice giorni {self.path}: {e}')
+
+
+def _inode(path):
+    try:
+        return os.stat(path).st_ino
+    except FileNotFoundError:
+        return None
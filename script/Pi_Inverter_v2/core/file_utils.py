@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Utility di I/O condivise dai motori di storage: copia a blocchi e fsync
+della directory dopo un rename atomico.
+"""
+
+import os
+
+CHUNK_SIZE = 1 << 20
+
+
+def copy_range(src, dst, length=None, chunk_size=CHUNK_SIZE):
+    """
+    Copia a blocchi da src (gia posizionato) a dst: `length` byte, oppure
+    fino a EOF se length e None. Ritorna i byte copiati.
+    """
+    copied = 0
+    while length is None or copied < length:
+        size = chunk_size if length is None else min(chunk_size, length - copied)
+        chunk = src.read(size)
+        if not chunk:
+            break
+        dst.write(chunk)
+        copied += len(chunk)
+    return copied
+
+
+def fsync_dir(path):
+    """fsync della directory, per rendere persistente un rename."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Scansione parallela delle serie per i lavori bulk (ricostruzione di indice
+giorni, sketch e rollup, report annuali) sui quattro core del Pi 4.
+
+Il CSV viene diviso in intervalli di byte allineati all'inizio delle righe
+(i segmenti d'archivio per mese): ogni intervallo e letto e pre-aggregato in
+un processo di un ProcessPoolExecutor e i parziali (conteggi, somme, min/max,
+sketch, bucket, intervalli di byte per giorno) sono fusi nel processo
+principale. Con workers=1 gli stessi task girano in seriale nel processo
+corrente: e il riferimento per misurare lo speedup.
+"""
+
+import gzip
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from .archive_segments import SegmentArchive, FIRST_TS, LAST_TS, OFFSET, LENGTH
+from .quality import row_value
+from .quantile_sketch import SeriesSketch
+from .timestamps import line_epoch
+
+# Indici delle statistiche di un bucket (stesse chiavi dei rollup)
+COUNT, SUM, MIN, MAX, POS_COUNT, POS_SUM = range(6)
+_STAT_NAMES = ('count', 'sum', 'min', 'max', 'pos_count', 'pos_sum')
+
+
+class Partial:
+    """
+    Aggregati di un intervallo di righe, fondibili con merge() nell'ordine
+    dei file. Opzionali: sketch dei quantili (sketch_k), statistiche per
+    bucket di bucket_seconds e intervalli di byte per giorno (spans).
+    """
+
+    def __init__(self, sketch_k=None, bucket_seconds=None, spans=False):
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+        self.first = None
+        self.last = None
+        self.end = 0                # Fine (byte) dell'ultima riga completa letta
+        self.skipped = 0
+        self.sketch = SeriesSketch(sketch_k) if sketch_k else None
+        self.bucket_seconds = bucket_seconds
+        self.buckets = {} if bucket_seconds else None
+        self.days = {} if spans else None
+
+    def add(self, epoch, value):
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        if self.first is None or epoch < self.first:
+            self.first = epoch
+        if self.last is None or epoch > self.last:
+            self.last = epoch
+        if self.sketch is not None:
+            self.sketch.update(value)
+        if self.buckets is not None:
+            start = epoch - epoch % self.bucket_seconds
+            stats = self.buckets.get(start)
+            if stats is None:
+                self.buckets[start] = [1, value, value, value, int(value > 0), value if value > 0 else 0.0]
+                return
+            stats[COUNT] += 1
+            stats[SUM] += value
+            if value < stats[MIN]:
+                stats[MIN] = value
+            if value > stats[MAX]:
+                stats[MAX] = value
+            if value > 0:
+                stats[POS_COUNT] += 1
+                stats[POS_SUM] += value
+
+    def merge(self, other):
+        """Fonde un parziale in questo (in place) e lo ritorna."""
+        self.count += other.count
+        self.sum += other.sum
+        self.skipped += other.skipped
+        self.end = max(self.end, other.end)
+        for name, pick in (('min', min), ('max', max), ('first', min), ('last', max)):
+            value = getattr(other, name)
+            if value is not None:
+                mine = getattr(self, name)
+                setattr(self, name, value if mine is None else pick(mine, value))
+        if self.sketch is not None and other.sketch is not None:
+            self.sketch.merge(other.sketch)
+        if self.buckets is not None and other.buckets is not None:
+            for start, stats in other.buckets.items():
+                mine = self.buckets.get(start)
+                if mine is None:
+                    self.buckets[start] = stats
+                    continue
+                mine[COUNT] += stats[COUNT]
+                mine[SUM] += stats[SUM]
+                mine[MIN] = min(mine[MIN], stats[MIN])
+                mine[MAX] = max(mine[MAX], stats[MAX])
+                mine[POS_COUNT] += stats[POS_COUNT]
+                mine[POS_SUM] += stats[POS_SUM]
+        if self.days is not None and other.days is not None:
+            for key, span in other.days.items():
+                _add_span(self.days, key, span[0], span[1])
+        return self
+
+    def bucket_stats(self):
+        """{inizio bucket: {count, sum, min, max, pos_count, pos_sum}} in ordine di tempo."""
+        return {start: dict(zip(_STAT_NAMES, self.buckets[start])) for start in sorted(self.buckets)}
+
+    def mean(self):
+        return self.sum / self.count if self.count else None
+
+
+def _add_span(days, key, start, end):
+    span = days.get(key)
+    if span is None:
+        days[key] = [start, end]
+    else:
+        span[0] = min(span[0], start)
+        span[1] = max(span[1], end)
+
+
+def split_ranges(path, parts, start=0, stop=None):
+    """
+    Divide [start, stop) del file in al piu parts intervalli di byte contigui,
+    ciascuno che inizia all'inizio di una riga (start deve esserlo).
+    """
+    if stop is None:
+        stop = os.path.getsize(path)
+    if stop <= start:
+        return []
+    step = (stop - start) // max(1, parts)
+    bounds = [start]
+    with open(path, 'rb') as f:
+        for i in range(1, parts):
+            f.seek(max(start + i * step - 1, bounds[-1]))
+            f.readline()
+            position = f.tell()
+            if position >= stop:
+                break
+            if position > bounds[-1]:
+                bounds.append(position)
+    bounds.append(stop)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _scan_range(task):
+    """Worker: aggrega le righe complete di un intervallo di byte del file."""
+    path, start, stop, column, epoch_start, epoch_end, options = task
+    partial = Partial(*options)
+    days = partial.days
+    day_epochs = {}
+    offset = start
+    with open(path, 'rb') as f:
+        f.seek(start)
+        for line in f:
+            line_end = offset + len(line)
+            if line_end > stop or not line.endswith(b'\n'):
+                break
+            if days is not None and line[10:11] == b'_':
+                _add_span(days, line[:10].decode('ascii', errors='replace'), offset, line_end)
+            offset = partial.end = line_end
+            epoch = line_epoch(line, day_epochs)
+            if epoch is None:
+                partial.skipped += 1
+                continue
+            if (epoch_start is not None and epoch < epoch_start) or (epoch_end is not None and epoch >= epoch_end):
+                continue
+            value = row_value(line, column)
+            if value is None:
+                partial.skipped += 1     # campo vuoto, non valido o lettura STALE/FAILED
+                continue
+            partial.add(epoch, value)
+    return partial
+
+
+def _scan_segment(task):
+    """Worker: aggrega i blocchi indicati di un segmento mensile d'archivio."""
+    path, blocks, column, epoch_start, epoch_end, options = task
+    partial = Partial(*options)
+    day_epochs = {}
+    with open(path, 'rb') as f:
+        for block in blocks:
+            f.seek(block[OFFSET])
+            for line in gzip.decompress(f.read(block[LENGTH])).split(b'\n'):
+                epoch = line_epoch(line, day_epochs)
+                if epoch is None or (epoch_start is not None and epoch < epoch_start) \
+                        or (epoch_end is not None and epoch >= epoch_end):
+                    continue
+                value = row_value(line, column)
+                if value is None:
+                    partial.skipped += 1
+                    continue
+                partial.add(epoch, value)
+    return partial
+
+
+def _run(worker, tasks, workers, options):
+    """Esegue i task (in seriale se workers <= 1) e fonde i parziali nell'ordine dei task."""
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+            partials = list(pool.map(worker, tasks))
+    else:
+        partials = [worker(task) for task in tasks]
+    result = Partial(*options)
+    for partial in partials:
+        result.merge(partial)
+    return result
+
+
+def default_workers():
+    return os.cpu_count() or 1
+
+
+def scan_file(path, column=0, sketch_k=None, bucket_seconds=None, spans=False,
+              start=0, stop=None, epoch_start=None, epoch_end=None, workers=None):
+    """
+    Aggrega le righe del CSV tra i byte start e stop (righe complete) con
+    timestamp in [epoch_start, epoch_end). column: indice del valore dopo il
+    timestamp (colonna del canale nei file wide). Ritorna un Partial.
+    """
+    workers = workers or default_workers()
+    options = (sketch_k, bucket_seconds, spans)
+    if not os.path.exists(path):
+        return Partial(*options)
+    tasks = [(path, range_start, range_stop, column, epoch_start, epoch_end, options)
+             for range_start, range_stop in split_ranges(path, workers, start, stop)]
+    return _run(_scan_range, tasks, workers, options)
+
+
+def scan_archive(directory, column=0, sketch_k=None, bucket_seconds=None,
+                 epoch_start=None, epoch_end=None, workers=None):
+    """Come scan_file sui segmenti d'archivio: un task per mese, solo i blocchi che intersecano."""
+    workers = workers or default_workers()
+    options = (sketch_k, bucket_seconds, False)
+    archive = SegmentArchive(directory)
+    tasks = []
+    for month in archive.segment_months():
+        blocks = [block for block in archive.load_index(month)
+                  if (epoch_start is None or block[LAST_TS] >= epoch_start)
+                  and (epoch_end is None or block[FIRST_TS] < epoch_end)]
+        if blocks:
+            tasks.append((archive.segment_path(month), blocks, column, epoch_start, epoch_end, options))
+    return _run(_scan_segment, tasks, workers, options)
+
+
+def measure_speedup(job, workers=None):
+    """
+    Esegue job(workers) in seriale (workers=1) e in parallelo e misura i tempi.
+    Ritorna (risultato parallelo, {'serial', 'parallel', 'workers', 'speedup'}).
+    """
+    workers = workers or default_workers()
+    started = time.perf_counter()
+    job(1)
+    serial = time.perf_counter() - started
+    started = time.perf_counter()
+    result = job(workers)
+    parallel = time.perf_counter() - started
+    return result, {'serial': serial, 'parallel': parallel, 'workers': workers,
+                    'speedup': serial / parallel if parallel else None}
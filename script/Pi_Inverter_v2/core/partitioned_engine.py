@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Motore di storage a partizioni mensili: la serie logs/power_log.csv diventa
+logs/power_log/YYYY-MM.csv (stesso formato riga del CSV storico, ogni
+partizione e un CsvEngine con il proprio indice giorni).
+La retention comprime partizioni intere nei segmenti mensili dell'archivio
+(logs/archive/power_log/, vedi archive_segments) e le letture aprono solo
+le partizioni utili.
+"""
+
+import os
+import re
+import time
+from array import array
+from datetime import datetime, timedelta
+
+from .archive_segments import SegmentArchive, archive_dir
+from .csv_engine import CsvEngine
+from .quality import OK
+from .timestamps import epoch_to_datetime
+
+_PARTITION_RE = re.compile(r'^(\d{4})-(\d{2})\.csv$')
+
+
+def partition_dir(filepath):
+    """Directory delle partizioni della serie (logs/power_log.csv -> logs/power_log/)."""
+    return os.path.splitext(filepath)[0]
+
+
+def partition_name(timestamp):
+    """Nome della partizione per un timestamp 'YYYY_MM_DD_HH:MM'."""
+    return f'{timestamp[0:4]}-{timestamp[5:7]}.csv'
+
+
+class PartitionedEngine:
+    """
+    Serie divisa in partizioni mensili ordinate. Per sketch e aggiornamenti
+    incrementali le partizioni sono viste come un unico flusso di byte
+    concatenato: si scrive solo nell'ultima, quindi il flusso e append-only
+    finche la retention non rimuove la piu vecchia (cambia identity()).
+    """
+
+    name = 'partitioned'
+
+    def __init__(self, filepath, index_save_interval=600, epoch_column=False):
+        self.path = partition_dir(filepath)
+        self.archive = SegmentArchive(archive_dir(filepath))
+        self.index_save_interval = index_save_interval
+        self.epoch_column = epoch_column
+        self._partitions = {}
+
+    def _engine(self, name):
+        engine = self._partitions.get(name)
+        if engine is None:
+            engine = CsvEngine(os.path.join(self.path, name), self.index_save_interval,
+                               self.epoch_column)
+            self._partitions[name] = engine
+        return engine
+
+    def partition_names(self):
+        """Nomi delle partizioni attive in ordine cronologico."""
+        try:
+            names = os.listdir(self.path)
+        except FileNotFoundError:
+            return []
+        return sorted(name for name in names if _PARTITION_RE.match(name))
+
+    def partitions_between(self, start_date=None, end_date=None):
+        """
+        Partizioni attive che si sovrappongono all'intervallo di date
+        [start_date, end_date] (None = senza limite): la potatura di tutte le letture.
+        """
+        names = self.partition_names()
+        if start_date is not None:
+            names = [name for name in names if name >= f'{start_date.year:04d}-{start_date.month:02d}.csv']
+        if end_date is not None:
+            names = [name for name in names if name <= f'{end_date.year:04d}-{end_date.month:02d}.csv']
+        return names
+
+    def exists(self):
+        return bool(self.partition_names())
+
+    def identity(self):
+        """(partizione piu vecchia, inode): cambia quando la retention la rimuove."""
+        names = self.partition_names()
+        if not names:
+            return None
+        return [names[0], self._engine(names[0]).identity()]
+
+    def size(self):
+        """Dimensione del flusso concatenato di tutte le partizioni."""
+        return sum(self._engine(name).size() for name in self.partition_names())
+
+    def version(self):
+        names = self.partition_names()
+        if not names:
+            return None
+        return tuple((name, self._engine(name).version()) for name in names)
+
+    def append(self, timestamp, value, flag=OK):
+        """Aggiunge la lettura alla partizione del suo mese; ritorna la fine del flusso."""
+        os.makedirs(self.path, exist_ok=True)
+        self._engine(partition_name(timestamp)).append(timestamp, value, flag)
+        return self.size()
+
+    def append_many(self, rows):
+        """Aggiunge un blocco di letture, una scrittura per partizione interessata."""
+        os.makedirs(self.path, exist_ok=True)
+        start = 0
+        for i in range(1, len(rows) + 1):
+            if i == len(rows) or partition_name(rows[i][0]) != partition_name(rows[start][0]):
+                self._engine(partition_name(rows[start][0])).append_many(rows[start:i])
+                start = i
+        return self.size()
+
+    def last_epoch(self):
+        for name in reversed(self.partition_names()):
+            epoch = self._engine(name).last_epoch()
+            if epoch is not None:
+                return epoch
+        return None
+
+    def values(self):
+        values = []
+        for name in self.partition_names():
+            values.extend(self._engine(name).values())
+        return values
+
+    def load_arrays(self):
+        times = array('q')
+        values = array('d')
+        for name in self.partition_names():
+            part_times, part_values = self._engine(name).load_arrays()
+            times.extend(part_times)
+            values.extend(part_values)
+        return times, values
+
+    def arrays_since(self, offset):
+        """
+        Letture del flusso concatenato dal byte offset in poi, come array (epoch
+        wall clock, valori), e posizione di fine lettura: una riga incompleta
+        conta solo nell'ultima partizione, l'unica in cui si scrive.
+        """
+        times = array('q')
+        values = array('d')
+        base = 0
+        names = self.partition_names()
+        for index, name in enumerate(names):
+            engine = self._engine(name)
+            size = engine.size()
+            if base + size > offset:
+                part_times, part_values, end = engine.arrays_since(max(0, offset - base))
+                times.extend(part_times)
+                values.extend(part_values)
+                offset = base + (end if index == len(names) - 1 else size)
+            base += size
+        return times, values, offset
+
+    def scan_values(self, start=0, stop=None):
+        """Valori del flusso concatenato tra i byte start e stop."""
+        base = 0
+        for name in self.partition_names():
+            engine = self._engine(name)
+            size = engine.size()
+            if stop is not None and base >= stop:
+                break
+            if base + size > start:
+                local_stop = None if stop is None else stop - base
+                yield from engine.scan_values(max(0, start - base), local_stop)
+            base += size
+
+    def tail_values(self, n):
+        """Ultimi N valori, leggendo solo le partizioni piu recenti necessarie."""
+        values = []
+        for name in reversed(self.partition_names()):
+            values = self._engine(name).tail_values(n - len(values)) + values
+            if len(values) >= n:
+                break
+        return values
+
+    def iter_range(self, start=None, end=None, reverse=False):
+        """
+        Coppie (epoch, value) con start <= epoch < end, aprendo solo le partizioni
+        del periodo (con reverse=True dalla piu recente, partizioni in ordine inverso).
+        """
+        names = self._names_between(start, end)
+        if reverse:
+            names.reverse()
+        for name in names:
+            yield from self._engine(name).iter_range(start, end, reverse)
+
+    def iter_flags(self, start=None, end=None):
+        """Coppie (epoch, flag) delle letture non OK con start <= epoch < end."""
+        for name in self._names_between(start, end):
+            yield from self._engine(name).iter_flags(start, end)
+
+    def _names_between(self, start, end):
+        """Partizioni attive che si sovrappongono all'intervallo di epoch [start, end)."""
+        return self.partitions_between(None if start is None else epoch_to_datetime(start),
+                                       None if end is None else epoch_to_datetime(end - 1))
+
+    def day_rows(self, target_date):
+        """Coppie (datetime, value) del giorno, dalla sola partizione del suo mese."""
+        names = self.partitions_between(target_date, target_date)
+        if not names:
+            return []
+        return self._engine(names[0]).day_rows(target_date)
+
+    def iter_archive(self, start=None, end=None, reverse=False):
+        """Coppie (epoch, value) archiviate con start <= epoch < end, in streaming."""
+        return self.archive.iter_rows(start, end, reverse=reverse)
+
+    def repair_tail(self, last_good=None, max_tail=65536):
+        """Controllo di integrita della coda della partizione corrente (l'unica in scrittura)."""
+        names = self.partition_names()
+        if not names:
+            return None
+        return self._engine(names[-1]).repair_tail(last_good, max_tail)
+
+    def cleanup(self, max_age_days):
+        """
+        Retention a granularita mensile: comprime nell'archivio le partizioni il
+        cui mese e interamente piu vecchio di max_age_days, poi le rimuove.
+        """
+        started = time.monotonic()
+        threshold = datetime.now() - timedelta(days=max_age_days)
+        keep_from = f'{threshold.year:04d}-{threshold.month:02d}.csv'
+        stats = {'archived_bytes': 0, 'kept_bytes': 0, 'elapsed': 0.0}
+        for name in self.partition_names():
+            engine = self._engine(name)
+            if name >= keep_from:
+                stats['kept_bytes'] += engine.size()
+                continue
+            stats['archived_bytes'] += engine.size()
+            with open(engine.path, 'rb') as f:
+                self.archive.append_lines(f)
+            engine.day_index.invalidate()
+            os.remove(engine.path)
+            self._partitions.pop(name, None)
+            print(f'Partizione {name} archiviata in {self.archive.directory}')
+        stats['elapsed'] = time.monotonic() - started
+        return stats
+
+
+def migrate_csv(csv_path, target_dir):
+    """
+    Migrazione una tantum da file singolo a partizioni mensili in target_dir:
+    copia le righe cosi come sono nella partizione del loro mese (il CSV
+    originale resta intatto). Le righe senza timestamp valido vengono scartate.
+    Ritorna {nome partizione: righe scritte}.
+    """
+    if os.path.isdir(target_dir) and any(_PARTITION_RE.match(n) for n in os.listdir(target_dir)):
+        raise ValueError(f'{target_dir} contiene gia partizioni: migrazione gia eseguita?')
+    os.makedirs(target_dir, exist_ok=True)
+    counts = {}
+    current_name = None
+    out = None
+    try:
+        with open(csv_path, 'rb') as src:
+            for line in src:
+                if len(line) < 17 or line[4:5] != b'_' or line[16:17] != b',' \
+                        or not line.endswith(b'\n'):
+                    continue
+                name = partition_name(line[:16].decode('ascii', errors='replace'))
+                if not _PARTITION_RE.match(name):
+                    continue
+                if name != current_name:
+                    if out is not None:
+                        out.close()
+                    out = open(os.path.join(target_dir, name), 'ab')
+                    current_name = name
+                out.write(line)
+                counts[name] = counts.get(name, 0) + 1
+    finally:
+        if out is not None:
+            out.close()
+    return counts
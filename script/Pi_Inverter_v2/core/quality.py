@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Flag di qualita delle letture: OK, STALE (ultimo valore buono ripetuto dopo
+una lettura fallita), FAILED (lettura Modbus fallita, valore segnaposto) e
+INTERPOLATED (valore stimato, usabile negli aggregati).
+
+Formato su disco retrocompatibile, le letture OK restano invariate:
+- CSV a serie singola: colonna finale con il codice solo per le letture non OK,
+  'YYYY_MM_DD_HH:MM,0,F' (dopo l'eventuale colonna epoch UTC);
+- file wide multi-canale: codice in coda al campo del canale ('0F', '-1.2I');
+- binario: bit 1-2 del byte di flag del record (bit 0 = valore intero);
+- SQLite: letture non OK nella tabella sample_flags, samples contiene solo le usabili.
+
+I lettori dei motori scartano STALE e FAILED gia in lettura, quindi cache,
+sketch, rollup, livelli consolidati e grafici non li vedono senza bisogno di
+riscansioni; iter_flags dei motori li elenca per contare i disservizi.
+"""
+
+OK = 0
+STALE = 1
+FAILED = 2
+INTERPOLATED = 3
+
+NAMES = ('ok', 'stale', 'failed', 'interpolated')
+
+# Codice su disco delle letture non OK
+CODES = {STALE: 'S', FAILED: 'F', INTERPOLATED: 'I'}
+_CODE_FLAGS = {b'S': STALE, b'F': FAILED, b'I': INTERPOLATED}
+FLAG_CODES = frozenset(CODES.values())
+
+# Flag delle letture valide per aggregati e scale
+USABLE = frozenset((OK, INTERPOLATED))
+
+# Fine delle righe CSV a serie singola con flag STALE/FAILED (con o senza terminatore,
+# le righe dei blocchi d'archivio sono separate su '\n' e conservano '\r')
+_BAD_ENDINGS = tuple(f',{code}{end}'.encode('ascii')
+                     for code in (CODES[STALE], CODES[FAILED]) for end in ('\r\n', '\n', '\r', ''))
+
+# Byte di flag del record binario
+BINARY_SHIFT = 1
+BINARY_MASK = 0x06
+
+
+def usable(flag):
+    return flag in USABLE
+
+
+def bad_line(line):
+    """True se la riga CSV a serie singola (bytes) porta il flag STALE o FAILED."""
+    return line.endswith(_BAD_ENDINGS)
+
+
+def line_flag(line):
+    """Flag della riga CSV a serie singola (bytes): codice nella colonna finale, OK se assente."""
+    end = line.rstrip(b'\r\n')
+    if end[-2:-1] != b',':
+        return OK
+    return _CODE_FLAGS.get(end[-1:], OK)
+
+
+def text_flag(parts):
+    """Flag dei campi (str) di una riga CSV a serie singola gia divisa."""
+    if len(parts) > 2 and parts[-1] in FLAG_CODES:
+        return _CODE_FLAGS[parts[-1].encode('ascii')]
+    return OK
+
+
+def parse_cell(cell):
+    """(valore, flag) di un campo (bytes) con codice opzionale in coda; valore None se vuoto o non numerico."""
+    flag = _CODE_FLAGS.get(cell[-1:], OK)
+    if flag != OK:
+        cell = cell[:-1]
+    try:
+        return float(cell), flag
+    except ValueError:
+        return None, flag
+
+
+def format_cell(value, flag):
+    """Campo del file wide: il valore, seguito dal codice se la lettura non e OK."""
+    return value if flag == OK else f'{value}{CODES[flag]}'
+
+
+def row_value(line, column=0):
+    """
+    Valore della colonna (indice dopo il timestamp) di una riga CSV o wide,
+    None se vuoto, non numerico o con flag STALE/FAILED (della riga o del campo).
+    """
+    if line.endswith(_BAD_ENDINGS):
+        return None
+    fields = line[17:].rstrip(b'\r\n').split(b',')
+    if column >= len(fields) or not fields[column]:
+        return None
+    value, flag = parse_cell(fields[column])
+    return value if flag in USABLE else None
+
+
+def binary_bits(flag):
+    """Bit del flag di qualita nel byte di flag del record binario."""
+    return flag << BINARY_SHIFT
+
+
+def binary_flag(flags):
+    """Flag di qualita dal byte di flag del record binario."""
+    return (flags & BINARY_MASK) >> BINARY_SHIFT
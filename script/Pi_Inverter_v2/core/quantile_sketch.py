@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Sketch di quantili in streaming (stile KLL) per le serie storiche.
+Aggiornamento O(1) ammortizzato, memoria limitata, fusione (merge) tra sketch
+e serializzazione su dict JSON. ZERO dipendenze esterne.
+"""
+
+import math
+
+
+class KLLSketch:
+    """
+    Sketch KLL: una pila di compattatori, il livello h contiene elementi di
+    peso 2**h. Quando lo sketch supera la capacita, il primo livello pieno
+    viene ordinato e dimezzato (un elemento su due sale di livello).
+
+    La scelta pari/dispari della compattazione alterna deterministicamente
+    per livello, cosi' due ricostruzioni dallo stesso CSV danno lo stesso sketch.
+    """
+
+    def __init__(self, k=200):
+        self.k = k
+        self.n = 0
+        self.compactors = [[]]
+        self._offsets = [0]
+        self._size = 0
+        self._max_size = self._capacity(0)
+        self._cdf = None
+
+    def _capacity(self, height):
+        depth = len(self.compactors) - height - 1
+        return int(math.ceil((2.0 / 3.0) ** depth * self.k)) + 1
+
+    def _grow(self):
+        self.compactors.append([])
+        self._offsets.append(0)
+        self._max_size = sum(self._capacity(h) for h in range(len(self.compactors)))
+
+    def update(self, value):
+        """Aggiunge un valore allo sketch."""
+        self.compactors[0].append(value)
+        self.n += 1
+        self._size += 1
+        self._cdf = None
+        if self._size >= self._max_size:
+            self._compress()
+
+    def _compress(self):
+        for h in range(len(self.compactors)):
+            level = self.compactors[h]
+            if len(level) < self._capacity(h):
+                continue
+            if h + 1 >= len(self.compactors):
+                self._grow()
+            level.sort()
+            # Un eventuale elemento dispari resta al livello corrente
+            keep = [level.pop()] if len(level) % 2 else []
+            offset = self._offsets[h]
+            self._offsets[h] = 1 - offset
+            self.compactors[h + 1].extend(level[offset::2])
+            self.compactors[h] = keep
+            self._size = sum(len(c) for c in self.compactors)
+            if self._size < self._max_size:
+                break
+
+    def merge(self, other):
+        """Fonde un altro KLLSketch in questo (in place)."""
+        while len(self.compactors) < len(other.compactors):
+            self._grow()
+        for h, level in enumerate(other.compactors):
+            self.compactors[h].extend(level)
+        self.n += other.n
+        self._size = sum(len(c) for c in self.compactors)
+        self._cdf = None
+        while self._size >= self._max_size:
+            self._compress()
+
+    def value_at_rank(self, rank):
+        """
+        Restituisce il valore in posizione `rank` (0-based) della sequenza
+        ordinata approssimata, None se lo sketch e vuoto.
+        """
+        if self.n == 0:
+            return None
+        if self._cdf is None:
+            weighted = sorted(
+                (value, 1 << h)
+                for h, level in enumerate(self.compactors)
+                for value in level
+            )
+            cumulative = 0
+            cdf = []
+            for value, weight in weighted:
+                cumulative += weight
+                cdf.append((cumulative, value))
+            self._cdf = cdf
+        rank = max(0, min(rank, self.n - 1))
+        for cumulative, value in self._cdf:
+            if cumulative > rank:
+                return value
+        return self._cdf[-1][1]
+
+    def to_dict(self):
+        return {'k': self.k, 'n': self.n,
+                'compactors': self.compactors, 'offsets': self._offsets}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['k'])
+        sketch.n = data['n']
+        sketch.compactors = [list(level) for level in data['compactors']]
+        sketch._offsets = list(data['offsets'])
+        sketch._size = sum(len(c) for c in sketch.compactors)
+        sketch._max_size = sum(sketch._capacity(h) for h in range(len(sketch.compactors)))
+        return sketch
+
+
+class SeriesSketch:
+    """
+    Riassunto di una serie (potenza solare o rete) per la scala dei LED:
+    sketch separati per valori positivi e negativi, conteggio degli zeri e
+    min/max esatti. Replica la semantica di `_percentile` (indice
+    int(n * pct / 100) sulla lista ordinata).
+    """
+
+    def __init__(self, k=200):
+        self.positive = KLLSketch(k)
+        self.negative = KLLSketch(k)
+        self.zeros = 0
+        self.max = None
+        self.min = None
+
+    @property
+    def count(self):
+        return self.positive.n + self.negative.n + self.zeros
+
+    def update(self, value):
+        """Aggiunge una lettura alla serie."""
+        if value > 0:
+            self.positive.update(value)
+        elif value < 0:
+            self.negative.update(value)
+        else:
+            self.zeros += 1
+        if self.max is None or value > self.max:
+            self.max = value
+        if self.min is None or value < self.min:
+            self.min = value
+
+    def merge(self, other):
+        """Fonde un altro SeriesSketch in questo (in place)."""
+        self.positive.merge(other.positive)
+        self.negative.merge(other.negative)
+        self.zeros += other.zeros
+        for value in (other.max, other.min):
+            if value is None:
+                continue
+            if self.max is None or value > self.max:
+                self.max = value
+            if self.min is None or value < self.min:
+                self.min = value
+
+    def percentile_positive(self, pct):
+        """Percentile pct dei soli valori > 0 (0 se non ce ne sono)."""
+        n = self.positive.n
+        if n == 0:
+            return 0
+        return self.positive.value_at_rank(min(int(n * pct / 100), n - 1))
+
+    def percentile_non_negative(self, pct):
+        """Percentile pct dei valori >= 0, zeri inclusi (0 se non ce ne sono)."""
+        n = self.positive.n + self.zeros
+        if n == 0:
+            return 0
+        rank = min(int(n * pct / 100), n - 1)
+        if rank < self.zeros:
+            return 0
+        return self.positive.value_at_rank(rank - self.zeros)
+
+    def percentile_negative(self, pct):
+        """Percentile pct dei soli valori < 0 (0 se non ce ne sono)."""
+        n = self.negative.n
+        if n == 0:
+            return 0
+        return self.negative.value_at_rank(min(int(n * pct / 100), n - 1))
+
+    def to_dict(self):
+        return {'positive': self.positive.to_dict(),
+                'negative': self.negative.to_dict(),
+                'zeros': self.zeros, 'max': self.max, 'min': self.min}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls()
+        sketch.positive = KLLSketch.from_dict(data['positive'])
+        sketch.negative = KLLSketch.from_dict(data['negative'])
+        sketch.zeros = data['zeros']
+        sketch.max = data['max']
+        sketch.min = data['min']
+        return sketch
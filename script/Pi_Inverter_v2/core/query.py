@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Aggregazione in streaming delle letture (epoch, value) ordinate per tempo:
+bucket a larghezza fissa allineati agli epoch wall clock (un bucket di un
+giorno parte a mezzanotte locale) e funzioni mean/min/max/sum/count/pXX.
+Un bucket viene emesso appena arriva la prima lettura del successivo.
+I percentili usano un KLLSketch per bucket: memoria limitata anche su un
+bucket di un anno, esatti finche il bucket sta nello sketch (~k letture).
+"""
+
+import re
+from datetime import timedelta
+
+from .quantile_sketch import KLLSketch
+
+_PERCENTILE_RE = re.compile(r'^p(\d+(?:\.\d+)?)$')
+_BUCKET_RE = re.compile(r'^(\d+)(s|m|h|d)$')
+_BUCKET_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+AGGREGATES = ('mean', 'min', 'max', 'sum', 'count')
+
+
+def parse_bucket(bucket):
+    """Larghezza del bucket in secondi da int, timedelta o '15m'/'1h'/'1d' (None = unico bucket)."""
+    if bucket is None:
+        return None
+    if isinstance(bucket, timedelta):
+        seconds = int(bucket.total_seconds())
+    elif isinstance(bucket, str):
+        match = _BUCKET_RE.match(bucket)
+        if not match:
+            raise ValueError(f'Bucket non valido: {bucket}')
+        seconds = int(match.group(1)) * _BUCKET_UNITS[match.group(2)]
+    else:
+        seconds = int(bucket)
+    if seconds <= 0:
+        raise ValueError(f'Bucket non valido: {bucket}')
+    return seconds
+
+
+def parse_aggregates(agg):
+    """Valida i nomi delle aggregazioni; ritorna (lista nomi, {nome: percentile})."""
+    if isinstance(agg, str):
+        agg = [agg]
+    percentiles = {}
+    for name in agg:
+        match = _PERCENTILE_RE.match(name)
+        if match:
+            percentiles[name] = float(match.group(1))
+        elif name not in AGGREGATES:
+            raise ValueError(f'Aggregazione non supportata: {name}')
+    return list(agg), percentiles
+
+
+class _Bucket:
+    __slots__ = ('count', 'sum', 'min', 'max', 'sketch')
+
+    def __init__(self, sketch_k):
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+        self.sketch = KLLSketch(sketch_k) if sketch_k else None
+
+    def add(self, value):
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        if self.sketch is not None:
+            self.sketch.update(value)
+
+    def result(self, names, percentiles):
+        result = {}
+        for name in names:
+            if name == 'mean':
+                result[name] = self.sum / self.count
+            elif name == 'count':
+                result[name] = self.count
+            elif name in percentiles:
+                # Stessa convenzione dei percentili della serie: rango int(n * pct / 100)
+                result[name] = self.sketch.value_at_rank(int(self.count * percentiles[name] / 100))
+            else:
+                result[name] = getattr(self, name)
+        return result
+
+
+def aggregate(rows, bucket_seconds, agg, origin=None, sketch_k=200):
+    """
+    Aggrega le righe (epoch, value) ordinate. Ritorna un generatore di
+    (inizio bucket in epoch, {aggregazione: valore}) per i soli bucket non vuoti.
+    bucket_seconds None: un unico bucket che parte da origin (o dalla prima riga).
+    sketch_k: precisione dello sketch dei percentili (vedi KLLSketch).
+    """
+    names, percentiles = parse_aggregates(agg)
+    sketch_k = sketch_k if percentiles else None
+    current = None
+    current_start = None
+    for epoch, value in rows:
+        if bucket_seconds is None:
+            start = origin if origin is not None else epoch if current_start is None else current_start
+        else:
+            start = epoch - epoch % bucket_seconds
+        if start != current_start:
+            if current is not None:
+                yield current_start, current.result(names, percentiles)
+            current = _Bucket(sketch_k)
+            current_start = start
+        current.add(value)
+    if current is not None:
+        yield current_start, current.result(names, percentiles)
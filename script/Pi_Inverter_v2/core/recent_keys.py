@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Indice dei timestamp recenti di una serie, per rendere idempotente la
+scrittura di una lettura per (serie, minuto): un riavvio del servizio nello
+stesso minuto non deve riscrivere la riga gia presente. Usato anche dalla
+deduplicazione offline in streaming, con memoria limitata alla finestra.
+"""
+
+from collections import deque
+
+
+class RecentKeys:
+    """
+    Ultime `capacity` chiavi (epoch al minuto, o bytes del timestamp) in ordine
+    di inserimento: appartenenza O(1) con un set, le piu vecchie scartate
+    dalla deque. `last` e l'ultima chiave aggiunta (la coda della serie).
+    """
+
+    __slots__ = ('capacity', 'last', '_order', '_keys')
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.last = None
+        self._order = deque()
+        self._keys = set()
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, key):
+        """Registra la chiave come ultima scritta. Ritorna False se era gia nella finestra."""
+        self.last = key
+        if key in self._keys:
+            return False
+        self._keys.add(key)
+        self._order.append(key)
+        if len(self._order) > self.capacity:
+            self._keys.discard(self._order.popleft())
+        return True
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Controllo di integrita della coda dei file delle serie dopo un arresto non
+pulito (watchdog con `sudo reboot`, mancanza di corrente).
+
+I file sono append-only: una scrittura interrotta puo lasciare solo in coda
+una riga troncata, righe concatenate o byte NUL (blocchi allocati ma mai
+scritti). Il controllo legge quindi solo i byte dopo l'ultimo offset buono
+ricordato (al massimo max_tail byte), scarta le righe/record non validi e
+riscrive la coda in posto. Costo proporzionale alla coda, non al file.
+"""
+
+import os
+
+from .quality import FLAG_CODES, parse_cell
+from .timestamps import HEADER_PREFIX, line_epoch
+
+SAMPLE_LINES = 10          # Righe scartate riportate nel report (troncate a SAMPLE_BYTES)
+SAMPLE_BYTES = 120
+
+
+def _scan_start(path, st, last_good, max_tail):
+    """Offset da cui controllare: ultimo offset buono se ancora valido, limitato a max_tail."""
+    start = 0
+    if last_good and last_good.get('path') == path and last_good.get('inode') == st.st_ino \
+            and last_good.get('offset', 0) <= st.st_size:
+        start = last_good['offset']
+    return max(start, st.st_size - max_tail, 0)
+
+
+def _line_start(f, offset, block_size=8192):
+    """Inizio della riga che contiene offset (offset stesso se preceduto da newline)."""
+    position = offset
+    while position > 0:
+        read_size = min(block_size, position)
+        f.seek(position - read_size)
+        newline = f.read(read_size).rfind(b'\n')
+        if newline >= 0:
+            return position - read_size + newline + 1
+        position -= read_size
+    return 0
+
+
+def _result(path, st, start):
+    return {'path': path, 'inode': st.st_ino, 'offset': st.st_size, 'scanned_bytes': st.st_size - start,
+            'dropped_lines': 0, 'dropped_bytes': 0, 'samples': []}
+
+
+def valid_text_line(line, offset):
+    """
+    Riga completa 'YYYY_MM_DD_HH:MM,v[,v...]' con valori numerici (o header a offset 0);
+    ammessi i codici di qualita (colonna finale o in coda al campo, vedi quality).
+    """
+    if b'\x00' in line or not line.endswith(b'\n'):
+        return False
+    if offset == 0 and line.startswith(HEADER_PREFIX):
+        return True
+    if line_epoch(line, {}) is None:
+        return False
+    fields = line[17:].rstrip(b'\r\n').split(b',')
+    if len(fields) > 1 and fields[-1].decode('ascii', 'replace') in FLAG_CODES:
+        fields.pop()
+    for field in fields:
+        if field and parse_cell(field)[0] is None:
+            return False
+    return any(fields)
+
+
+def repair_text_tail(path, last_good=None, max_tail=65536):
+    """
+    Controlla la coda di un CSV di serie e rimuove righe troncate o corrotte.
+    Ritorna il risultato per il report (None se il file non esiste), con
+    'offset' = nuova dimensione (ultimo offset buono) e 'repaired_from' =
+    inizio della coda riscritta (None se la coda era integra).
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    start = _scan_start(path, st, last_good, max_tail)
+    result = _result(path, st, start)
+    result['repaired_from'] = None
+    if start == st.st_size:
+        return result
+    with open(path, 'r+b') as f:
+        start = _line_start(f, start)
+        f.seek(start)
+        data = f.read()
+        lines = data.split(b'\n')
+        partial = lines.pop()
+        kept = []
+        offset = start
+        for line in lines:
+            line += b'\n'
+            if valid_text_line(line, offset):
+                kept.append(line)
+            elif b'\x00' in line:
+                # Riga scritta dopo i blocchi NUL persi: si recupera la parte finale
+                garbage, salvaged = line.rsplit(b'\x00', 1)
+                _drop(result, garbage + b'\x00')
+                if valid_text_line(salvaged, offset + len(garbage) + 1):
+                    kept.append(salvaged)
+                elif salvaged.strip():
+                    _drop(result, salvaged)
+            else:
+                _drop(result, line)
+            offset += len(line)
+        if partial:
+            _drop(result, partial)
+        if not result['dropped_bytes']:
+            return result
+        tail = b''.join(kept)
+        f.seek(start)
+        f.write(tail)
+        f.truncate(start + len(tail))
+        f.flush()
+        os.fsync(f.fileno())
+    result['offset'] = start + len(tail)
+    result['repaired_from'] = start
+    return result
+
+
+def repair_record_tail(path, header_size, record_size, last_good=None, max_tail=65536):
+    """
+    Come repair_text_tail per un file di record binari a larghezza fissa:
+    tronca il record parziale finale e scarta i record interamente a zero (NUL).
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    result = _result(path, st, 0)
+    result['repaired_from'] = None
+    if st.st_size < header_size:
+        # Header incompleto: il file non ha mai avuto record
+        if st.st_size:
+            with open(path, 'r+b') as f:
+                _drop(result, f.read())
+                f.truncate(0)
+                os.fsync(f.fileno())
+            result['offset'] = 0
+            result['repaired_from'] = 0
+        result['scanned_bytes'] = st.st_size
+        return result
+    start = _scan_start(path, st, last_good, max_tail)
+    # Allinea al confine di record
+    start = max(header_size, start - (start - header_size) % record_size)
+    result['scanned_bytes'] = st.st_size - start
+    if start == st.st_size:
+        return result
+    empty = bytes(record_size)
+    with open(path, 'r+b') as f:
+        f.seek(start)
+        data = f.read()
+        kept = []
+        whole = len(data) - len(data) % record_size
+        for position in range(0, whole, record_size):
+            record = data[position:position + record_size]
+            if record == empty:
+                _drop(result, record)
+            else:
+                kept.append(record)
+        if whole < len(data):
+            _drop(result, data[whole:])
+        if not result['dropped_bytes']:
+            return result
+        tail = b''.join(kept)
+        f.seek(start)
+        f.write(tail)
+        f.truncate(start + len(tail))
+        f.flush()
+        os.fsync(f.fileno())
+    result['offset'] = start + len(tail)
+    result['repaired_from'] = start
+    return result
+
+
+def _drop(result, data):
+    result['dropped_lines'] += 1
+    result['dropped_bytes'] += len(data)
+    if len(result['samples']) < SAMPLE_LINES:
+        if not data.strip(b'\x00'):
+            result['samples'].append(f'<{len(data)} byte NUL>')
+        else:
+            result['samples'].append(repr(data[:SAMPLE_BYTES]))
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Rollup giornalieri materializzati: per ogni serie e giorno concluso, un JSON
+con statistiche per slot di 15 minuti e per l'intera giornata
+(min/max/mean/count/energy, piu somma e conteggio dei soli valori positivi
+usati dal grafico a barre). Un giorno passato non cambia piu: grafici e
+storico leggono il rollup invece di riparsare le letture al minuto.
+
+File: logs/rollups/<serie>/<YYYY-MM-DD>.json
+"""
+
+import json
+import os
+import threading
+from datetime import datetime
+
+SLOT_MINUTES = 15
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+
+_cache = {}
+_cache_lock = threading.Lock()
+_CACHE_MAX = 64
+
+
+def rollup_path(filepath, target_date):
+    """Path del rollup di un giorno per la serie filepath."""
+    series = os.path.splitext(os.path.basename(filepath))[0]
+    return os.path.join(os.path.dirname(filepath), 'rollups', series,
+                        f"{target_date.strftime('%Y-%m-%d')}.json")
+
+
+def _new_stats():
+    return {'count': 0, 'sum': 0.0, 'min': None, 'max': None,
+            'pos_count': 0, 'pos_sum': 0.0}
+
+
+def _add(stats, value):
+    stats['count'] += 1
+    stats['sum'] += value
+    if stats['min'] is None or value < stats['min']:
+        stats['min'] = value
+    if stats['max'] is None or value > stats['max']:
+        stats['max'] = value
+    if value > 0:
+        stats['pos_count'] += 1
+        stats['pos_sum'] += value
+
+
+def _finish(stats, sample_hours):
+    stats['mean'] = stats['sum'] / stats['count'] if stats['count'] else None
+    # Energia nell'unita della serie per ora (W -> Wh, kW -> kWh)
+    stats['energy'] = stats['sum'] * sample_hours
+    return stats
+
+
+def compute_day_rollup(day_rows, target_date, sample_hours):
+    """
+    Calcola il rollup dalle coppie (datetime, value) di un giorno.
+    sample_hours: durata di una lettura in ore (POLL_INTERVAL / 3600).
+    """
+    day = _new_stats()
+    slots = {}
+    for ts, value in day_rows:
+        if ts.date() != target_date:
+            continue
+        _add(day, value)
+        index = (ts.hour * 60 + ts.minute) // SLOT_MINUTES
+        stats = slots.get(index)
+        if stats is None:
+            stats = slots[index] = _new_stats()
+        _add(stats, value)
+
+    return _assemble(target_date, day, slots, sample_hours)
+
+
+def rollup_from_slot_stats(slot_stats, target_date, sample_hours):
+    """
+    Costruisce il rollup da statistiche per slot gia aggregate altrove (es. in SQL):
+    {indice slot: {count, sum, min, max, pos_count, pos_sum}}.
+    """
+    day = _new_stats()
+    for stats in slot_stats.values():
+        day['count'] += stats['count']
+        day['sum'] += stats['sum']
+        day['pos_count'] += stats['pos_count']
+        day['pos_sum'] += stats['pos_sum']
+        if day['min'] is None or stats['min'] < day['min']:
+            day['min'] = stats['min']
+        if day['max'] is None or stats['max'] > day['max']:
+            day['max'] = stats['max']
+    return _assemble(target_date, day, dict(slot_stats), sample_hours)
+
+
+def _assemble(target_date, day, slots, sample_hours):
+    return {
+        'date': target_date.strftime('%Y-%m-%d'),
+        'slot_minutes': SLOT_MINUTES,
+        'day': _finish(day, sample_hours),
+        'slots': {str(i): _finish(s, sample_hours) for i, s in sorted(slots.items())},
+    }
+
+
+def save_day_rollup(filepath, rollup_data):
+    """Scrive il rollup su disco (file temporaneo + rename atomico)."""
+    path = rollup_path(filepath, _parse_date(rollup_data['date']))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(rollup_data, f)
+    os.replace(tmp_path, path)
+    _remember(path, rollup_data)
+
+
+def load_day_rollup(filepath, target_date):
+    """Rollup del giorno (dict) oppure None se non ancora materializzato."""
+    path = rollup_path(filepath, target_date)
+    with _cache_lock:
+        if path in _cache:
+            return _cache[path]
+    try:
+        with open(path, 'r') as f:
+            rollup_data = json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f'Rollup {path} illeggibile: {e}')
+        return None
+    _remember(path, rollup_data)
+    return rollup_data
+
+
+def _remember(path, rollup_data):
+    """Mette il rollup in cache, scartando il piu vecchio oltre _CACHE_MAX."""
+    with _cache_lock:
+        if path not in _cache and len(_cache) >= _CACHE_MAX:
+            _cache.pop(next(iter(_cache)))
+        _cache[path] = rollup_data
+
+
+def slot_range_stats(rollup_data, first_slot, last_slot):
+    """Somma delle statistiche 'pos_count'/'pos_sum' degli slot in [first_slot, last_slot)."""
+    pos_count = 0
+    pos_sum = 0.0
+    slots = rollup_data['slots']
+    for index in range(first_slot, last_slot):
+        stats = slots.get(str(index))
+        if stats:
+            pos_count += stats['pos_count']
+            pos_sum += stats['pos_sum']
+    return pos_count, pos_sum
+
+
+def _parse_date(text):
+    return datetime.strptime(text, '%Y-%m-%d').date()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Rotazione del file vivo di una serie per il cleanup di mezzanotte, senza
+bloccare ne perdere le scritture del thread di polling.
+
+Il file vivo e append-only: i byte gia scritti quando parte il cleanup
+(fino a 'sealed') sono un segmento sigillato che nessuno modifica piu.
+Il thread di cleanup lavora solo su quello: archivia la parte vecchia,
+copia il resto in <file>.next e registra la rotazione nel manifest
+<file>.rotation.json con os.replace. Il file vivo resta il segmento attivo:
+chi scrive continua ad accodare senza attese e, alla scrittura successiva,
+completa la rotazione copiando in <file>.next i byte accodati dopo 'sealed'
+e sostituendo il file vivo con os.replace. Solo chi scrive sostituisce il
+file su cui scrive, quindi nessuna riga va persa.
+
+Il manifest sopravvive a un riavvio: la rotazione viene completata alla
+prima scrittura, o scartata se il file vivo non e piu quello sigillato
+(es. riscritto da storage_tools). Scartandola, on_discard del motore toglie
+dall'archivio le righe ancora presenti nel file vivo, che altrimenti
+verrebbero lette due volte e archiviate di nuovo al cleanup successivo.
+Le righe del file vivo da 'cut' in poi passano nello stesso ordine nel file
+ruotato, spostate indietro dei byte archiviati: chi tiene posizioni in byte
+(indice dei giorni, follower, sketch) le riallinea senza rileggere la serie.
+"""
+
+import json
+import os
+
+from .file_utils import copy_range, fsync_dir
+
+
+def manifest_path(path):
+    """Manifest della rotazione in sospeso del file vivo."""
+    return path + '.rotation.json'
+
+
+def next_path(path):
+    """Segmento preparato dal cleanup che sostituira il file vivo."""
+    return path + '.next'
+
+
+def seal(path, sealed, first_epoch, cut=None):
+    """
+    Registra la rotazione preparata in <path>.next: 'sealed' e la dimensione del
+    file vivo copiata (o archiviata), 'first_epoch' la sua prima lettura, 'cut'
+    la posizione nel file vivo della prima riga mantenuta. Ritorna il manifest.
+    """
+    manifest = {'inode': os.stat(path).st_ino, 'sealed': sealed, 'first_epoch': first_epoch, 'cut': cut}
+    tmp_path = manifest_path(path) + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, manifest_path(path))
+    fsync_dir(os.path.dirname(os.path.abspath(path)))
+    return manifest
+
+
+def load(path, on_discard=None):
+    """
+    Manifest della rotazione in sospeso (None se assente). Una rotazione non
+    piu applicabile (file vivo sostituito o accorciato, segmento mancante)
+    viene scartata, poi passata a on_discard(manifest).
+    """
+    try:
+        with open(manifest_path(path), 'r') as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f'Manifest rotazione {path} illeggibile: {e}')
+        discard(path)
+        return None
+    if not _applicable(path, manifest):
+        print(f'Rotazione {path} non piu applicabile: scartata')
+        discard(path, manifest, on_discard)
+        return None
+    return manifest
+
+
+def _applicable(path, manifest):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return False
+    return (st.st_ino == manifest.get('inode') and st.st_size >= manifest.get('sealed', 0)
+            and os.path.exists(next_path(path)))
+
+
+def complete(path, manifest, on_discard=None):
+    """
+    Accoda a <path>.next i byte scritti dopo il sigillo e lo sostituisce al
+    file vivo. Va chiamata solo da chi scrive il file. Ritorna i byte copiati.
+    Una rotazione non piu applicabile viene scartata (vedi discard).
+    """
+    if not _applicable(path, manifest):
+        discard(path, manifest, on_discard)
+        raise ValueError(f'rotazione di {path} non piu applicabile')
+    with open(path, 'rb') as src, open(next_path(path), 'ab') as dst:
+        src.seek(manifest['sealed'])
+        copied = copy_range(src, dst)
+        dst.flush()
+        os.fsync(dst.fileno())
+    os.replace(next_path(path), path)
+    os.remove(manifest_path(path))
+    fsync_dir(os.path.dirname(os.path.abspath(path)))
+    return copied
+
+
+def discard(path, manifest=None, on_discard=None):
+    """
+    Rimuove segmento preparato e manifest di una rotazione, poi chiama
+    on_discard(manifest): il motore annulla l'archiviazione del cleanup se le
+    righe archiviate sono ancora nel file vivo (vedi archived_rows_live).
+    """
+    for leftover in (next_path(path), manifest_path(path)):
+        try:
+            os.remove(leftover)
+        except FileNotFoundError:
+            pass
+    if manifest is not None and on_discard is not None:
+        try:
+            on_discard(manifest)
+        except Exception as e:
+            print(f'Errore ripristino archivio della rotazione {path}: {e}')
+
+
+def archived_rows_live(manifest, live_first_epoch):
+    """
+    True se le righe archiviate dal cleanup di una rotazione scartata sono
+    ancora nel file vivo: il file inizia ancora dalla loro prima lettura (o
+    prima). Dopo una rotazione completata il file vivo inizia piu avanti.
+    """
+    first = manifest.get('first_epoch')
+    return first is not None and live_first_epoch is not None and live_first_epoch <= first
+
+
+def archive_end(manifest, end):
+    """
+    Limite delle letture d'archivio con una rotazione in sospeso: le righe
+    archiviate sono ancora anche nel file vivo, dalla sua prima lettura in poi.
+    """
+    first = manifest.get('first_epoch') if manifest is not None else None
+    if first is None or (end is not None and end <= first):
+        return end
+    return first
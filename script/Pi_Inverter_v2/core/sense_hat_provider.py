@@ -2,7 +2,8 @@
 # -*- coding: utf-8 -*-
 """
 Singleton per SenseHat — una sola istanza per l'intera applicazione.
-Include cleanup automatico dei LED all'uscita (atexit + SIGTERM).
+Include cleanup automatico dei LED all'uscita (atexit + SIGTERM) e gli hook
+di arresto registrati dagli altri moduli (es. flush delle letture in attesa).
 """
 
 import atexit
@@ -11,6 +12,7 @@ import sys
 
 
 _instance = None
+_exit_hooks = []
 
 
 def get_sense_hat():
@@ -30,8 +32,18 @@ def get_sense_hat():
     return _instance
 
 
+def add_exit_hook(hook):
+    """Registra una funzione da eseguire all'uscita (atexit o SIGTERM), prima dei LED."""
+    _exit_hooks.append(hook)
+
+
 def _cleanup():
-    """Spegne i LED all'uscita normale (atexit)."""
+    """Esegue gli hook di arresto e spegne i LED all'uscita normale (atexit)."""
+    for hook in _exit_hooks:
+        try:
+            hook()
+        except Exception as e:
+            print(f"Errore hook di arresto {hook.__name__}: {e}")
     if _instance is not None:
         try:
             _instance.clear()
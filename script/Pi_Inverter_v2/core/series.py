@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Serie storica compatta restituita dalle letture di data_store (e dal
+CSVHandler legacy): timestamp epoch wall clock in array('q') e valori in
+array('d'), 16 byte per lettura invece di tuple e float boxed.
+
+Slicing (per indice o per tempo) e filtri per segno sono viste sugli stessi
+array, senza copie; len/min/max di una vista sono calcolati una volta sola.
+Iterare una Series produce i valori, come la vecchia lista di read_all_values;
+items() produce le coppie (datetime, value). Solo libreria standard.
+"""
+
+import bisect
+import heapq
+from array import array
+from itertools import compress, islice
+
+from .timestamps import epoch_to_datetime
+
+# Filtri per segno: metodi dei float in C, nessuna funzione Python per elemento
+_SIGN_TESTS = {
+    'positive': (0.0).__lt__,       # v > 0
+    'non_negative': (0.0).__le__,   # v >= 0
+    'negative': (0.0).__gt__,       # v < 0
+}
+
+
+class Series:
+    """
+    Vista [start, stop) su array (epoch, valori) condivisi, opzionalmente
+    filtrata per segno. Gli array non vanno modificati finche esistono viste.
+    """
+
+    __slots__ = ('times', 'values', 'start', 'stop', 'sign', '_length', '_min', '_max')
+
+    def __init__(self, times=None, values=None, start=0, stop=None, sign=None):
+        self.times = times if times is not None else array('q')
+        self.values = values if values is not None else array('d')
+        self.start = start
+        self.stop = len(self.values) if stop is None else stop
+        self.sign = sign
+        self._length = None if sign else self.stop - self.start
+        self._min = None
+        self._max = None
+
+    @classmethod
+    def from_pairs(cls, pairs):
+        """Series da coppie (epoch, value) in ordine di tempo."""
+        times = array('q')
+        values = array('d')
+        for epoch, value in pairs:
+            times.append(epoch)
+            values.append(value)
+        return cls(times, values)
+
+    def _raw(self, data):
+        if self.start == 0 and self.stop == len(data):
+            return iter(data)
+        return islice(data, self.start, self.stop)
+
+    def _mask(self):
+        return map(_SIGN_TESTS[self.sign], self._raw(self.values))
+
+    def __iter__(self):
+        """Valori della vista (float), in ordine di tempo."""
+        if self.sign is None:
+            return self._raw(self.values)
+        return filter(_SIGN_TESTS[self.sign], self._raw(self.values))
+
+    def __len__(self):
+        if self._length is None:
+            self._length = sum(self._mask())
+        return self._length
+
+    def __getitem__(self, index):
+        if self.sign is not None:
+            raise TypeError('Una vista filtrata per segno non e indicizzabile: usare iter() o items()')
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.stop - self.start)
+            if step != 1:
+                raise ValueError('Slicing con passo diverso da 1 non supportato')
+            return Series(self.times, self.values, self.start + start, self.start + max(start, stop))
+        length = self.stop - self.start
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError(index)
+        return self.values[self.start + index]
+
+    def __repr__(self):
+        return f'Series({len(self)} letture{", " + self.sign if self.sign else ""})'
+
+    def epochs(self):
+        """Timestamp epoch wall clock della vista."""
+        if self.sign is None:
+            return self._raw(self.times)
+        return compress(self._raw(self.times), self._mask())
+
+    def items(self):
+        """Coppie (datetime, value) della vista."""
+        return ((epoch_to_datetime(epoch), value) for epoch, value in zip(self.epochs(), self))
+
+    def between(self, start_epoch=None, end_epoch=None):
+        """Vista delle letture con start_epoch <= epoch < end_epoch (ricerca binaria sui tempi)."""
+        if self.sign is not None:
+            raise TypeError('between() va applicato prima del filtro per segno')
+        first = self.start if start_epoch is None else \
+            bisect.bisect_left(self.times, start_epoch, self.start, self.stop)
+        last = self.stop if end_epoch is None else \
+            bisect.bisect_left(self.times, end_epoch, first, self.stop)
+        return Series(self.times, self.values, first, last)
+
+    def positive(self):
+        """Vista dei soli valori > 0."""
+        return self._filtered('positive')
+
+    def non_negative(self):
+        """Vista dei soli valori >= 0."""
+        return self._filtered('non_negative')
+
+    def negative(self):
+        """Vista dei soli valori < 0."""
+        return self._filtered('negative')
+
+    def _filtered(self, sign):
+        if self.sign is not None and self.sign != sign:
+            raise TypeError(f'Vista gia filtrata ({self.sign})')
+        return Series(self.times, self.values, self.start, self.stop, sign)
+
+    def min(self):
+        """Valore minimo della vista (None se vuota)."""
+        if self._min is None and len(self):
+            self._min = min(self)
+        return self._min
+
+    def max(self):
+        """Valore massimo della vista (None se vuota)."""
+        if self._max is None and len(self):
+            self._max = max(self)
+        return self._max
+
+    def percentile(self, pct):
+        """
+        Percentile pct con la semantica di _percentile (indice int(n * pct / 100)
+        della lista ordinata), senza ordinare una copia: selezione con un heap
+        dei soli valori dalla parte piu corta (per p98 il 2% piu alto).
+        """
+        n = len(self)
+        if not n:
+            return None
+        index = min(int(n * pct / 100), n - 1)
+        if index < n // 2:
+            return heapq.nsmallest(index + 1, self)[-1]
+        return heapq.nlargest(n - index, self)[-1]
+
+    def tolist(self):
+        return list(self)
+
+    def to_arrays(self):
+        """Copie compatte (array('q'), array('d')) della vista."""
+        if self.sign is None:
+            return self.times[self.start:self.stop], self.values[self.start:self.stop]
+        return array('q', self.epochs()), array('d', self)
+
+    def nbytes(self):
+        """Byte degli array sottostanti (condivisi tra le viste)."""
+        return (self.times.buffer_info()[1] * self.times.itemsize
+                + self.values.buffer_info()[1] * self.values.itemsize)
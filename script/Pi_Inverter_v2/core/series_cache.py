@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cache residente delle serie: un buffer circolare limitato per serie
+(array compatti 'q' per i timestamp epoch wall clock e 'd' per i valori),
+caricato una volta con il percorso bulk del motore e aggiornato dallo stesso
+append_reading che scrive su disco. Se il file cambia fuori dal processo
+(inode/dimensione/mtime diversi da quelli attesi) la serie viene ricaricata.
+"""
+
+import bisect
+import threading
+from array import array
+
+
+class SeriesBuffer:
+    """
+    Buffer limitato a `capacity` letture: oltre la capacita le piu vecchie
+    vengono scartate (a blocchi, per ammortizzare lo spostamento in memoria).
+    `complete` resta True finche il buffer contiene l'intera serie.
+    """
+
+    __slots__ = ('times', 'values', 'capacity', 'complete')
+
+    def __init__(self, capacity, times=None, values=None):
+        self.capacity = capacity
+        self.times = times if times is not None else array('q')
+        self.values = values if values is not None else array('d')
+        self.complete = True
+        self._trim()
+
+    def __len__(self):
+        return len(self.values)
+
+    def append(self, epoch, value):
+        self.times.append(epoch)
+        self.values.append(value)
+        if len(self.values) > self.capacity + self.capacity // 16:
+            self._trim()
+
+    def _trim(self):
+        excess = len(self.values) - self.capacity
+        if excess > 0:
+            del self.times[:excess]
+            del self.values[:excess]
+            self.complete = False
+
+    def first_time(self):
+        return self.times[0] if self.times else None
+
+    def range_indexes(self, start, end):
+        """Indici [i, j) delle letture con start <= timestamp < end (timestamp ordinati)."""
+        return bisect.bisect_left(self.times, start), bisect.bisect_left(self.times, end)
+
+    def nbytes(self):
+        return (self.times.buffer_info()[1] * self.times.itemsize
+                + self.values.buffer_info()[1] * self.values.itemsize)
+
+
+class SeriesCache:
+    """Cache di processo: filepath logico -> SeriesBuffer, con statistiche hit/miss."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._entries = {}
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+
+    def get(self, filepath, engine):
+        """Buffer della serie, caricato (o ricaricato se il file e cambiato) se serve."""
+        with self._lock:
+            entry = self._entries.get(filepath)
+            version = engine.version()
+            if entry is None or entry['version'] != version:
+                times, values = engine.load_arrays()
+                entry = {'buffer': SeriesBuffer(self.capacity, times, values),
+                         'version': version}
+                self._entries[filepath] = entry
+                self.loads += 1
+            return entry['buffer']
+
+    def is_current(self, filepath, engine):
+        """True se la serie e caricata e allineata al file."""
+        with self._lock:
+            entry = self._entries.get(filepath)
+            return entry is not None and entry['version'] == engine.version()
+
+    def refresh_version(self, filepath, engine):
+        """Riallinea la versione dopo che il processo ha scritto righe gia presenti nel buffer."""
+        with self._lock:
+            entry = self._entries.get(filepath)
+            if entry is not None:
+                entry['version'] = engine.version()
+
+    def note_append(self, filepath, engine, epoch, value):
+        """Aggiunge al buffer (se caricato) la lettura appena scritta dal processo."""
+        with self._lock:
+            entry = self._entries.get(filepath)
+            if entry is None:
+                return
+            entry['buffer'].append(epoch, value)
+            entry['version'] = engine.version()
+
+    def drop_before(self, filepath, engine, epoch):
+        """
+        Riallinea la serie al file ruotato dal cleanup (vedi rotation) senza
+        ricaricarla: scarta dal buffer le letture archiviate, precedenti a epoch.
+        """
+        with self._lock:
+            entry = self._entries.get(filepath)
+            if entry is None:
+                return
+            buffer = entry['buffer']
+            index = bisect.bisect_left(buffer.times, epoch)
+            del buffer.times[:index]
+            del buffer.values[:index]
+            entry['version'] = engine.version()
+
+    def invalidate(self, filepath):
+        with self._lock:
+            self._entries.pop(filepath, None)
+
+    def record_hit(self):
+        self.hits += 1
+
+    def record_miss(self):
+        self.misses += 1
+
+    def stats(self):
+        """Hit/miss, caricamenti e memoria residente (byte) per serie."""
+        with self._lock:
+            series = {path: {'records': len(entry['buffer']),
+                             'bytes': entry['buffer'].nbytes(),
+                             'complete': entry['buffer'].complete}
+                      for path, entry in self._entries.items()}
+        return {'hits': self.hits, 'misses': self.misses, 'loads': self.loads,
+                'bytes': sum(s['bytes'] for s in series.values()), 'series': series}
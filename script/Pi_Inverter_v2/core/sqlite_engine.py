@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Motore di storage SQLite (stdlib sqlite3) in modalita WAL: tutte le serie in
+un unico database, tabella `samples` WITHOUT ROWID con chiave primaria
+(series, ts) -> le letture per intervallo sono range scan sulla chiave.
+Le scritture sono raccolte in batch e inserite in una sola transazione;
+aggregati per bucket (min/max/count/sum) calcolati direttamente in SQL.
+Ogni thread usa la propria connessione: con il WAL i lettori non bloccano
+chi scrive (e viceversa), il cleanup di mezzanotte non ferma il polling.
+
+Le posizioni usate per gli aggiornamenti incrementali (size/scan_values)
+sono timestamp epoch wall clock invece di offset in byte.
+
+Le letture non OK (vedi quality) sono in `sample_flags`: quelle STALE/FAILED
+solo li, quelle INTERPOLATED anche in `samples`, che resta la tabella delle
+letture usabili letta da aggregati e range scan (database esistenti compatibili).
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from datetime import datetime, timedelta
+
+from .quality import OK, USABLE, text_flag
+from .timestamps import parse_ts, epoch_to_datetime, datetime_to_epoch
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    series TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (series, ts)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS samples_archive (
+    series TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (series, ts)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS sample_flags (
+    series TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    flag INTEGER NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (series, ts)
+) WITHOUT ROWID;
+"""
+
+BUSY_TIMEOUT = 30          # Secondi di attesa se un altro thread/processo sta scrivendo
+CLEANUP_CHUNK = 10000      # Righe spostate in archivio per transazione
+
+# Connessioni per thread: thread -> {db_path: connessione}
+_local = threading.local()
+
+
+def series_name(filepath):
+    """Nome della serie nel database (logs/power_log.csv -> 'power_log')."""
+    return os.path.splitext(os.path.basename(filepath))[0]
+
+
+def connect(db_path):
+    """Connessione del thread corrente al database (creata alla prima richiesta)."""
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(db_path)
+    if conn is None:
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT)
+        conn.execute('PRAGMA journal_mode=WAL')
+        # In WAL, NORMAL non perde la consistenza: al massimo le ultime transazioni
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript(SCHEMA)
+        connections[db_path] = conn
+    return conn
+
+
+class SqliteEngine:
+    """Serie memorizzata come righe (series, ts, value) di un database SQLite condiviso."""
+
+    name = 'sqlite'
+
+    def __init__(self, filepath, db_path, batch_size=10, flush_interval=600):
+        self.path = db_path
+        self.series = series_name(filepath)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending = []
+        self._pending_since = None
+        self._lock = threading.Lock()
+        # (inode, primo ts, ultimo ts) su disco: letti una volta, poi aggiornati da flush e cleanup
+        self._known_bounds = None
+        self._bounds_changes = 0
+
+    def _conn(self):
+        return connect(self.path)
+
+    def exists(self):
+        if self._pending:
+            return True
+        if not os.path.exists(self.path):
+            return False
+        row = self._conn().execute('SELECT 1 FROM samples WHERE series = ? LIMIT 1',
+                                   (self.series,)).fetchone()
+        return row is not None
+
+    def identity(self):
+        """Inode del database (None se non esiste)."""
+        try:
+            return os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return None
+
+    def _bounds(self):
+        """
+        (primo, ultimo) timestamp su disco della serie, (None, None) se vuota.
+        Letti dal database solo la prima volta (o se il database e stato
+        sostituito): poi li tengono aggiornati flush e cleanup.
+        """
+        inode = self.identity()
+        if inode is None:
+            return None, None
+        known = self._known_bounds
+        if known is None or known[0] != inode:
+            changes = self._bounds_changes
+            first, last = self._conn().execute('SELECT MIN(ts), MAX(ts) FROM samples WHERE series = ?',
+                                               (self.series,)).fetchone()
+            known = (inode, first, last)
+            with self._lock:
+                # Un flush concluso durante la query: i limiti letti potrebbero essere gia vecchi
+                if changes == self._bounds_changes:
+                    self._known_bounds = known
+        return known[1:]
+
+    def _note_written(self, times):
+        """Aggiorna i limiti in memoria con i timestamp appena scritti in samples."""
+        with self._lock:
+            self._bounds_changes += 1
+            known = self._known_bounds
+            if known is None or not times:
+                return
+            inode, first, last = known
+            self._known_bounds = (inode, min(times) if first is None else min(first, min(times)),
+                                  max(times) if last is None else max(last, max(times)))
+
+    def size(self):
+        """Posizione di fine serie: ultimo timestamp + 1 (righe in batch comprese), 0 se vuota."""
+        last = self._bounds()[1]
+        with self._lock:
+            if self._pending:
+                last = max(last or 0, max(row[0] for row in self._pending))
+        return 0 if last is None else last + 1
+
+    def version(self):
+        """(inode, primo ts, fine serie): cambia con ogni append e con il cleanup (nessuna query)."""
+        inode = self.identity()
+        if inode is None and not self._pending:
+            return None
+        return (inode, self._bounds()[0], self.size())
+
+    def append(self, timestamp, value, flag=OK):
+        """
+        Accoda la lettura al batch in memoria; il batch viene scritto in una sola
+        transazione dopo batch_size letture o flush_interval secondi.
+        Ritorna la nuova posizione di fine serie.
+        """
+        epoch = parse_ts(timestamp)
+        with self._lock:
+            self._pending.append((epoch, float(value), flag))
+            if self._pending_since is None:
+                self._pending_since = time.monotonic()
+            due = (len(self._pending) >= self.batch_size
+                   or time.monotonic() - self._pending_since >= self.flush_interval)
+        if due:
+            self.flush()
+        return epoch + 1
+
+    def append_many(self, rows):
+        """Aggiunge un blocco di letture (timestamp, value[, flag]) e lo scrive subito in una transazione."""
+        with self._lock:
+            self._pending.extend((parse_ts(row[0]), float(row[1]), row[2] if len(row) > 2 else OK)
+                                 for row in rows)
+        self.flush()
+        return self.size()
+
+    def last_epoch(self):
+        """Ultimo timestamp della serie (righe in batch comprese), None se vuota."""
+        size = self.size()
+        return size - 1 if size else None
+
+    def flush(self):
+        """Scrive il batch in attesa (executemany in una transazione). Ritorna le righe scritte."""
+        with self._lock:
+            rows, self._pending = self._pending, []
+            self._pending_since = None
+        if not rows:
+            return 0
+        try:
+            with self._conn() as conn:
+                conn.executemany('INSERT OR IGNORE INTO samples (series, ts, value) VALUES (?, ?, ?)',
+                                 [(self.series, ts, value) for ts, value, flag in rows if flag in USABLE])
+                conn.executemany('INSERT OR IGNORE INTO sample_flags (series, ts, flag, value) '
+                                 'VALUES (?, ?, ?, ?)',
+                                 [(self.series, ts, flag, value) for ts, value, flag in rows if flag != OK])
+        except Exception:
+            # Database occupato o errore di I/O: il batch resta in attesa per il prossimo flush
+            with self._lock:
+                self._pending = rows + self._pending
+                if self._pending_since is None:
+                    self._pending_since = time.monotonic()
+            raise
+        self._note_written([ts for ts, value, flag in rows if flag in USABLE])
+        return len(rows)
+
+    def _query(self, sql, params):
+        """Esegue una lettura dopo aver scritto il batch in attesa."""
+        self.flush()
+        return self._conn().execute(sql, params)
+
+    def values(self):
+        return [value for (value,) in self._query(
+            'SELECT value FROM samples WHERE series = ? ORDER BY ts', (self.series,))]
+
+    def load_arrays(self):
+        return self.arrays_since(0)[:2]
+
+    def arrays_since(self, offset):
+        """
+        Letture con ts >= offset (posizioni di size()) come array (epoch wall clock,
+        valori) e posizione dopo l'ultima letta: le righe ancora nel batch restano escluse.
+        """
+        times = array('q')
+        values = array('d')
+        for ts, value in self._query('SELECT ts, value FROM samples WHERE series = ? AND ts >= ? ORDER BY ts',
+                                     (self.series, offset)):
+            times.append(ts)
+            values.append(value)
+        return times, values, (times[-1] + 1 if times else offset)
+
+    def scan_values(self, start=0, stop=None):
+        """Valori con start <= ts < stop (posizioni di size())."""
+        if stop is None:
+            stop = self.size()
+        for (value,) in self._query(
+                'SELECT value FROM samples WHERE series = ? AND ts >= ? AND ts < ? ORDER BY ts',
+                (self.series, start, stop)):
+            yield value
+
+    def tail_values(self, n):
+        """Gli ultimi N valori in ordine cronologico (range scan all'indietro sulla chiave)."""
+        if n <= 0:
+            return []
+        rows = self._query('SELECT value FROM samples WHERE series = ? ORDER BY ts DESC LIMIT ?',
+                           (self.series, n))
+        values = [value for (value,) in rows]
+        values.reverse()
+        return values
+
+    def iter_range(self, start=None, end=None, reverse=False):
+        """Coppie (epoch, value) con start <= ts < end, in streaming dal cursore (reverse: ts decrescente)."""
+        yield from self._query(
+            'SELECT ts, value FROM samples WHERE series = ? AND ts >= ? AND ts < ? '
+            'ORDER BY ts' + (' DESC' if reverse else ''),
+            (self.series, -2 ** 63 if start is None else start, 2 ** 63 - 1 if end is None else end))
+
+    def iter_flags(self, start=None, end=None):
+        """Coppie (epoch, flag) delle letture non OK con start <= ts < end (range scan su sample_flags)."""
+        yield from self._query(
+            'SELECT ts, flag FROM sample_flags WHERE series = ? AND ts >= ? AND ts < ? ORDER BY ts',
+            (self.series, -2 ** 63 if start is None else start, 2 ** 63 - 1 if end is None else end))
+
+    def day_rows(self, target_date):
+        """Coppie (datetime, value) del giorno target_date."""
+        start = datetime_to_epoch(datetime.combine(target_date, datetime.min.time()))
+        return [(epoch_to_datetime(ts), value) for ts, value in self.iter_range(start, start + 86400)]
+
+    def bucket_stats(self, start, end, bucket_seconds):
+        """
+        Aggregati per bucket calcolati in SQL sulle letture con start <= ts < end.
+        Ritorna {indice bucket: stats} con le chiavi usate dai rollup
+        (count, sum, min, max, pos_count, pos_sum).
+        """
+        rows = self._query(
+            'SELECT (ts - ?) / ?, COUNT(*), TOTAL(value), MIN(value), MAX(value), '
+            'SUM(value > 0), TOTAL(CASE WHEN value > 0 THEN value END) '
+            'FROM samples WHERE series = ? AND ts >= ? AND ts < ? GROUP BY 1',
+            (start, bucket_seconds, self.series, start, end))
+        return {index: {'count': count, 'sum': total, 'min': low, 'max': high,
+                        'pos_count': pos_count, 'pos_sum': pos_sum}
+                for index, count, total, low, high, pos_count, pos_sum in rows}
+
+    def iter_archive(self, start=None, end=None, reverse=False):
+        """Coppie (epoch, value) di samples_archive con start <= ts < end, in streaming."""
+        cursor = self._conn().execute(
+            'SELECT ts, value FROM samples_archive WHERE series = ? AND ts >= ? AND ts < ? '
+            'ORDER BY ts' + (' DESC' if reverse else ''), (self.series, -2 ** 63 if start is None else start,
+                            2 ** 63 - 1 if end is None else end))
+        yield from cursor
+
+    def cleanup(self, max_age_days):
+        """
+        Sposta in samples_archive le letture piu vecchie di max_age_days, a blocchi
+        di CLEANUP_CHUNK righe per transazione (le scritture del polling si
+        intercalano tra un blocco e l'altro).
+        """
+        if not self.exists():
+            return None
+        started = time.monotonic()
+        self.flush()
+        threshold = datetime.now() - timedelta(days=max_age_days)
+        cutoff = datetime_to_epoch(threshold) + (1 if threshold.second or threshold.microsecond else 0)
+        conn = self._conn()
+        archived = 0
+        while True:
+            with conn:
+                (last,) = conn.execute(
+                    'SELECT MAX(ts) FROM (SELECT ts FROM samples WHERE series = ? AND ts < ? '
+                    'ORDER BY ts LIMIT ?)', (self.series, cutoff, CLEANUP_CHUNK)).fetchone()
+                if last is None:
+                    break
+                conn.execute('INSERT OR IGNORE INTO samples_archive SELECT series, ts, value '
+                             'FROM samples WHERE series = ? AND ts <= ?', (self.series, last))
+                archived += conn.execute('DELETE FROM samples WHERE series = ? AND ts <= ?',
+                                         (self.series, last)).rowcount
+        if archived:
+            # Primo timestamp cambiato: i limiti vengono riletti alla prossima richiesta
+            with self._lock:
+                self._bounds_changes += 1
+                self._known_bounds = None
+        (kept,) = conn.execute('SELECT COUNT(*) FROM samples WHERE series = ?',
+                               (self.series,)).fetchone()
+        elapsed = time.monotonic() - started
+        print(f'Cleanup {self.series}: archiviate {archived} righe, mantenute {kept} ({elapsed:.2f}s)')
+        return {'archived_rows': archived, 'kept_rows': kept, 'elapsed': elapsed}
+
+
+def import_csv(csv_path, filepath, db_path, batch_rows=5000):
+    """
+    Importa un CSV storico nella serie series_name(filepath) del database.
+    Ritorna (righe importate, righe non valide scartate).
+    """
+    series = series_name(filepath)
+    conn = connect(db_path)
+    imported = skipped = 0
+    batch = []
+    flagged = []
+    with open(csv_path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            parts = line.strip().split(',')
+            try:
+                row = (series, parse_ts(parts[0]), float(parts[1]))
+            except (ValueError, IndexError):
+                skipped += 1
+                continue
+            flag = text_flag(parts)
+            if flag != OK:
+                flagged.append((series, row[1], flag, row[2]))
+            if flag in USABLE:
+                batch.append(row)
+            if len(batch) >= batch_rows:
+                with conn:
+                    conn.executemany('INSERT OR IGNORE INTO samples VALUES (?, ?, ?)', batch)
+                imported += len(batch)
+                batch = []
+    if batch:
+        with conn:
+            conn.executemany('INSERT OR IGNORE INTO samples VALUES (?, ?, ?)', batch)
+        imported += len(batch)
+    if flagged:
+        with conn:
+            conn.executemany('INSERT OR IGNORE INTO sample_flags VALUES (?, ?, ?, ?)', flagged)
+    return imported, skipped
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Lettura incrementale di una serie che cresce in coda: il follower tiene in
+memoria gli array (epoch, valori) gia letti, la posizione di fine lettura e
+l'identita del file, e a ogni refresh legge dal motore solo le righe
+accodate dopo quella posizione (arrays_since), con costo O(righe nuove).
+Se il file e stato sostituito (cleanup, rotazione) o accorciato (riparazione
+della coda) riparte da zero con array nuovi.
+"""
+
+from array import array
+from bisect import bisect_left
+
+from .series import Series
+
+
+class TailFollower:
+    """
+    Serie intera di un motore, aggiornata per differenza. refresh() restituisce
+    una Series che e una vista sugli array del follower: le letture successive
+    accodano senza modificare le viste gia restituite, un reset crea array nuovi.
+    """
+
+    __slots__ = ('engine', 'times', 'values', 'identity', 'offset', 'resets', 'parsed_rows')
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.times = array('q')
+        self.values = array('d')
+        self.identity = None
+        self.offset = 0
+        self.resets = 0
+        self.parsed_rows = 0
+
+    def reset(self):
+        """Dimentica lo stato: il prossimo refresh rilegge la serie dall'inizio."""
+        self.times = array('q')
+        self.values = array('d')
+        self.identity = None
+        self.offset = 0
+
+    def rotate(self, manifest, removed, first_epoch):
+        """
+        Riallinea il follower al file ruotato dal cleanup (manifest della
+        rotazione, vedi rotation) senza rileggerlo: scarta le letture archiviate
+        (prima di first_epoch, la prima lettura del file ruotato) e sposta la
+        posizione indietro dei byte archiviati. Array nuovi: le viste gia
+        restituite restano invariate. False se il follower non era allineato al
+        file sigillato: va ricreato.
+        """
+        cut = manifest.get('cut')
+        if cut is None or self.identity != manifest.get('inode') or self.offset < cut:
+            return False
+        index = bisect_left(self.times, first_epoch)
+        self.times = self.times[index:]
+        self.values = self.values[index:]
+        self.offset -= removed
+        self.identity = self.engine.identity()
+        return True
+
+    def refresh(self):
+        """Legge le righe nuove e restituisce l'intera serie come Series."""
+        identity = self.engine.identity()
+        size = self.engine.size()
+        if identity != self.identity or size < self.offset:
+            if self.identity is not None:
+                self.resets += 1
+            self.reset()
+            self.identity = identity
+        if size > self.offset:
+            times, values, self.offset = self.engine.arrays_since(self.offset)
+            self.times.extend(times)
+            self.values.extend(values)
+            self.parsed_rows += len(values)
+        return Series(self.times, self.values)
+
+    def stats(self):
+        """Letture in memoria, righe lette in totale e reset per sostituzione del file."""
+        return {'records': len(self.values), 'parsed_rows': self.parsed_rows, 'resets': self.resets}
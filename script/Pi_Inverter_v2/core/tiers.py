@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Risoluzioni consolidate delle serie, stile RRD: accanto alle letture al
+minuto un CSV per livello (15 minuti, 1 ora, ...) con una riga per
+intervallo chiuso 'YYYY_MM_DD_HH:MM,min,max,mean,last,count' (timestamp =
+inizio intervallo). Il consolidamento e aggiornato a ogni lettura:
+l'intervallo aperto resta in memoria e la sua riga viene accodata quando
+arriva la prima lettura dell'intervallo successivo. Ogni livello ha la sua
+retention, applicata dal cleanup di mezzanotte.
+
+File: logs/tiers/<serie>/<livello>.csv (es. 15m.csv, 1h.csv)
+"""
+
+import os
+import threading
+import time
+
+from .csv_engine import _find_cut, _tail_lines
+from .file_utils import copy_range, fsync_dir
+from .timestamps import format_ts, line_epoch, utc_to_wall
+
+# Campi dell'intervallo aperto
+_START, _COUNT, _SUM, _MIN, _MAX, _LAST = range(6)
+
+_WRITE_BATCH = 1000     # Righe accodate con una sola scrittura durante la ricostruzione
+
+
+def tier_dir(filepath):
+    """Directory dei livelli della serie (logs/power_log.csv -> logs/tiers/power_log/)."""
+    series = os.path.splitext(os.path.basename(filepath))[0]
+    return os.path.join(os.path.dirname(filepath), 'tiers', series)
+
+
+def _format(bucket):
+    return (f'{format_ts(bucket[_START])},{bucket[_MIN]:g},{bucket[_MAX]:g},'
+            f'{bucket[_SUM] / bucket[_COUNT]:g},{bucket[_LAST]:g},{bucket[_COUNT]}\n')
+
+
+def _stats(bucket):
+    return {'min': bucket[_MIN], 'max': bucket[_MAX], 'mean': bucket[_SUM] / bucket[_COUNT],
+            'last': bucket[_LAST], 'count': bucket[_COUNT]}
+
+
+class Tier:
+    """Un livello di consolidamento: intervalli di `seconds` secondi tenuti retention_days giorni."""
+
+    def __init__(self, path, name, seconds, retention_days=None):
+        self.path = path
+        self.name = name
+        self.seconds = seconds
+        self.retention_days = retention_days
+        self.bucket = None
+        self.last_written = self._last_written()
+
+    def _last_written(self):
+        """Inizio dell'ultimo intervallo gia su disco (None se il file e vuoto o assente)."""
+        if not os.path.exists(self.path):
+            return None
+        for line in reversed(_tail_lines(self.path, 5)):
+            epoch = line_epoch(line.encode('ascii', errors='replace'), {})
+            if epoch is not None:
+                return epoch
+        return None
+
+    def add(self, epoch, value):
+        """
+        Aggiorna l'intervallo aperto con una lettura. Ritorna la riga dell'intervallo
+        appena chiuso (str) oppure None. Letture di intervalli gia consolidati o
+        precedenti a quello aperto (orologio spostato indietro) vengono ignorate.
+        """
+        start = epoch - epoch % self.seconds
+        bucket = self.bucket
+        if bucket is not None and start == bucket[_START]:
+            bucket[_COUNT] += 1
+            bucket[_SUM] += value
+            if value < bucket[_MIN]:
+                bucket[_MIN] = value
+            if value > bucket[_MAX]:
+                bucket[_MAX] = value
+            bucket[_LAST] = value
+            return None
+        if (bucket is not None and start < bucket[_START]) or \
+                (self.last_written is not None and start <= self.last_written):
+            return None
+        self.bucket = [start, 1, value, value, value, value]
+        if bucket is None:
+            return None
+        self.last_written = bucket[_START]
+        return _format(bucket)
+
+    def write(self, lines):
+        if not lines:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'a', encoding='ascii') as f:
+            f.write(''.join(lines))
+
+    def iter_rows(self, start=None, end=None):
+        """
+        Intervalli (epoch di inizio, {min, max, mean, last, count}) con start <= epoch < end,
+        in ordine; l'intervallo aperto in memoria (parziale) e l'ultimo.
+        """
+        if os.path.exists(self.path):
+            day_epochs = {}
+            with open(self.path, 'rb') as f:
+                if start is not None:
+                    f.seek(_find_cut(f, os.fstat(f.fileno()).st_size, format_ts(start).encode('ascii')))
+                for line in f:
+                    epoch = line_epoch(line, day_epochs)
+                    if epoch is None or not line.endswith(b'\n'):
+                        continue
+                    if end is not None and epoch >= end:
+                        return
+                    fields = line[17:].split(b',')
+                    try:
+                        yield epoch, {'min': float(fields[0]), 'max': float(fields[1]),
+                                      'mean': float(fields[2]), 'last': float(fields[3]),
+                                      'count': int(fields[4])}
+                    except (ValueError, IndexError):
+                        continue
+        bucket = self.bucket
+        if bucket is not None and (start is None or bucket[_START] >= start) \
+                and (end is None or bucket[_START] < end):
+            yield bucket[_START], _stats(bucket)
+
+    def covers(self, epoch, now=None):
+        """True se la retention del livello arriva indietro fino a epoch."""
+        if self.retention_days is None:
+            return True
+        now = utc_to_wall(time.time()) if now is None else now
+        return epoch >= now - self.retention_days * 86400
+
+    def cleanup(self, now=None):
+        """Elimina gli intervalli oltre la retention (file temporaneo + os.replace). Ritorna i byte rimossi."""
+        if self.retention_days is None or not os.path.exists(self.path):
+            return 0
+        now = utc_to_wall(time.time()) if now is None else now
+        cutoff = now - now % self.seconds - self.retention_days * 86400
+        tmp_path = self.path + '.tmp'
+        with open(self.path, 'rb') as src:
+            size = os.fstat(src.fileno()).st_size
+            cut = _find_cut(src, size, format_ts(cutoff).encode('ascii'))
+            if cut == 0:
+                return 0
+            with open(tmp_path, 'wb') as dst:
+                src.seek(cut)
+                copy_range(src, dst)
+                dst.flush()
+                os.fsync(dst.fileno())
+        os.replace(tmp_path, self.path)
+        fsync_dir(os.path.dirname(os.path.abspath(self.path)))
+        return cut
+
+
+class TierSeries:
+    """Livelli di consolidamento di una serie, aggiornati insieme a ogni lettura."""
+
+    def __init__(self, directory, levels):
+        self.directory = directory
+        self.tiers = [Tier(os.path.join(directory, f'{name}.csv'), name, seconds, retention_days)
+                      for name, seconds, retention_days in levels]
+        self.resumed = False    # True dopo il recupero degli intervalli persi dalla serie al minuto
+        self._lock = threading.Lock()
+
+    def resume_from(self, epoch):
+        """
+        Epoch da cui rileggere la serie al minuto prima della lettura epoch: dopo
+        l'ultimo intervallo consolidato, o dall'inizio dell'intervallo di epoch.
+        """
+        starts = [tier.last_written + tier.seconds if tier.last_written is not None
+                  else epoch - epoch % tier.seconds for tier in self.tiers]
+        return min(starts) if starts else epoch
+
+    def add(self, epoch, value):
+        """Aggiorna tutti i livelli con una lettura, accodando le righe degli intervalli chiusi."""
+        with self._lock:
+            for tier in self.tiers:
+                line = tier.add(epoch, value)
+                if line is not None:
+                    tier.write([line])
+
+    def consolidate(self, rows):
+        """
+        Aggiorna i livelli con piu letture (epoch, value) ordinate, scrivendo a
+        blocchi. Ritorna {livello: righe accodate}.
+        """
+        written = {tier.name: 0 for tier in self.tiers}
+        with self._lock:
+            pending = [[] for _ in self.tiers]
+            for epoch, value in rows:
+                for tier, lines in zip(self.tiers, pending):
+                    line = tier.add(epoch, value)
+                    if line is not None:
+                        lines.append(line)
+                        written[tier.name] += 1
+                        if len(lines) >= _WRITE_BATCH:
+                            tier.write(lines)
+                            lines.clear()
+            for tier, lines in zip(self.tiers, pending):
+                tier.write(lines)
+        return written
+
+    def tier(self, name):
+        for tier in self.tiers:
+            if tier.name == name:
+                return tier
+        raise ValueError(f'Livello non configurato: {name}')
+
+    def choose(self, start, end, max_points, now=None):
+        """Il livello piu fine che copre start con al piu max_points intervalli (altrimenti il piu grossolano)."""
+        for tier in self.tiers:
+            if start is None and tier.retention_days is not None:
+                continue
+            if start is not None and not tier.covers(start, now):
+                continue
+            if start is not None and end is not None and (end - start) // tier.seconds > max_points:
+                continue
+            return tier
+        return self.tiers[-1]
+
+    def cleanup(self):
+        """Retention di tutti i livelli. Ritorna {livello: byte rimossi}."""
+        with self._lock:
+            return {tier.name: tier.cleanup() for tier in self.tiers}
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Conversioni dei timestamp delle letture.
+Il formato storico dei CSV e 'YYYY_MM_DD_HH:MM' in ora locale; i motori
+binari usano secondi epoch dell'ora locale (wall clock), cosi' la
+conversione da/verso il testo e senza perdite e non dipende dal fuso.
+
+Il testo e ambiguo nell'ora ripetuta al ritorno all'ora solare: i CSV
+possono portare una colonna opzionale con l'epoch UTC reale della lettura
+(vedi utc_after), che distingue le due occorrenze.
+Il parsing del formato storico e a campi fissi (slicing, parte data in
+cache) invece di strptime.
+"""
+
+import calendar
+import time
+from datetime import date, datetime, timedelta
+
+TS_FORMAT = '%Y_%m_%d_%H:%M'
+
+# Prima riga dei file con header (formato wide multi-canale)
+HEADER_PREFIX = b'timestamp,'
+
+_EPOCH = datetime(1970, 1, 1)
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# Cache 'YYYY_MM_DD' -> (anno, mese, giorno, epoch della mezzanotte), svuotata oltre
+# _DAY_CACHE_SIZE giorni: la parte data viene convertita e validata una volta per giorno
+_day_cache = {}
+_DAY_CACHE_SIZE = 2048
+
+
+def _day_fields(text):
+    """Campi della data di un timestamp (dalla cache), ValueError se il formato non e valido."""
+    if len(text) != 16 or text[4] != '_' or text[7] != '_' or text[10] != '_' or text[13] != ':' \
+            or not text[11:13].isdigit() or not text[14:16].isdigit():
+        raise ValueError(f'Timestamp non valido: {text!r}')
+    day = text[:10]
+    fields = _day_cache.get(day)
+    if fields is None:
+        if not (text[0:4] + text[5:7] + text[8:10]).isdigit():
+            raise ValueError(f'Timestamp non valido: {text!r}')
+        year, month, mday = int(text[0:4]), int(text[5:7]), int(text[8:10])
+        midnight = (date(year, month, mday).toordinal() - _EPOCH_ORDINAL) * 86400
+        if len(_day_cache) >= _DAY_CACHE_SIZE:
+            _day_cache.clear()
+        fields = _day_cache[day] = (year, month, mday, midnight)
+    return fields
+
+
+def parse_ts(text):
+    """
+    Converte 'YYYY_MM_DD_HH:MM' in secondi epoch wall clock (ValueError se invalido).
+    Parser a campi fissi (slicing) con la parte data in cache, senza strptime.
+    """
+    midnight = _day_fields(text)[3]
+    hour = int(text[11:13])
+    minute = int(text[14:16])
+    if hour > 23 or minute > 59:
+        raise ValueError(f'Timestamp non valido: {text!r}')
+    return midnight + hour * 3600 + minute * 60
+
+
+def parse_datetime(text):
+    """Come parse_ts ma ritorna il datetime naive in ora locale (sostituto di strptime)."""
+    year, month, mday, _ = _day_fields(text)
+    return datetime(year, month, mday, int(text[11:13]), int(text[14:16]))
+
+
+def wall_to_utc(wall_epoch, fold=0):
+    """
+    Epoch UTC reale dell'ora locale wall_epoch, secondo il fuso del sistema.
+    Nell'ora ripetuta fold=0 indica la prima occorrenza, fold=1 la seconda.
+    """
+    return int(epoch_to_datetime(wall_epoch).replace(fold=fold).timestamp())
+
+
+def utc_to_wall(utc_epoch):
+    """Epoch wall clock (ora locale) di un epoch UTC."""
+    return calendar.timegm(time.localtime(utc_epoch))
+
+
+def utc_after(wall_epoch, previous_utc=None):
+    """
+    Epoch UTC di una lettura wall_epoch scritta dopo quella con epoch UTC
+    previous_utc: se la prima occorrenza dell'ora locale non e successiva
+    (ora ripetuta al ritorno all'ora solare) si usa la seconda.
+    """
+    utc = wall_to_utc(wall_epoch)
+    if previous_utc is not None and utc <= previous_utc:
+        later = wall_to_utc(wall_epoch, fold=1)
+        if later > previous_utc:
+            utc = later
+    return utc
+
+
+def format_ts(epoch):
+    """Converte secondi epoch wall clock nel formato testo dei CSV."""
+    return epoch_to_datetime(epoch).strftime(TS_FORMAT)
+
+
+def epoch_to_datetime(epoch):
+    """Secondi epoch wall clock -> datetime naive in ora locale."""
+    return _EPOCH + timedelta(seconds=epoch)
+
+
+def datetime_to_epoch(dt):
+    """datetime naive in ora locale -> secondi epoch wall clock."""
+    return calendar.timegm(dt.timetuple())
+
+
+def line_epoch(line, day_epochs):
+    """
+    Epoch wall clock di una riga CSV in bytes b'YYYY_MM_DD_HH:MM,...' senza
+    strptime (None se non valida). day_epochs: cache giorno -> epoch della mezzanotte.
+    """
+    if len(line) < 18 or line[16:17] != b',' or line[4:5] != b'_' or line[10:11] != b'_':
+        return None
+    day = line[:10]
+    try:
+        base = day_epochs.get(day)
+        if base is None:
+            base = day_epochs[day] = calendar.timegm(
+                (int(day[0:4]), int(day[5:7]), int(day[8:10]), 0, 0, 0))
+        return base + int(line[11:13]) * 3600 + int(line[14:16]) * 60
+    except ValueError:
+        return None
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Percorso vettoriale opzionale (NumPy) per il grafico giornaliero: serie intera
+in array datetime64/float64, selezione delle letture del giorno, medie per
+barra con np.bincount, percentile con np.partition e livelli 0-8 come
+operazioni su array. Se NumPy non e installato available() e False e
+data_store usa il percorso Python puro.
+
+Le medie possono differire dal percorso Python nelle ultime cifre (np.bincount
+somma in sequenza, sum() dei float da Python 3.12 e compensata): il confronto
+di storage_tools chart-parity e con tolleranza sulle medie ed esatto sui livelli.
+"""
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def available():
+    """True se NumPy e importabile."""
+    return np is not None
+
+
+def to_ndarrays(times, values):
+    """
+    array('q') epoch wall clock + array('d') valori -> (datetime64[s], float64).
+    Copia i dati: gli array sorgente (es. della cache) possono crescere dopo.
+    """
+    return (np.array(times, dtype=np.int64).view('datetime64[s]'),
+            np.array(values, dtype=np.float64))
+
+
+def _epochs(times):
+    """Epoch interi da un array datetime64[s] (vista, senza copia) o da una sequenza di interi."""
+    times = np.asarray(times)
+    if times.dtype.kind == 'M':
+        return times.astype('datetime64[s]').view(np.int64)
+    return times.astype(np.int64, copy=False)
+
+
+def bar_averages(times, values, start, end, num_bars):
+    """
+    Media dei valori positivi per barra tra gli epoch start incluso ed end
+    escluso (NaN = barra vuota), come data_store._bar_averages_from_rows.
+    """
+    epochs = _epochs(times)
+    powers = np.asarray(values, dtype=np.float64)
+    mask = (powers > 0) & (epochs >= start) & (epochs < end)
+    elapsed = (epochs[mask] - start).astype(np.float64)
+    index = np.minimum((elapsed / float(end - start) * num_bars).astype(np.int64), num_bars - 1)
+    sums = np.bincount(index, weights=powers[mask], minlength=num_bars)
+    counts = np.bincount(index, minlength=num_bars)
+    averages = np.full(num_bars, np.nan)
+    np.divide(sums, counts, out=averages, where=counts > 0)
+    return averages
+
+
+def percentile_positive(values, pct):
+    """
+    Percentile pct dei soli valori positivi con la semantica di Series.percentile
+    (indice int(n * pct / 100) dei valori ordinati), per selezione senza ordinare.
+    None se non ci sono valori positivi.
+    """
+    powers = np.asarray(values, dtype=np.float64)
+    positive = powers[powers > 0]
+    n = len(positive)
+    if not n:
+        return None
+    index = min(int(n * pct / 100), n - 1)
+    return float(np.partition(positive, index)[index])
+
+
+def bar_levels(averages, historical_max):
+    """
+    Livelli 0-8 dalle medie per barra (NaN = 0): 8 sopra il 90% del massimo
+    storico, altrimenti il rapporto su 8 arrotondato come round() (np.rint
+    arrotonda anch'esso le meta al pari).
+    """
+    ratio = np.asarray(averages, dtype=np.float64) / historical_max
+    levels = np.where(ratio >= 0.9, 8.0, np.clip(np.rint(ratio * 8), 0, 8))
+    return np.nan_to_num(levels, nan=0.0).astype(np.int64).tolist()
+
+
+def to_list(averages):
+    """Medie come lista Python con None per le barre vuote."""
+    return [None if np.isnan(avg) else float(avg) for avg in averages]
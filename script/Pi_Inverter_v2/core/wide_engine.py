@@ -0,0 +1,475 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Formato wide multi-canale: un solo CSV con una riga per ciclo di polling e
+tutti i registri letti in quel ciclo.
+
+    timestamp,solar_w,grid_kw
+    2025_06_01_12:30,4210,-1.532
+    2025_06_01_21:00,,0.412          <- canale non letto: campo vuoto
+    2025_06_01_21:01,,0F             <- lettura fallita: codice di qualita in coda al campo
+
+L'header descrive le colonne; un canale nuovo viene aggiunto in coda
+riscrivendo solo l'header (le righe piu corte hanno i canali finali mancanti).
+Ogni serie logica (config.SOLAR_CSV, config.GRID_CSV) e una vista
+WideChannelEngine sul file condiviso: stessa interfaccia degli altri motori,
+legge solo la propria colonna e salta le righe in cui e vuota.
+"""
+
+import calendar
+import heapq
+import os
+import threading
+from array import array
+from datetime import datetime, timedelta
+from itertools import islice
+
+from . import rotation
+from .archive_segments import SegmentArchive, archive_dir
+from .csv_engine import prepare_cleanup, reverse_lines, rollback_archive
+from .day_index import DayIndex
+from .file_utils import copy_range, fsync_dir
+from .quality import OK, format_cell, line_flag, parse_cell, row_value
+from .recovery import repair_text_tail
+from .timestamps import HEADER_PREFIX, line_epoch, epoch_to_datetime
+
+# File wide aperti nel processo: path -> WideFile (condiviso dalle viste dei canali)
+_files = {}
+_files_lock = threading.Lock()
+
+
+def wide_file(path, channels, index_save_interval=600):
+    """WideFile condiviso per path (creato alla prima richiesta)."""
+    with _files_lock:
+        wide = _files.get(path)
+        if wide is None:
+            wide = _files[path] = WideFile(path, channels, index_save_interval)
+        return wide
+
+
+def format_row(timestamp, values):
+    """Riga wide 'timestamp,v1,v2,...' (None = campo vuoto), con terminatore."""
+    return timestamp + ''.join(',' if value is None else f',{value}' for value in values) + '\n'
+
+
+def _field(line, column):
+    """Valore float della colonna (indice dopo il timestamp), None se vuota, mancante o STALE/FAILED."""
+    return row_value(line, column)
+
+
+def _field_flag(line, column):
+    """Flag di qualita del campo della colonna (OK se vuoto o mancante)."""
+    fields = line[17:].rstrip(b'\r\n').split(b',')
+    if column >= len(fields) or not fields[column]:
+        return OK
+    return parse_cell(fields[column])[1]
+
+
+class WideFile:
+    """File wide: header dei canali, indice giorni e scritture di righe complete."""
+
+    def __init__(self, path, channels, index_save_interval=600):
+        self.path = path
+        self.default_channels = list(channels)
+        self.day_index = DayIndex(path, index_save_interval)
+        self._header = None      # (inode, canali) letti dall'header
+        self._lock = threading.RLock()
+        # Rotazione preparata dal cleanup, completata da chi scrive (vedi rotation)
+        self._rotation = rotation.load(path, self._rollback_archive)
+
+    def channels(self):
+        """Canali nell'ordine delle colonne (quelli di default se il file non esiste)."""
+        try:
+            inode = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return list(self.default_channels)
+        if self._header is None or self._header[0] != inode:
+            with open(self.path, 'rb') as f:
+                line = f.readline()
+            if line.startswith(HEADER_PREFIX) and line.endswith(b'\n'):
+                names = line.decode('utf-8').rstrip('\r\n').split(',')[1:]
+            else:
+                names = list(self.default_channels)
+            self._header = (inode, names)
+        return list(self._header[1])
+
+    def column(self, channel):
+        """Indice della colonna del canale dopo il timestamp, None se non presente."""
+        channels = self.channels()
+        return channels.index(channel) if channel in channels else None
+
+    def _ensure_channels(self, names):
+        """Crea il file con l'header o vi aggiunge i canali mancanti. Ritorna i canali."""
+        channels = self.channels()
+        missing = [name for name in names if name not in channels]
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            if missing:
+                self._rewrite_header(channels + missing)
+                channels = channels + missing
+            return channels
+        channels = channels + missing
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write(','.join(['timestamp'] + channels) + '\n')
+        self._header = None
+        return channels
+
+    def _rewrite_header(self, channels):
+        """Sostituisce l'header copiando le righe in un file temporaneo (os.replace dopo fsync)."""
+        tmp_path = self.path + '.tmp'
+        with open(self.path, 'rb') as src, open(tmp_path, 'wb') as dst:
+            header = src.readline()
+            if not header.startswith(HEADER_PREFIX):
+                src.seek(0)
+            dst.write((','.join(['timestamp'] + channels) + '\n').encode('utf-8'))
+            copy_range(src, dst)
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.replace(tmp_path, self.path)
+        fsync_dir(os.path.dirname(os.path.abspath(self.path)))
+        self._header = None
+        self.day_index.invalidate()
+        print(f'{self.path}: header aggiornato con i canali {", ".join(channels)}')
+
+    def append_rows(self, rows):
+        """
+        Aggiunge righe (timestamp, {canale: valore}) con una sola scrittura;
+        i canali assenti restano vuoti. Ritorna la nuova posizione di fine file.
+        """
+        with self._lock:
+            names = []
+            for _, values in rows:
+                names.extend(name for name in values if name not in names)
+            channels = self._ensure_channels(names)
+            lines = [format_row(timestamp, [values.get(name) for name in channels])
+                     for timestamp, values in rows]
+            with open(self.path, 'a', encoding='utf-8') as f:
+                start = f.tell()
+                f.write(''.join(lines))
+                end = f.tell()
+            for (timestamp, _), line in zip(rows, lines):
+                self.day_index.note_append(start, start + len(line), timestamp)
+                start += len(line)
+            return end
+
+    def iter_rows(self, channels, start=None, end=None, reverse=False):
+        """
+        Righe (epoch, [valore per canale o None]) con start <= epoch < end,
+        proiettate sui canali richiesti; saltate le righe senza nessuno dei canali.
+        Con reverse=True dalla piu recente, leggendo a blocchi dalla fine.
+        """
+        if not os.path.exists(self.path):
+            return
+        columns = [self.column(channel) for channel in channels]
+        if all(column is None for column in columns):
+            return
+        if reverse:
+            yield from self._iter_rows_reverse(columns, start, end)
+            return
+        offset = 0
+        if start is not None:
+            offset = self.day_index.offset_from(epoch_to_datetime(start).date())
+            if offset is None:
+                return
+        day_epochs = {}
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                epoch = line_epoch(line, day_epochs)
+                if epoch is None or (start is not None and epoch < start):
+                    continue
+                if end is not None and epoch >= end:
+                    break
+                values = [None if column is None else _field(line, column) for column in columns]
+                if any(value is not None for value in values):
+                    yield epoch, values
+
+    def _iter_rows_reverse(self, columns, start, end):
+        limit = os.path.getsize(self.path)
+        if end is not None:
+            next_day = self.day_index.offset_from(epoch_to_datetime(end - 1).date() + timedelta(days=1))
+            if next_day is not None:
+                limit = next_day
+        day_epochs = {}
+        with open(self.path, 'rb') as f:
+            for line in reverse_lines(f, limit):
+                epoch = line_epoch(line, day_epochs)
+                if epoch is None or (end is not None and epoch >= end):
+                    continue
+                if start is not None and epoch < start:
+                    break
+                values = [None if column is None else _field(line, column) for column in columns]
+                if any(value is not None for value in values):
+                    yield epoch, values
+
+    def repair_tail(self, last_good=None, max_tail=65536):
+        """Controllo di integrita della coda (righe di tutti i canali), vedi recovery."""
+        with self._lock:
+            result = repair_text_tail(self.path, last_good, max_tail)
+            if result is not None and result['repaired_from'] is not None:
+                self.day_index.truncate(result['repaired_from'])
+            return result
+
+    def cleanup(self, max_age_days):
+        """
+        Archivia le righe piu vecchie di max_age_days (tutti i canali), header
+        mantenuto, e prepara la rotazione senza prendere il lock delle scritture:
+        il file vivo e sostituito da complete_rotation alla scrittura successiva.
+        """
+        if not os.path.exists(self.path) or self._rotation is not None:
+            return None
+        stats, self._rotation = prepare_cleanup(self.path, datetime.now() - timedelta(days=max_age_days),
+                                                archive=SegmentArchive(archive_dir(self.path)))
+        return stats
+
+    def complete_rotation(self):
+        """Sostituisce il file vivo con il segmento preparato dal cleanup. Ritorna i byte ricopiati."""
+        with self._lock:
+            manifest, self._rotation = self._rotation, None
+            size = os.path.getsize(self.path)
+            copied = rotation.complete(self.path, manifest, self._rollback_archive)
+            self.day_index.rotate(manifest, size - os.path.getsize(self.path))
+            return copied
+
+    def _rollback_archive(self, manifest):
+        rollback_archive(self.path, manifest)
+
+
+class WideChannelEngine:
+    """Vista di un canale del file wide con l'interfaccia dei motori di storage."""
+
+    name = 'wide'
+
+    def __init__(self, wide, channel):
+        self.wide = wide
+        self.channel = channel
+        self.path = wide.path
+        self.day_index = wide.day_index
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def identity(self):
+        """Inode del file wide (None se non esiste)."""
+        try:
+            return os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return None
+
+    def size(self):
+        """Posizione di fine file (byte), condivisa dai canali."""
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+
+    def version(self):
+        """(inode, dimensione, mtime_ns) del file wide, None se assente."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def append(self, timestamp, value, flag=OK):
+        """Aggiunge una riga con il solo canale della vista."""
+        return self.wide.append_rows([(timestamp, {self.channel: format_cell(value, flag)})])
+
+    def append_many(self, rows):
+        return self.wide.append_rows([(row[0], {self.channel: format_cell(row[1], row[2] if len(row) > 2 else OK)})
+                                      for row in rows])
+
+    def _tail_epochs_values(self, n):
+        """Ultime n righe con il canale valorizzato, come (epoch, value) cronologiche."""
+        if n <= 0:
+            return []
+        rows = list(islice(self.iter_range(reverse=True), n))
+        rows.reverse()
+        return rows
+
+    def last_epoch(self):
+        rows = self._tail_epochs_values(1)
+        return rows[0][0] if rows else None
+
+    def values(self):
+        return [value for _, value in self.iter_range()]
+
+    def load_arrays(self):
+        """Caricamento bulk della colonna del canale in array (epoch wall clock, valori)."""
+        return self.arrays_since(0)[:2]
+
+    def arrays_since(self, offset):
+        """
+        Colonna del canale nelle righe complete dal byte offset in poi, come array
+        (epoch wall clock, valori), e posizione dopo l'ultima riga completa.
+        """
+        times = array('q')
+        values = array('d')
+        column = self.wide.column(self.channel)
+        if column is None or not self.exists():
+            return times, values, offset
+        day_epochs = {}
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                offset += len(line)
+                if line[16:17] != b',':
+                    continue
+                value = _field(line, column)
+                if value is None:
+                    continue
+                day = line[:10]
+                base = day_epochs.get(day)
+                try:
+                    if base is None:
+                        base = day_epochs[day] = calendar.timegm(
+                            (int(day[0:4]), int(day[5:7]), int(day[8:10]), 0, 0, 0))
+                    epoch = base + int(line[11:13]) * 3600 + int(line[14:16]) * 60
+                except ValueError:
+                    continue
+                times.append(epoch)
+                values.append(value)
+        return times, values, offset
+
+    def scan_values(self, start=0, stop=None):
+        """Valori del canale nelle righe complete comprese tra i byte start e stop."""
+        column = self.wide.column(self.channel)
+        if column is None or not self.exists():
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(start)
+            position = start
+            for line in f:
+                position += len(line)
+                if not line.endswith(b'\n') or (stop is not None and position > stop):
+                    break
+                if line[16:17] != b',':
+                    continue
+                value = _field(line, column)
+                if value is not None:
+                    yield value
+
+    def tail_values(self, n):
+        return [value for _, value in self._tail_epochs_values(n)]
+
+    def iter_range(self, start=None, end=None, reverse=False):
+        """Coppie (epoch, value) del canale con start <= epoch < end, in streaming."""
+        for epoch, values in self.wide.iter_rows([self.channel], start, end, reverse):
+            yield epoch, values[0]
+
+    def iter_flags(self, start=None, end=None):
+        """Coppie (epoch, flag) delle letture non OK del canale con start <= epoch < end."""
+        column = self.wide.column(self.channel)
+        if column is None or not self.exists():
+            return
+        offset = 0
+        if start is not None:
+            offset = self.day_index.offset_from(epoch_to_datetime(start).date())
+            if offset is None:
+                return
+        day_epochs = {}
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                epoch = line_epoch(line, day_epochs)
+                if epoch is None or (start is not None and epoch < start):
+                    continue
+                if end is not None and epoch >= end:
+                    break
+                flag = _field_flag(line, column)
+                if flag != OK:
+                    yield epoch, flag
+
+    def day_rows(self, target_date):
+        """Coppie (datetime, value) del giorno target_date, lette via indice giorni."""
+        column = self.wide.column(self.channel)
+        if column is None or not self.exists():
+            return []
+        data = []
+        day_epochs = {}
+        for line in self.day_index.read_day_lines(target_date):
+            row = line.encode('utf-8')
+            epoch = line_epoch(row, day_epochs)
+            value = _field(row, column) if epoch is not None else None
+            if value is not None:
+                data.append((epoch_to_datetime(epoch), value))
+        return data
+
+    def iter_archive(self, start=None, end=None, reverse=False):
+        """Coppie (epoch, value) archiviate del canale con start <= epoch < end."""
+        column = self.wide.column(self.channel)
+        if column is None:
+            return iter(())
+        end = rotation.archive_end(self.wide._rotation, end)
+        return SegmentArchive(archive_dir(self.path)).iter_rows(start, end, column, reverse)
+
+    def repair_tail(self, last_good=None, max_tail=65536):
+        return self.wide.repair_tail(last_good, max_tail)
+
+    def cleanup(self, max_age_days):
+        """Cleanup del file wide condiviso da tutti i canali (vedi data_store.cleanup_wide)."""
+        return self.wide.cleanup(max_age_days)
+
+    def rotation_pending(self):
+        return self.wide._rotation is not None
+
+    def rotation_manifest(self):
+        return self.wide._rotation
+
+    def complete_rotation(self):
+        return self.wide.complete_rotation()
+
+
+def merge_csv(sources, wide_path):
+    """
+    Unisce CSV storici per serie ({canale: path CSV}, ordinati per tempo) nel
+    file wide wide_path con un merge in streaming: una riga per timestamp.
+    Ritorna (righe scritte, righe non valide scartate). Rifiuta di
+    sovrascrivere un file wide esistente.
+    """
+    if os.path.exists(wide_path) and os.path.getsize(wide_path) > 0:
+        raise ValueError(f'{wide_path} esiste gia: rimuoverlo o rinominarlo prima della migrazione')
+    channels = list(sources)
+    skipped = [0]
+
+    def readings(index, path):
+        with open(path, 'rb') as f:
+            for line in f:
+                raw = line[17:].rstrip(b'\r\n').split(b',')[0]
+                try:
+                    if line[16:17] != b',' or not line.endswith(b'\n'):
+                        raise ValueError(line)
+                    float(raw)
+                except ValueError:
+                    skipped[0] += 1
+                    continue
+                yield line[:16].decode('ascii'), index, format_cell(raw.decode('ascii'), line_flag(line))
+
+    written = 0
+    tmp_path = wide_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(','.join(['timestamp'] + channels) + '\n')
+        row_ts = None
+        row = None
+        for timestamp, index, raw in heapq.merge(*(readings(i, sources[channel])
+                                                   for i, channel in enumerate(channels))):
+            if timestamp != row_ts:
+                if row is not None:
+                    f.write(format_row(row_ts, row))
+                    written += 1
+                row_ts = timestamp
+                row = [None] * len(channels)
+            row[index] = raw
+        if row is not None:
+            f.write(format_row(row_ts, row))
+            written += 1
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, wide_path)
+    fsync_dir(os.path.dirname(os.path.abspath(wide_path)))
+    return written, skipped[0]
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Write-behind delle letture: invece di aprire/scrivere/chiudere i file sulla SD
+a ogni poll, le letture restano in RAM (e in un journal su tmpfs) e vengono
+scritte nello storage persistente a blocchi ogni N minuti o all'arresto.
+
+Il journal (<dir>/<serie>.journal, righe 'YYYY_MM_DD_HH:MM,value[,codice qualita]') serve al
+replay dopo un crash del processo: viene svuotato solo dopo che il blocco e
+stato scritto nello storage, e al replay le righe gia presenti nello storage
+(timestamp <= ultimo persistito) vengono scartate, quindi il replay e idempotente.
+"""
+
+import os
+import threading
+import time
+
+from .quality import OK, CODES, text_flag
+
+# Stima del costo di un append diretto sulla SD: open + write + close,
+# e almeno una pagina sporcata (piu l'aggiornamento dell'inode) per scrittura
+SYSCALLS_PER_WRITE = 3
+PAGE_SIZE = 4096
+
+
+class WriteBehindBuffer:
+    """Letture in attesa per serie, con journal opzionale e contatori di I/O risparmiato."""
+
+    def __init__(self, flush_interval, journal_dir=None):
+        self.flush_interval = flush_interval
+        self.journal_dir = journal_dir
+        self._rows = {}          # filepath -> [(timestamp, value, flag)]
+        self._recovered = {}     # filepath -> righe ripristinate dal journal (da deduplicare)
+        self._journals = {}      # filepath -> file del journal aperto in append
+        self._last_flush = time.monotonic()
+        self._lock = threading.RLock()
+        self.counters = {'rows': 0, 'flushed_rows': 0, 'batches': 0, 'recovered_rows': 0,
+                         'journal_bytes': 0}
+
+    def _journal_path(self, filepath):
+        series = os.path.splitext(os.path.basename(filepath))[0]
+        return os.path.join(self.journal_dir, series + '.journal')
+
+    def _open(self, filepath):
+        """Al primo uso della serie: replay del journal rimasto da un crash, poi apertura."""
+        if filepath in self._rows:
+            return
+        self._rows[filepath] = []
+        if self.journal_dir is None:
+            return
+        os.makedirs(self.journal_dir, exist_ok=True)
+        path = self._journal_path(filepath)
+        try:
+            with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                for line in f:
+                    parts = line.strip().split(',')
+                    flag = text_flag(parts)
+                    if len(parts) != (2 if flag == OK else 3) or not line.endswith('\n'):
+                        continue   # riga troncata dal crash
+                    try:
+                        value = int(parts[1]) if parts[1].lstrip('-').isdigit() else float(parts[1])
+                    except ValueError:
+                        continue
+                    self._rows[filepath].append((parts[0], value, flag))
+        except FileNotFoundError:
+            pass
+        if self._rows[filepath]:
+            self._recovered[filepath] = len(self._rows[filepath])
+            self.counters['recovered_rows'] += len(self._rows[filepath])
+            print(f'Write-behind: {len(self._rows[filepath])} letture di {filepath} '
+                  f'ripristinate dal journal')
+        self._journals[filepath] = open(path, 'a', encoding='utf-8')
+
+    def add(self, filepath, timestamp, value, flag=OK):
+        """Accoda una lettura (e la scrive nel journal su tmpfs)."""
+        with self._lock:
+            self._open(filepath)
+            self._rows[filepath].append((timestamp, value, flag))
+            self.counters['rows'] += 1
+            journal = self._journals.get(filepath)
+            if journal is not None:
+                line = f'{timestamp},{value},{CODES[flag]}\n' if flag != OK else f'{timestamp},{value}\n'
+                journal.write(line)
+                journal.flush()
+                self.counters['journal_bytes'] += len(line)
+
+    def has_pending(self, filepath):
+        with self._lock:
+            self._open(filepath)
+            return bool(self._rows[filepath])
+
+    def due(self):
+        """True se e trascorso l'intervallo di flush."""
+        return time.monotonic() - self._last_flush >= self.flush_interval
+
+    def series(self):
+        with self._lock:
+            return list(self._rows)
+
+    def flush(self, filepath, write):
+        """
+        Scrive le letture in attesa della serie con write(rows, recovered), dove
+        recovered e il numero di righe iniziali ripristinate dal journal, poi
+        svuota il journal. Se write fallisce le letture restano in attesa.
+        Ritorna le righe scritte.
+        """
+        with self._lock:
+            self._open(filepath)
+            rows = self._rows[filepath]
+            if not rows:
+                return 0
+            write(rows, self._recovered.get(filepath, 0))
+            self._clear(filepath)
+            self.counters['flushed_rows'] += len(rows)
+            self.counters['batches'] += 1
+            return len(rows)
+
+    def flush_group(self, filepaths, write):
+        """
+        Come flush, per serie scritte insieme nello stesso file (backend wide):
+        write(pending) con pending = {filepath: (rows, recovered)} delle sole
+        serie con letture in attesa. Se write fallisce restano tutte in attesa.
+        Ritorna le righe scritte.
+        """
+        with self._lock:
+            pending = {}
+            for filepath in filepaths:
+                self._open(filepath)
+                if self._rows[filepath]:
+                    pending[filepath] = (self._rows[filepath], self._recovered.get(filepath, 0))
+            if not pending:
+                return 0
+            write(pending)
+            for filepath in pending:
+                self._clear(filepath)
+            flushed = sum(len(rows) for rows, _ in pending.values())
+            self.counters['flushed_rows'] += flushed
+            self.counters['batches'] += 1
+            return flushed
+
+    def _clear(self, filepath):
+        """Svuota le letture in attesa e il journal della serie dopo la scrittura."""
+        self._rows[filepath] = []
+        self._recovered.pop(filepath, None)
+        journal = self._journals.get(filepath)
+        if journal is not None:
+            journal.truncate(0)
+            journal.seek(0)
+
+    def mark_flushed(self):
+        self._last_flush = time.monotonic()
+
+    def stats(self):
+        """Contatori e stima di syscall e byte risparmiati sulla SD rispetto all'append diretto."""
+        with self._lock:
+            stats = dict(self.counters)
+            stats['pending'] = sum(len(rows) for rows in self._rows.values())
+        saved_writes = max(0, stats['flushed_rows'] - stats['batches'])
+        stats['syscalls_saved'] = saved_writes * SYSCALLS_PER_WRITE
+        stats['sd_bytes_saved'] = saved_writes * PAGE_SIZE
+        return stats
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Storico della produzione giornaliera (registro 32114): una riga per data
+'YYYY-MM-DD,energy_kwh,read_at,source' con il valore finale del giorno.
+Il file e piccolo (una riga al giorno) e viene riscritto atomicamente
+(file temporaneo + fsync + rename) a ogni aggiornamento; in memoria resta
+una copia con date ordinate per ricerche puntuali e per intervallo.
+Stdlib pura: usato anche dagli script stand_alone_.
+"""
+
+import bisect
+import json
+import os
+import threading
+from collections import namedtuple
+from datetime import datetime
+
+YieldRecord = namedtuple('YieldRecord', 'date energy_kwh read_at source')
+
+_READ_AT_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class YieldHistory:
+    """Storico daily yield su CSV con copia in memoria ricaricata solo se il file cambia."""
+
+    def __init__(self, path, seed_json=None):
+        self.path = path
+        self.seed_json = seed_json
+        self._records = {}
+        self._dates = []
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _sync(self):
+        """(Ri)carica il file se e cambiato (inode, dimensione, mtime)."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            if self._version is None and self.seed_json:
+                self._seed()
+            return
+        version = (st.st_ino, st.st_size, st.st_mtime_ns)
+        if version == self._version:
+            return
+        records = {}
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                parts = line.rstrip('\n').split(',')
+                if len(parts) != 4:
+                    continue
+                try:
+                    day = datetime.strptime(parts[0], '%Y-%m-%d').date()
+                    records[day] = YieldRecord(day, float(parts[1]), parts[2], parts[3])
+                except ValueError:
+                    continue
+        self._records = records
+        self._dates = sorted(records)
+        self._version = version
+
+    def _seed(self):
+        """Primo avvio: importa l'ultimo valore di last_daily_energy.json, se presente."""
+        self._version = ()
+        try:
+            with open(self.seed_json, 'r') as f:
+                data = json.load(f)
+            day = datetime.strptime(data['date'], '%Y-%m-%d').date()
+            record = YieldRecord(day, float(data['energy_kwh']), data.get('timestamp', ''), 'json')
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            print(f'Impossibile importare {self.seed_json} nello storico daily yield: {e}')
+            return
+        self._records = {day: record}
+        self._dates = [day]
+        self._write()
+
+    def _write(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for day in self._dates:
+                record = self._records[day]
+                f.write(f'{day.isoformat()},{record.energy_kwh},{record.read_at},{record.source}\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        st = os.stat(self.path)
+        self._version = (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def record(self, day, energy_kwh, source='modbus', read_at=None):
+        """Salva (o sostituisce) il valore del giorno e riscrive il file atomicamente."""
+        if read_at is None:
+            read_at = datetime.now().strftime(_READ_AT_FORMAT)
+        with self._lock:
+            self._sync()
+            if day not in self._records:
+                bisect.insort(self._dates, day)
+            self._records[day] = YieldRecord(day, float(energy_kwh), read_at, source)
+            self._write()
+            return self._records[day]
+
+    def get(self, day):
+        """YieldRecord del giorno, None se non registrato."""
+        with self._lock:
+            self._sync()
+            return self._records.get(day)
+
+    def between(self, start, end):
+        """YieldRecord con start <= data <= end, in ordine cronologico."""
+        with self._lock:
+            self._sync()
+            first = bisect.bisect_left(self._dates, start)
+            last = bisect.bisect_right(self._dates, end)
+            return [self._records[day] for day in self._dates[first:last]]
+
+    def last(self):
+        """YieldRecord piu recente, None se lo storico e vuoto."""
+        with self._lock:
+            self._sync()
+            return self._records[self._dates[-1]] if self._dates else None
@@ -161,30 +161,28 @@ class LEDController:
             pixels.extend(row)
         self.sense.set_pixels(pixels)
 
-    def calculate_level(self, current_power, historical_values):
+    def calculate_level(self, current_power, sketch):
         """
         Converte il valore corrente in un livello 0-8 per la barra,
         usando il 98esimo percentile positivo (o 2 negativo) come riferimento.
+        sketch: SeriesSketch della serie storica (data_store.get_series_sketch).
         """
-        if not historical_values:
+        if sketch.count == 0:
             return 8 if current_power > 0 else 0
 
-        positive_values = [x for x in historical_values if x >= 0]
-        negative_values = [x for x in historical_values if x < 0]
-
         if current_power >= 0:
-            if not positive_values:
+            if sketch.positive.n + sketch.zeros == 0:
                 return 0
-            max_power = self._percentile(positive_values, 98)
+            max_power = sketch.percentile_non_negative(98)
             if max_power == 0:
                 return 0
             level = round(current_power / max_power * 8)
             if level < 1 and current_power > 0:
                 level = 1
         else:
-            if not negative_values:
+            if sketch.negative.n == 0:
                 return 0
-            min_power = self._percentile(negative_values, 2)
+            min_power = sketch.percentile_negative(2)
             if min_power == 0:
                 return 0
             level = round(abs(current_power) / abs(min_power) * 8)
@@ -193,15 +191,15 @@ class LEDController:
 
         return min(level, 8)
 
-    def choose_color(self, current_power, historical_values):
+    def choose_color(self, current_power, sketch):
         """
         Sceglie il colore per la barra solare in base al rapporto corrente/max
         storico. Gradient rosso→giallo→verde.
         """
-        if not historical_values:
+        if sketch.count == 0:
             return config.GREEN if current_power > 0 else config.RED
 
-        max_power = max(historical_values)
+        max_power = sketch.max
         if max_power <= 0:
             return config.RED
 
@@ -215,9 +213,3 @@ class LEDController:
             g = 255
 
         return (r, g, 0)
-
-    def _percentile(self, values, pct):
-        """Percentile pct (0-100) di una lista di valori."""
-        sorted_vals = sorted(values)
-        idx = int(len(sorted_vals) * pct / 100)
-        return sorted_vals[min(idx, len(sorted_vals) - 1)]
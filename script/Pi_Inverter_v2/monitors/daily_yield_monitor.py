@@ -3,6 +3,7 @@
 """
 Monitor produzione giornaliera — registro Modbus 32114 (u32, gain 100).
 Restituisce il valore in kWh. Aggiorna solo una volta per ora (guard).
+Il valore finale di ogni giorno resta nello storico daily yield (data_store).
 Zero display, zero CSV diretto.
 """
 
@@ -35,7 +36,8 @@ def read(client):
 def update_if_needed(client):
     """
     Aggiorna il daily yield solo se nelle ore giuste e non gia aggiornato
-    in questa ora. Persiste il valore su JSON.
+    in questa ora. Persiste il valore nello storico giornaliero e su JSON
+    (last_daily_energy.json, letto anche da Pi_Inverter).
 
     Args:
         client: ModbusTcpClient attivo
@@ -54,7 +56,8 @@ def update_if_needed(client):
         return False
 
     value = read(client)
-    if value is not None and data_store.save_daily_energy(config.DAILY_ENERGY_JSON, value):
+    if value is not None and data_store.record_daily_yield(value):
+        data_store.save_daily_energy(config.DAILY_ENERGY_JSON, value)
         _last_updated_hour = current_hour
         print(f"Daily yield aggiornato alle {current_hour}:00: {value} kWh")
         return True
@@ -64,10 +67,10 @@ def update_if_needed(client):
 
 def get_last_daily_yield():
     """
-    Legge l'ultimo daily yield salvato sul JSON.
+    Ultimo daily yield registrato (dalla copia in memoria dello storico).
 
     Returns:
-        Valore in kWh (float), 0.0 se il file non esiste o e vuoto.
+        Valore in kWh (float), 0.0 se lo storico e vuoto.
     """
-    value = data_store.read_daily_energy(config.DAILY_ENERGY_JSON)
-    return value if value is not None else 0.0
+    record = data_store.last_daily_yield()
+    return record.energy_kwh if record is not None else 0.0
@@ -2,7 +2,7 @@
 # -*- coding: utf-8 -*-
 """
 Monitor potenza rete — registro Modbus 37113 (i32, gain 1000).
-Restituisce la potenza in kW (positivo=consumo, negativo=export).
+Restituisce la potenza in kW (positivo=consumo, negativo=export), None se la lettura fallisce.
 Zero display, zero CSV.
 """
 
@@ -18,9 +18,10 @@ def read(client):
         client: ModbusTcpClient attivo
 
     Returns:
-        Potenza rete in kW (float), 0.0 se la lettura fallisce.
+        Potenza rete in kW (float), None se la lettura fallisce
+        (l'orchestrator la salva con flag di qualita FAILED/STALE).
     """
     registers = read_register(client, config.GRID_REGISTER, config.REGISTER_COUNT)
     if registers is not None:
         return decode_int32(registers, signed=True) / 1000.0
-    return 0.0
+    return None
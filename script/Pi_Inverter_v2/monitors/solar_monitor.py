@@ -2,7 +2,7 @@
 # -*- coding: utf-8 -*-
 """
 Monitor potenza solare — registro Modbus 32080 (i32, gain 1000).
-Restituisce la potenza in watt. Zero display, zero CSV.
+Restituisce la potenza in watt (None se la lettura fallisce). Zero display, zero CSV.
 """
 
 from ..core.modbus_client import read_register, decode_int32
@@ -17,9 +17,10 @@ def read(client):
         client: ModbusTcpClient attivo
 
     Returns:
-        Potenza solare in watt (int), 0 se la lettura fallisce.
+        Potenza solare in watt (int), None se la lettura fallisce
+        (l'orchestrator la salva con flag di qualita FAILED/STALE).
     """
     registers = read_register(client, config.SOLAR_REGISTER, config.REGISTER_COUNT)
     if registers is not None:
         return decode_int32(registers, signed=True)
-    return 0
+    return None
@@ -7,11 +7,11 @@ Il logging della rete avviene 24/7 (fix del buco dati notturno).
 """
 
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from . import config
 from .core.modbus_client import ModbusSession
-from .core import data_store
+from .core import data_store, quality
 from .monitors import solar_monitor, grid_monitor, daily_yield_monitor
 from .display.led_controller import LEDController
 
@@ -20,6 +20,7 @@ class Orchestrator:
     def __init__(self):
         self.led = LEDController()
         self.last_daily_yield = daily_yield_monitor.get_last_daily_yield()
+        self.last_good = {}    # filepath -> (time.monotonic(), ultimo valore letto correttamente)
         print(f"Orchestrator inizializzato. Daily yield: {self.last_daily_yield} kWh")
 
     def run(self):
@@ -47,9 +48,9 @@ class Orchestrator:
         # Imposta luminosita LED
         self.led.set_low_light(not is_daytime)
 
-        # --- Letture Modbus con sessione condivisa ---
-        solar_power = 0
-        grid_power = 0.0
+        # --- Letture Modbus con sessione condivisa (None = lettura fallita) ---
+        solar_power = None
+        grid_power = None
 
         try:
             with ModbusSession() as client:
@@ -70,11 +71,18 @@ class Orchestrator:
         except Exception as e:
             print(f"Errore lettura Modbus: {e}")
 
-        # --- Logging CSV (rete SEMPRE, solare solo di giorno) ---
-        data_store.append_reading(config.GRID_CSV, timestamp, round(grid_power, 3))
+        # --- Qualita: una lettura fallita non e uno zero reale ---
+        grid_power, grid_flag = self._with_quality(config.GRID_CSV, grid_power, 0.0)
+        solar_power, solar_flag = self._with_quality(config.SOLAR_CSV, solar_power, 0) \
+            if is_daytime else (0, quality.OK)
 
+        # --- Logging CSV (rete SEMPRE, solare solo di giorno) ---
+        readings = {config.GRID_CSV: round(grid_power, 3)}
+        flags = {config.GRID_CSV: grid_flag}
         if is_daytime:
-            data_store.append_reading(config.SOLAR_CSV, timestamp, solar_power)
+            readings[config.SOLAR_CSV] = solar_power
+            flags[config.SOLAR_CSV] = solar_flag
+        data_store.append_cycle(timestamp, readings, flags)
 
         # --- Aggiorna il valore corrente della rete nel LED controller ---
         self.led.current_grid_power = grid_power
@@ -85,11 +93,26 @@ class Orchestrator:
         else:
             self._display_nighttime(grid_power)
 
+    def _with_quality(self, filepath, value, fallback):
+        """
+        (valore, flag di qualita) della lettura: OK se riuscita; se fallita
+        l'ultimo valore buono entro QUALITY_HOLD_SECONDS (STALE), altrimenti
+        fallback (FAILED). Entrambe salvate ma escluse da medie e scale.
+        """
+        now = time.monotonic()
+        if value is not None:
+            self.last_good[filepath] = (now, value)
+            return value, quality.OK
+        held = self.last_good.get(filepath)
+        if held is not None and now - held[0] <= config.QUALITY_HOLD_SECONDS:
+            return held[1], quality.STALE
+        return fallback, quality.FAILED
+
     def _display_daytime(self, solar_power, grid_power):
         """Sequenza display diurna: testo + doppia barra animata."""
-        # Leggi TUTTI i valori storici per il calcolo corretto del 98° percentile
-        solar_historical = data_store.read_all_values(config.SOLAR_CSV)
-        grid_historical = data_store.read_all_values(config.GRID_CSV)
+        # Scala storica (98° percentile, max) dagli sketch, senza rileggere i CSV
+        solar_historical = data_store.get_series_sketch(config.SOLAR_CSV)
+        grid_historical = data_store.get_series_sketch(config.GRID_CSV)
 
         solar_level = self.led.calculate_level(solar_power, solar_historical)
         grid_level = self.led.calculate_level(grid_power, grid_historical)
@@ -108,15 +131,21 @@ class Orchestrator:
 
     def _display_nighttime(self, grid_power):
         """Sequenza display notturna: daily yield + barra rete + grafico giornaliero."""
-        # 1. Testo daily yield
+        # 1. Testo daily yield del giorno mostrato dal grafico (prima della
+        #    lettura serale: l'ultimo registrato)
+        now = datetime.now()
+        chart_date = now.date() if now.hour >= config.DAY_START_HOUR else (now - timedelta(days=1)).date()
+        daily_yield = data_store.get_daily_yield(chart_date)
+        if daily_yield is None:
+            daily_yield = self.last_daily_yield
         self.led.clear()
-        text = f"Daily power: {self.last_daily_yield:.2f} kWh"
+        text = f"Daily power: {daily_yield:.2f} kWh"
         self.led.show_message(text, color=config.WHITE, scroll_speed=0.06)
         self.led.show_message(text, color=config.WHITE, scroll_speed=0.06)
         time.sleep(1)
 
         # 2. Barra consumo rete
-        grid_historical = data_store.read_all_values(config.GRID_CSV)
+        grid_historical = data_store.get_series_sketch(config.GRID_CSV)
         grid_level = self.led.calculate_level(grid_power, grid_historical)
 
         self.led.show_message(
@@ -22,7 +22,7 @@ from datetime import datetime, timedelta
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
 from Pi_Inverter_v2 import config
-from Pi_Inverter_v2.core.sense_hat_provider import get_sense_hat
+from Pi_Inverter_v2.core.sense_hat_provider import get_sense_hat, add_exit_hook
 from Pi_Inverter_v2.core import data_store
 from Pi_Inverter_v2.orchestrator import Orchestrator
 from Pi_Inverter_v2.service_manager import ServiceManager
@@ -32,6 +32,7 @@ from Pi_Inverter_v2.network_watchdog import NetworkWatchdog
 def daily_cleanup():
     """
     Thread di pulizia CSV giornaliera a mezzanotte.
+    Prima materializza i rollup del giorno appena concluso, poi pulisce i CSV.
     NESSUN uso di SenseHat — solo print per logging.
     """
     while True:
@@ -40,15 +41,64 @@ def daily_cleanup():
         sleep_time = (next_cleanup - now).total_seconds()
         time.sleep(sleep_time)
 
-        # Pulisci entrambi i file CSV
-        data_store.cleanup_csv(config.SOLAR_CSV)
-        data_store.cleanup_csv(config.GRID_CSV)
+        # Rollup 15 minuti / giornata del giorno appena finito
+        yesterday = (datetime.now() - timedelta(days=1)).date()
+        data_store.build_day_rollup(config.SOLAR_CSV, yesterday)
+        data_store.build_day_rollup(config.GRID_CSV, yesterday)
+
+        # Disservizi del giorno: letture fallite, escluse dagli aggregati
+        for filepath in (config.SOLAR_CSV, config.GRID_CSV):
+            windows = data_store.outage_windows(filepath, yesterday, yesterday + timedelta(days=1))
+            if windows:
+                print(f"Disservizi {os.path.basename(filepath)} {yesterday}: {len(windows)} finestre, "
+                      f"{sum(window['readings'] for window in windows)} letture non valide")
+
+        # Pulisci le serie: solo i byte gia scritti, il polling continua ad accodare
+        # e sostituisce il file alla scrittura successiva (vedi core/rotation).
+        # Col backend wide le serie sono canali dello stesso file: un solo cleanup
+        if config.STORAGE_BACKEND == 'wide':
+            data_store.cleanup_wide()
+        else:
+            data_store.cleanup_csv(config.SOLAR_CSV)
+            data_store.cleanup_csv(config.GRID_CSV)
+
+        # Nuovo offset buono: dopo un crash si controllera solo la coda successiva
+        data_store.record_good_offsets()
+
+        stats = data_store.write_behind_stats()
+        if stats is not None:
+            print(f"Write-behind: {stats['flushed_rows']} letture in {stats['batches']} blocchi, "
+                  f"~{stats['syscalls_saved']} syscall e ~{stats['sd_bytes_saved'] // 1024} KiB "
+                  f"di scritture SD risparmiati")
+
+        stats = data_store.cache_stats()
+        if stats is not None:
+            print(f"Cache serie: {stats['hits']} hit, {stats['misses']} miss, "
+                  f"{stats['loads']} caricamenti, {stats['bytes'] / 1048576:.1f} MB residenti")
+
+        for filepath, stats in data_store.tail_follower_stats().items():
+            print(f"Lettura incrementale {os.path.basename(filepath)}: {stats['records']} letture, "
+                  f"{stats['parsed_rows']} righe lette, {stats['resets']} riletture da capo")
+
+        stats = data_store.dedup_stats()
+        if stats['duplicates']:
+            print(f"Letture duplicate scartate (riavvii nello stesso minuto): {stats['duplicates']}")
+
+        stats = data_store.chart_memo_stats()
+        print(f"Grafico giornaliero: {stats['hits']} risultati riusati, {stats['misses']} calcolati")
 
 
 def main():
     """Funzione principale: inizializza componenti e avvia il loop."""
     sense = get_sense_hat()
 
+    # Coda dei file delle serie riparata dopo un arresto non pulito (reboot, corrente)
+    data_store.check_integrity([config.SOLAR_CSV, config.GRID_CSV])
+
+    # Letture in attesa (write-behind, batch SQLite) scritte su disco anche con SIGTERM,
+    # poi offset buoni registrati per il controllo di integrita al prossimo avvio
+    add_exit_hook(data_store.shutdown_series)
+
     # --- Service file systemd ---
     if os.geteuid() == 0:
         service_manager = ServiceManager()
@@ -0,0 +1,480 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Strumenti offline per lo storage delle serie (da eseguire a servizio fermo).
+
+Uso:
+    python3 Pi_Inverter_v2/storage_tools.py csv-to-bin logs/power_log.csv
+    python3 Pi_Inverter_v2/storage_tools.py bin-to-csv logs/power_log.bin power_log.csv
+    python3 Pi_Inverter_v2/storage_tools.py csv-to-partitions logs/power_log.csv
+    python3 Pi_Inverter_v2/storage_tools.py csv-to-sqlite logs/power_log.csv
+    python3 Pi_Inverter_v2/storage_tools.py csv-to-wide
+    python3 Pi_Inverter_v2/storage_tools.py epoch-column logs/power_log.csv [--drop]
+    python3 Pi_Inverter_v2/storage_tools.py dedup logs/power_log.csv [--window 10080]
+    python3 Pi_Inverter_v2/storage_tools.py archive-to-segments logs/power_log.csv
+    python3 Pi_Inverter_v2/storage_tools.py bench logs/power_log.csv
+    python3 Pi_Inverter_v2/storage_tools.py bench-memory [--src logs/power_log.csv] [--days 730]
+    python3 Pi_Inverter_v2/storage_tools.py query logs/power_log.csv --start 2024-01-01 --bucket 1d --agg mean max p98
+    python3 Pi_Inverter_v2/storage_tools.py rebuild logs/power_log.csv [--workers 4] [--compare]
+    python3 Pi_Inverter_v2/storage_tools.py tiers logs/power_log.csv
+    python3 Pi_Inverter_v2/storage_tools.py quality logs/power_log.csv [--start 2024-01-01] [--end 2024-02-01]
+    python3 Pi_Inverter_v2/storage_tools.py report logs/power_log.csv --year 2024 [--compare]
+    python3 Pi_Inverter_v2/storage_tools.py history logs/power_log.csv --start 2024-03-01 [--end 2024-03-31]
+    python3 Pi_Inverter_v2/storage_tools.py chart-parity logs/power_log.csv [--days 30]
+"""
+
+import argparse
+import csv
+import math
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# Aggiungi la directory padre al path per gli import relativi del package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Pi_Inverter_v2 import config
+from Pi_Inverter_v2.core import data_store
+from Pi_Inverter_v2.core import archive_segments, binary_engine, partitioned_engine, sqlite_engine, wide_engine
+from Pi_Inverter_v2.core.csv_engine import CsvEngine, convert_epoch_column, dedup_csv
+from Pi_Inverter_v2.core.file_utils import copy_range
+from Pi_Inverter_v2.core.series import Series
+from Pi_Inverter_v2.core.timestamps import format_ts, epoch_to_datetime, parse_datetime
+
+
+def cmd_csv_to_bin(args):
+    """Converte un CSV storico nel formato binario (config.STORAGE_BACKEND = 'binary')."""
+    dst = args.dst or binary_engine.binary_path(args.src)
+    imported, skipped = binary_engine.import_csv(args.src, dst, args.value_format)
+    print(f'{imported} record importati in {dst} ({skipped} righe non valide scartate)')
+
+
+def cmd_bin_to_csv(args):
+    """Esporta un file binario nel formato CSV storico."""
+    written = binary_engine.export_csv(args.src, args.dst)
+    print(f'{written} record esportati in {args.dst}')
+
+
+def cmd_csv_to_partitions(args):
+    """Divide un CSV storico in partizioni mensili (e comprime il suo _archive.csv)."""
+    target_dir = partitioned_engine.partition_dir(args.src)
+    counts = partitioned_engine.migrate_csv(args.src, target_dir)
+    print(f'{sum(counts.values())} righe in {len(counts)} partizioni sotto {target_dir}')
+    _archive_to_segments(args.src)
+
+
+def cmd_archive_to_segments(args):
+    """Comprime il vecchio <nome>_archive.csv nei segmenti mensili dell'archivio."""
+    _archive_to_segments(args.src)
+
+
+def _archive_to_segments(src):
+    archive_src = src.replace('.csv', '_archive.csv')
+    if not os.path.exists(archive_src):
+        return
+    archive = archive_segments.SegmentArchive(archive_segments.archive_dir(src))
+    with open(archive_src, 'rb') as f:
+        archived, skipped = archive.append_lines(f)
+    stats = archive.stats()
+    print(f'{archived} righe di {archive_src} archiviate in {archive.directory} '
+          f'({skipped} non valide scartate): {stats["raw_bytes"]} -> {stats["compressed_bytes"]} byte. '
+          f'Il file originale puo essere rimosso.')
+
+
+def cmd_csv_to_sqlite(args):
+    """Importa un CSV storico nel database SQLite (config.STORAGE_BACKEND = 'sqlite')."""
+    imported, skipped = sqlite_engine.import_csv(args.src, args.src, args.db)
+    print(f'{imported} righe importate nella serie {sqlite_engine.series_name(args.src)} '
+          f'di {args.db} ({skipped} righe non valide scartate)')
+
+
+def cmd_csv_to_wide(args):
+    """Unisce i CSV delle serie di config.WIDE_CHANNELS nel file wide (STORAGE_BACKEND = 'wide')."""
+    sources = {channel: filepath for filepath, channel in config.WIDE_CHANNELS.items()
+               if os.path.exists(filepath)}
+    if not sources:
+        print('Nessun CSV da unire')
+        return
+    written, skipped = wide_engine.merge_csv(sources, args.dst)
+    print(f'{written} righe ({", ".join(sources)}) scritte in {args.dst} '
+          f'({skipped} righe non valide scartate). I CSV originali e i loro archivi restano invariati.')
+
+
+def cmd_epoch_column(args):
+    """Aggiunge (o rimuove con --drop) la colonna epoch UTC a un CSV storico (CSV_EPOCH_COLUMN)."""
+    converted = convert_epoch_column(args.src, add=not args.drop)
+    print(f"{converted} righe di {args.src} {'senza' if args.drop else 'con'} colonna epoch UTC. "
+          f"Indice giorni e sketch verranno ricostruiti al prossimo accesso.")
+
+
+def cmd_dedup(args):
+    """Rimuove le letture duplicate per minuto (riavvii nello stesso minuto) con una passata in streaming."""
+    if os.path.isdir(args.src):
+        paths = sorted(os.path.join(args.src, name) for name in os.listdir(args.src) if name.endswith('.csv'))
+    else:
+        paths = [args.src]
+    for path in paths:
+        if path.endswith('.bin'):
+            kept, removed = binary_engine.dedup_records(path, args.window)
+        else:
+            kept, removed = dedup_csv(path, args.window)
+        print(f'{path}: {removed} duplicati rimossi, {kept} letture tenute')
+    print('Per ricalcolare sketch e rollup sulle letture rimaste: storage_tools.py rebuild <file.csv>')
+
+
+def _io_write_bytes():
+    """Byte scritti verso lo storage dal processo (/proc/self/io), None se non disponibile."""
+    try:
+        with open('/proc/self/io', 'r') as f:
+            for line in f:
+                if line.startswith('write_bytes:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _bench_engine(name, src, workdir, days, appends):
+    """Prepara una copia della serie per il motore e misura letture e volume scritto."""
+    filepath = os.path.join(workdir, os.path.basename(src))
+    if name == 'csv':
+        with open(src, 'rb') as f_src, open(filepath, 'wb') as f_dst:
+            copy_range(f_src, f_dst)
+        engine = CsvEngine(filepath)
+    else:
+        db_path = os.path.join(workdir, 'series.db')
+        sqlite_engine.import_csv(src, filepath, db_path)
+        engine = sqlite_engine.SqliteEngine(filepath, db_path, config.SQLITE_BATCH_SIZE,
+                                            config.SQLITE_FLUSH_INTERVAL)
+    os.sync()
+
+    result = {}
+    started = time.perf_counter()
+    times, _ = engine.load_arrays()
+    result['load_arrays'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    engine.tail_values(500)
+    result['tail_500'] = time.perf_counter() - started
+
+    last_day = epoch_to_datetime(times[-1]).date() if times else None
+    started = time.perf_counter()
+    for offset in range(days if last_day else 0):
+        engine.day_rows(last_day - timedelta(days=offset))
+    result['day_rows'] = (time.perf_counter() - started) / max(1, days)
+
+    # Un append al minuto: os.sync() dopo ogni lettura emula il writeback tra due poll
+    next_epoch = (times[-1] if times else 0) + config.POLL_INTERVAL
+    before = _io_write_bytes()
+    for i in range(appends):
+        engine.append(format_ts(next_epoch + i * config.POLL_INTERVAL), 1000 + i % 500)
+        os.sync()
+    if hasattr(engine, 'flush'):
+        engine.flush()
+        os.sync()
+    after = _io_write_bytes()
+    result['write_bytes'] = after - before if before is not None and after is not None else None
+    return result
+
+
+def cmd_bench(args):
+    """Confronto A/B tra motore CSV e SQLite sulla stessa serie e sullo stesso disco."""
+    workdir_base = os.path.dirname(os.path.abspath(args.src))
+    for name in ('csv', 'sqlite'):
+        workdir = tempfile.mkdtemp(prefix='bench_', dir=workdir_base)
+        try:
+            result = _bench_engine(name, args.src, workdir, args.days, args.appends)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        written = (f"{result['write_bytes'] / 1024:.0f} KiB" if result['write_bytes'] is not None
+                   else 'n/d')
+        print(f"{name:>6}: load_arrays {result['load_arrays'] * 1000:.1f} ms, "
+              f"tail 500 {result['tail_500'] * 1000:.2f} ms, "
+              f"giorno {result['day_rows'] * 1000:.2f} ms, "
+              f"{args.appends} append -> {written} scritti")
+
+
+def _synthetic_csv(path, days):
+    """CSV sintetico di days giorni al minuto: produzione di giorno, prelievo (negativo) di notte."""
+    rng = random.Random(days)
+    start = (datetime.now() - timedelta(days=days)).replace(hour=0, minute=0, second=0, microsecond=0)
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        for minute in range(days * 1440):
+            ts = start + timedelta(minutes=minute)
+            hour = ts.hour + ts.minute / 60
+            if 6 <= hour < 20:
+                value = max(0, int(6000 * math.sin(math.pi * (hour - 6) / 14) + rng.gauss(0, 300)))
+            else:
+                value = round(-rng.uniform(0.1, 1.5), 3)
+            writer.writerow([ts.strftime('%Y_%m_%d_%H:%M'), value])
+
+
+def _load_tuples(path):
+    """Percorso storico: tuple (datetime, float), lista dei valori, filtri per segno, percentile."""
+    data = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for row in csv.reader(f):
+            try:
+                data.append((parse_datetime(row[0]), float(row[1])))
+            except (ValueError, IndexError):
+                continue
+    values = [p for _, p in data]
+    positive_values = [x for x in values if x >= 0]
+    negative_values = [x for x in values if x < 0]
+    ordered = sorted(positive_values)
+    return len(data), ordered[min(int(len(ordered) * 0.98), len(ordered) - 1)], len(negative_values)
+
+
+def _load_series(path):
+    """Percorso compatto: Series su array, viste per segno, percentile per selezione."""
+    series = Series(*CsvEngine(path).load_arrays())
+    return len(series), series.non_negative().percentile(98), len(series.negative())
+
+
+def _measure_child(job, path, conn):
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    result = job(path)
+    elapsed = time.perf_counter() - started
+    # ru_maxrss in KiB su Linux: picco del processo oltre lo stato al fork
+    conn.send((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline, elapsed, result))
+    conn.close()
+
+
+def _measure(job, path):
+    """Picco di RSS (KiB) e tempo di job(path) in un processo figlio dedicato."""
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=_measure_child, args=(job, path, sender))
+    process.start()
+    result = receiver.recv()
+    process.join()
+    return result
+
+
+def cmd_bench_memory(args):
+    """Picco di RSS della serie storica come tuple/liste e come Series su array."""
+    workdir = None
+    src = args.src
+    if src is None:
+        workdir = tempfile.mkdtemp(prefix='bench_memory_')
+        src = os.path.join(workdir, 'synthetic.csv')
+        _synthetic_csv(src, args.days)
+    try:
+        print(f'{src}: {os.path.getsize(src) / 1048576:.1f} MB')
+        results = {}
+        for name, job in (('tuple', _load_tuples), ('Series', _load_series)):
+            peak, elapsed, result = results[name] = _measure(job, src)
+            print(f'{name:>6}: picco RSS +{peak / 1024:.1f} MB, {elapsed:.2f} s '
+                  f'({result[0]} letture, p98 positivi {result[1]:g})')
+        if results['tuple'][0] > 0:
+            print(f"Riduzione del picco RSS: {100 * (1 - results['Series'][0] / results['tuple'][0]):.0f}%")
+    finally:
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def cmd_query(args):
+    """Stampa le letture (o gli aggregati per bucket) della serie nell'intervallo."""
+    start = datetime.strptime(args.start, '%Y-%m-%d') if args.start else None
+    end = datetime.strptime(args.end, '%Y-%m-%d') if args.end else None
+    if not args.agg:
+        for ts, value in data_store.query(args.src, start, end):
+            print(f'{ts:%Y-%m-%d %H:%M},{value}')
+        return
+    print(','.join(['bucket'] + args.agg))
+    for ts, stats in data_store.query(args.src, start, end, args.bucket, args.agg):
+        print(','.join([f'{ts:%Y-%m-%d %H:%M}'] + [f'{stats[name]:g}' for name in args.agg]))
+
+
+def cmd_quality(args):
+    """Stampa conteggi per flag di qualita e finestre di disservizio della serie."""
+    start = datetime.strptime(args.start, '%Y-%m-%d') if args.start else None
+    end = datetime.strptime(args.end, '%Y-%m-%d') if args.end else None
+    counts = {}
+    for _ts, name in data_store.iter_quality_flags(args.src, start, end):
+        counts[name] = counts.get(name, 0) + 1
+    if not counts:
+        print(f'{args.src}: nessuna lettura con flag di qualita')
+        return
+    print(f'{args.src}: ' + ', '.join(f'{name} {count}' for name, count in sorted(counts.items())))
+    for window in data_store.outage_windows(args.src, start, end):
+        minutes = (window['end'] - window['start']).total_seconds() / 60
+        print(f"{window['start']:%Y-%m-%d %H:%M} -> {window['end']:%Y-%m-%d %H:%M} "
+              f"({minutes:.0f} min): {window['readings']} letture, "
+              f"{window['failed']} failed, {window['stale']} stale")
+
+
+def cmd_tiers(args):
+    """Ricostruisce i livelli consolidati (config.TIERS) dall'intera serie, archivio incluso."""
+    written = data_store.rebuild_tiers(args.src)
+    print(f'Livelli consolidati di {args.src}: ' +
+          ', '.join(f'{name} {count} intervalli' for name, count in written.items()))
+
+
+def _print_timing(timing):
+    if 'serial' in timing:
+        print(f"Seriale {timing['serial']:.2f} s, parallelo {timing['parallel']:.2f} s con "
+              f"{timing['workers']} processi: speedup {timing['speedup']:.1f}x")
+    else:
+        print(f"Scansione parallela in {timing['parallel']:.2f} s con {timing['workers']} processi")
+
+
+def cmd_rebuild(args):
+    """Ricostruisce indice giorni, sketch e rollup della serie con una scansione parallela."""
+    result = data_store.rebuild_indexes(args.src, args.workers, args.compare)
+    print(f"{result['rows']} letture scansionate: indice di {result['days']} giorni, sketch e "
+          f"{result['rollups']} rollup giornalieri ricostruiti")
+    _print_timing(result['timing'])
+
+
+def cmd_report(args):
+    """Report annuale per mese (archivio incluso) calcolato con una scansione parallela."""
+    report = data_store.yearly_report(args.src, args.year, args.workers, args.compare)
+    print('mese,giorni,letture,media,min,max,energia,yield_kwh')
+    for month, stats in report['months'] + [(str(args.year), report['year'])]:
+        if not stats['count']:
+            continue
+        measured = f"{stats['yield_kwh']:.2f}" if stats['yield_kwh'] is not None else ''
+        print(f"{month},{stats['days']},{stats['count']},{stats['mean']:.1f},{stats['min']:g},"
+              f"{stats['max']:g},{stats['energy']:.1f},{measured}")
+    print('Percentili dei valori positivi: ' +
+          ', '.join(f'{name} {value:g}' for name, value in report['percentiles'].items()))
+    _print_timing(report['timing'])
+
+
+def cmd_history(args):
+    """Statistiche giornaliere dei giorni conclusi lette dai rollup (materializzati se mancano)."""
+    start = datetime.strptime(args.start, '%Y-%m-%d').date()
+    end = datetime.strptime(args.end, '%Y-%m-%d').date() if args.end else datetime.now().date()
+    print('giorno,letture,media,min,max,energia')
+    for day, stats in data_store.read_daily_rollups(args.src, start, end):
+        print(f"{day},{stats['count']},{stats['mean']:.1f},{stats['min']:g},{stats['max']:g},"
+              f"{stats['energy']:.1f}")
+
+
+def cmd_chart_parity(args):
+    """Confronta medie e livelli del grafico giornaliero dei percorsi NumPy e Python sugli ultimi giorni."""
+    today = datetime.now().date()
+    days = [today - timedelta(days=offset) for offset in range(args.days)]
+    differences = data_store.chart_parity(args.src, days)
+    for day, numpy_levels, python_levels, numpy_averages, python_averages in differences:
+        print(f'{day}: livelli NumPy {numpy_levels} / Python {python_levels}, '
+              f'medie NumPy {numpy_averages} / Python {python_averages}')
+    print(f'{len(days) - len(differences)}/{len(days)} giorni con livelli identici '
+          f'e medie entro 1e-9 nei due percorsi')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Strumenti storage serie Pi_Inverter_v2')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('csv-to-bin', help='importa un CSV nel formato binario')
+    p.add_argument('src')
+    p.add_argument('dst', nargs='?')
+    p.add_argument('--value-format', choices=['d', 'f'], default=config.BINARY_VALUE_FORMAT)
+    p.set_defaults(func=cmd_csv_to_bin)
+
+    p = sub.add_parser('bin-to-csv', help='esporta un file binario in CSV')
+    p.add_argument('src')
+    p.add_argument('dst')
+    p.set_defaults(func=cmd_bin_to_csv)
+
+    p = sub.add_parser('csv-to-partitions', help='divide un CSV in partizioni mensili')
+    p.add_argument('src')
+    p.set_defaults(func=cmd_csv_to_partitions)
+
+    p = sub.add_parser('archive-to-segments', help='comprime <nome>_archive.csv in segmenti mensili')
+    p.add_argument('src')
+    p.set_defaults(func=cmd_archive_to_segments)
+
+    p = sub.add_parser('csv-to-sqlite', help='importa un CSV nel database SQLite')
+    p.add_argument('src')
+    p.add_argument('--db', default=config.SQLITE_DB)
+    p.set_defaults(func=cmd_csv_to_sqlite)
+
+    p = sub.add_parser('csv-to-wide', help='unisce i CSV delle serie nel file wide multi-canale')
+    p.add_argument('--dst', default=config.WIDE_CSV)
+    p.set_defaults(func=cmd_csv_to_wide)
+
+    p = sub.add_parser('epoch-column', help='aggiunge/rimuove la colonna epoch UTC di un CSV')
+    p.add_argument('src')
+    p.add_argument('--drop', action='store_true', help='rimuove la colonna')
+    p.set_defaults(func=cmd_epoch_column)
+
+    p = sub.add_parser('dedup', help='rimuove le letture duplicate per minuto (CSV, .bin o partizioni)')
+    p.add_argument('src', help='file CSV o wide, file .bin o directory delle partizioni mensili')
+    p.add_argument('--window', type=int, default=10080,
+                   help='righe precedenti in cui cercare il duplicato (10080 = una settimana)')
+    p.set_defaults(func=cmd_dedup)
+
+    p = sub.add_parser('bench', help='confronta latenza di lettura e volume scritto CSV/SQLite')
+    p.add_argument('src')
+    p.add_argument('--days', type=int, default=30, help='giorni letti con day_rows')
+    p.add_argument('--appends', type=int, default=1440, help='letture accodate (1440 = un giorno)')
+    p.set_defaults(func=cmd_bench)
+
+    p = sub.add_parser('bench-memory', help='picco di RSS della serie come tuple/liste e come Series')
+    p.add_argument('--src', help='CSV da caricare (default: file sintetico di --days giorni)')
+    p.add_argument('--days', type=int, default=730, help='giorni del file sintetico (730 = 2 anni)')
+    p.set_defaults(func=cmd_bench_memory)
+
+    p = sub.add_parser('query', help='letture o aggregati per bucket di una serie (archivio incluso)')
+    p.add_argument('src')
+    p.add_argument('--start', help='YYYY-MM-DD incluso')
+    p.add_argument('--end', help='YYYY-MM-DD escluso')
+    p.add_argument('--bucket', help="larghezza bucket: '15m', '1h', '1d' (default: unico bucket)")
+    p.add_argument('--agg', nargs='+', help='mean min max sum count pXX')
+    p.set_defaults(func=cmd_query)
+
+    p = sub.add_parser('quality', help='conteggi dei flag di qualita e finestre di disservizio')
+    p.add_argument('src')
+    p.add_argument('--start', help='YYYY-MM-DD incluso')
+    p.add_argument('--end', help='YYYY-MM-DD escluso')
+    p.set_defaults(func=cmd_quality)
+
+    p = sub.add_parser('rebuild', help='ricostruisce indice giorni, sketch e rollup in parallelo')
+    p.add_argument('src')
+    p.add_argument('--workers', type=int, help='processi (default: PARALLEL_WORKERS o tutti i core)')
+    p.add_argument('--compare', action='store_true', help='misura anche il percorso seriale (speedup)')
+    p.set_defaults(func=cmd_rebuild)
+
+    p = sub.add_parser('tiers', help='ricostruisce i livelli consolidati 15m/1h dalla serie')
+    p.add_argument('src')
+    p.set_defaults(func=cmd_tiers)
+
+    p = sub.add_parser('report', help='report annuale per mese calcolato in parallelo')
+    p.add_argument('src')
+    p.add_argument('--year', type=int, required=True)
+    p.add_argument('--workers', type=int, help='processi (default: PARALLEL_WORKERS o tutti i core)')
+    p.add_argument('--compare', action='store_true', help='misura anche il percorso seriale (speedup)')
+    p.set_defaults(func=cmd_report)
+
+    p = sub.add_parser('history', help='statistiche giornaliere dai rollup dei giorni conclusi')
+    p.add_argument('src')
+    p.add_argument('--start', required=True, help='YYYY-MM-DD incluso')
+    p.add_argument('--end', help='YYYY-MM-DD incluso (default: ieri)')
+    p.set_defaults(func=cmd_history)
+
+    p = sub.add_parser('chart-parity', help='confronta il grafico giornaliero NumPy e Python puro')
+    p.add_argument('src')
+    p.add_argument('--days', type=int, default=30, help='giorni da confrontare, fino a oggi')
+    p.set_defaults(func=cmd_chart_parity)
+
+    args = parser.parse_args(argv)
+    try:
+        args.func(args)
+    except Exception as e:
+        print(f'Errore: {e}')
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Verifiche di una data sui dati registrati localmente dal servizio (CSV della
+potenza solare e storico del daily yield), condivise dagli script
+stand_alone_check_specific_date*.py.
+"""
+
+import os
+import sys
+from datetime import datetime, timedelta
+
+# Interrogazione delle serie condivisa con Pi_Inverter_v2 (stesso motore di storage del servizio)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Pi_Inverter_v2 import config
+from Pi_Inverter_v2.core import data_store
+
+# Serie locale con le letture della potenza solare (una riga al minuto)
+LOCAL_CSV = config.SOLAR_CSV
+
+# Storico del daily yield (valore finale del registro 32114 per ogni giorno)
+YIELD_HISTORY_CSV = config.DAILY_YIELD_HISTORY_CSV
+
+
+def check_local_csv(target_date_str="2025-03-14"):
+    """
+    Stima l'energia prodotta nella data indicata (kWh) dai dati locali.
+    Per un giorno concluso legge il rollup giornaliero (read_daily_rollups,
+    materializzato se manca); per oggi le letture del giorno con
+    data_store.query (limiti di tempo passati al motore, archivio compreso).
+    Le letture STALE/FAILED sono scartate.
+    """
+    target_date = datetime.strptime(target_date_str, "%Y-%m-%d").date()
+
+    daily = data_store.read_daily_rollups(LOCAL_CSV, target_date, target_date)
+    if daily:
+        stats = daily[0][1]
+        count, peak, positive_sum = stats['count'], stats['max'], stats['pos_sum']
+        source = "rollup"
+    else:
+        count = 0
+        peak = None
+        positive_sum = 0.0
+        for _, power in data_store.query(LOCAL_CSV, target_date, target_date + timedelta(days=1)):
+            count += 1
+            if peak is None or power > peak:
+                peak = power
+            if power > 0:
+                positive_sum += power
+        source = "letture"
+
+    if not count:
+        print(f"Nessuna lettura nel CSV locale per il {target_date_str}")
+        return None
+
+    # Una lettura ogni POLL_INTERVAL secondi: W * intervallo = Wh
+    energy_kwh = positive_sum * config.POLL_INTERVAL / 3600.0 / 1000.0
+    print(f"CSV locale {target_date_str} ({source}): {count} letture, picco {peak:.0f} W, "
+          f"energia stimata {energy_kwh:.2f} kWh")
+    return energy_kwh
+
+
+def check_yield_history(target_date_str="2025-03-14"):
+    """
+    Cerca la data nello storico del daily yield registrato dal servizio
+    (data_store.read_daily_yields): risposta immediata, senza interrogare l'inverter.
+    """
+    target_date = datetime.strptime(target_date_str, "%Y-%m-%d").date()
+    records = data_store.read_daily_yields(target_date, target_date)
+    if not records:
+        print(f"Nessun daily yield registrato per il {target_date_str} in {YIELD_HISTORY_CSV}")
+        return None
+    record = records[0]
+    print(f"Storico daily yield {target_date_str}: {record.energy_kwh:.2f} kWh "
+          f"(letto {record.read_at}, fonte {record.source})")
+    return record.energy_kwh
@@ -5,6 +5,9 @@ from pymodbus.client import ModbusTcpClient
 import time
 from datetime import datetime, timedelta
 
+# Verifiche sui dati registrati localmente (CSV della potenza, storico del daily yield)
+from local_history import check_local_csv, check_yield_history
+
 # Configurazione dell'inverter
 INVERTER_IP = "192.168.1.11"  # indirizzo inverter
 MODBUS_PORT = 502             # porta standard Modbus TCP
@@ -132,6 +135,9 @@ def query_historical_data(target_date_str="2025-03-14"):
 def main():
     print("Verifica della produzione del 14 marzo 2025 direttamente dall'inverter")
     print(f"Inverter IP: {INVERTER_IP}, Porta: {MODBUS_PORT}")
+
+    # Valore registrato dal servizio, se disponibile
+    check_yield_history("2025-03-14")
     
     # Leggi l'energia giornaliera attuale
     daily_energy = query_register(DAILY_ENERGY_REGISTER, DAILY_ENERGY_COUNT, "energia giornaliera attuale")
@@ -155,6 +161,9 @@ def main():
     
     # Tenta comunque di leggere i dati storici (funzione sperimentale)
     query_historical_data("2025-03-14")
+
+    # Stima dai log locali (lettura diretta del giorno tramite indice)
+    check_local_csv("2025-03-14")
     
     print("\nPer ottenere il valore esatto della produzione del 14 marzo 2025, controlla:")
     print("1. Il portale web del produttore dell'inverter")
@@ -5,6 +5,9 @@ from pymodbus.client import ModbusTcpClient
 import time
 from datetime import datetime, timedelta
 
+# Verifiche sui dati registrati localmente (CSV della potenza, storico del daily yield)
+from local_history import check_local_csv, check_yield_history
+
 # Configurazione dell'inverter
 INVERTER_IP = "192.168.1.11"  # indirizzo inverter
 MODBUS_PORT = 502             # porta standard Modbus TCP
@@ -88,6 +91,9 @@ def check_specific_registers():
 def main():
     print("Verifica della produzione del 14 marzo 2025 direttamente dall'inverter")
     print(f"Inverter IP: {INVERTER_IP}, Porta: {MODBUS_PORT}")
+
+    # Valore registrato dal servizio, se disponibile
+    check_yield_history("2025-03-14")
     
     # Leggi l'energia giornaliera attuale
     daily_energy = query_register(DAILY_ENERGY_REGISTER, DAILY_ENERGY_COUNT, "energia giornaliera attuale")
@@ -112,6 +118,9 @@ def main():
         else:
             print(f"{name}: {value}")
     
+    print("\nStima dai log locali:")
+    check_local_csv("2025-03-14")
+
     print("\nConclusione:")
     print("Gli inverter Huawei SUN2000 non memorizzano dati storici dettagliati accessibili via Modbus.")
     print("Il registro dell'energia giornaliera (32114) contiene solo il valore del giorno corrente.")